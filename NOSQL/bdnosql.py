@@ -1,62 +1,404 @@
 import sys
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+import threading
+from decimal import Decimal
+from itertools import islice
 import os
 from dotenv import load_dotenv
 
+# permite importar o pacote comum/ também rodando o script direto (python NOSQL/bdnosql.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from comum import relatorios
+from comum.cache import CacheLeitura, CacheLRU
+from comum.consulta import CAMPOS, para_mongo
+from comum.inicializacao import ModuloPreguicoso
+from comum.registros import Endereco, Produto, Usuario
+from comum.resiliencia import CircuitoAberto, Disjuntor, Retentativa, classe_circuito_aberto
+
+# o pymongo só é importado ao conectar (ver comum/inicializacao.py)
+pymongo = ModuloPreguicoso("pymongo")
+
 load_dotenv()  # carrega as credenciais do .env
 MONGO_URI = os.getenv("DB_MONGO_URI")
 
+TAMANHO_LOTE = 1000
+# IDs reservados por $inc no contador (1 = uma ida ao banco por ID, como antes)
+BLOCO_IDS = int(os.getenv("DB_MONGO_BLOCO_IDS", "100"))
+# Cria os índices de INDICES ao conectar (DB_MONGO_INDICES = 0 desliga)
+CRIAR_INDICES = os.getenv("DB_MONGO_INDICES", "1") == "1"
+
+# Índices de cada coleção (além do _id), como argumentos de IndexModel;
+# criar_indices() aplica de forma idempotente
+INDICES = {
+    "usuarios": [
+        {"keys": [("email", 1)], "name": "email_unico", "unique": True}
+    ],
+    "produtos": [
+        {"keys": [("nome", "text")], "name": "nome_texto", "default_language": "portuguese"}
+    ],
+    "enderecos": [
+        {"keys": [("cidade", 1), ("bairro", 1)], "name": "cidade_bairro"},
+        {"keys": [("cep", 1)], "name": "cep"}
+    ]
+}
+# Cache das buscas por chave (DB_CACHE_MAX = 0 desliga)
+CACHE_CONFIG = {
+    "max_itens": int(os.getenv("DB_CACHE_MAX", "1024")),
+    "ttl": float(os.getenv("DB_CACHE_TTL", "30"))
+}
+
+# Retry com backoff (DB_RETRY_TENTATIVAS = 1 desliga) e disjuntor, que depois de
+# DB_DISJUNTOR_FALHAS falhas de conexão seguidas recusa tudo por DB_DISJUNTOR_ABERTO_S segundos
+RESILIENCIA_CONFIG = {
+    "tentativas": int(os.getenv("DB_RETRY_TENTATIVAS", "3")),
+    "base_ms": float(os.getenv("DB_RETRY_BASE_MS", "50")),
+    "teto_ms": float(os.getenv("DB_RETRY_TETO_MS", "2000")),
+    "falhas_para_abrir": int(os.getenv("DB_DISJUNTOR_FALHAS", "5")),
+    "aberto_s": float(os.getenv("DB_DISJUNTOR_ABERTO_S", "10"))
+}
+
+_MANTER = object()  # argumento não informado (diferente de None, que apaga o campo)
+
+
+def _falha_de_conexao(erro):
+    """Rede caiu, failover em andamento ou servidor fora (não erro de escrita/consulta)"""
+    if isinstance(erro, CircuitoAberto):
+        return False
+    return (isinstance(erro, pymongo.errors.ConnectionFailure)
+            or (isinstance(erro, pymongo.errors.PyMongoError) and erro.has_error_label("RetryableWriteError")))
+
+
+def _circuito_aberto(mensagem):
+    return classe_circuito_aberto(pymongo.errors.ConnectionFailure)(mensagem)
+
+
+def _em_lotes(itens, tamanho):
+    """Quebra um iterável em listas de até `tamanho` itens, junto com o índice inicial"""
+    itens = iter(itens)
+    inicio = 0
+    while True:
+        lote = list(islice(itens, tamanho))
+        if not lote:
+            return
+        yield inicio, lote
+        inicio += len(lote)
+
+
+class AlocadorSequencia:
+    """Alocador hi/lo de IDs sequenciais.
+
+    Cada ida ao banco reserva um bloco de IDs com um único $inc atômico em
+    `counters`; os IDs do bloco são entregues localmente. Como os blocos de
+    processos diferentes nunca se sobrepõem, não há IDs repetidos. IDs não
+    usados de um bloco viram lacunas na sequência quando o processo termina.
+    """
+
+    def __init__(self, reservar, tamanho_bloco=BLOCO_IDS):
+        self._reservar = reservar  # reservar(colecao, quantidade) -> primeiro ID ou None
+        self.tamanho_bloco = max(1, tamanho_bloco)
+        self._blocos = {}  # colecao -> [proximo, limite]
+        self._lock = threading.Lock()
+
+    def proximo(self, colecao):
+        ids = self.proximos(colecao, 1)
+        return ids[0] if ids else None
+
+    def proximos(self, colecao, quantidade):
+        """Devolve `quantidade` IDs (ou None se não foi possível reservar)"""
+        with self._lock:
+            proximo, limite = self._blocos.get(colecao, (0, 0))
+            ids = list(range(proximo, min(limite, proximo + quantidade)))
+            faltam = quantidade - len(ids)
+            if faltam > 0:
+                tamanho = max(self.tamanho_bloco, faltam)
+                primeiro = self._reservar(colecao, tamanho)
+                if primeiro is None:
+                    return None
+                ids.extend(range(primeiro, primeiro + faltam))
+                proximo, limite = primeiro + faltam, primeiro + tamanho
+            else:
+                proximo += quantidade
+            self._blocos[colecao] = (proximo, limite)
+            return ids
+
+
 class MongoManager:
-    def __init__(self, uri):
-        self.cliente = None
-        self.banco = None
+    def __init__(self, uri, bloco_ids=BLOCO_IDS, cache=None, cliente=None, criar_indices=CRIAR_INDICES,
+                 resiliencia=RESILIENCIA_CONFIG):
+        """Não conecta aqui: cliente, ping e índices ficam para o primeiro uso de
+        `banco` (ou para conectar()). `cliente` permite passar um cliente pronto
+        (ex. mongomock.MongoClient() em benchmarks)"""
+        self.uri = uri
+        self._cliente = cliente
+        self._banco = None
+        self._criar_indices = criar_indices
+        self._lock_conexao = threading.Lock()
+        self.cache = cache if cache is not None else CacheLeitura(CacheLRU(**CACHE_CONFIG))
+        self.ids = AlocadorSequencia(self.reservar_sequencia, bloco_ids)
+        self._local = threading.local()
+        resiliencia = resiliencia or {}
+        self.retentativa = Retentativa(resiliencia.get("tentativas", 1), resiliencia.get("base_ms", 50),
+                                       resiliencia.get("teto_ms", 2000))
+        # o pool do MongoClient já descarta conexões quebradas e acompanha o failover
+        # do replica set sozinho; o disjuntor só evita esperar timeout com o banco fora
+        self.disjuntor = Disjuntor(resiliencia.get("falhas_para_abrir", 0), resiliencia.get("aberto_s", 10),
+                                   excecao=_circuito_aberto,
+                                   ao_abrir=lambda: print("Erro: MongoDB indisponível, operações recusadas por enquanto"))
+
+    def conectar(self):
+        """Conecta e faz o ping agora, para falhar cedo se o MongoDB estiver fora;
+        devolve o próprio manager"""
         try:
-            self.cliente = MongoClient(uri)
-            self.cliente.admin.command('ping')
-            self.banco = self.cliente.sistema
+            self._abrir()
             print("Conectado ao MongoDB com sucesso!")
-        except ConnectionFailure:
+        except pymongo.errors.ConnectionFailure:
             print("Erro: Não foi possível conectar ao MongoDB", file=sys.stderr)
-            sys.exit(1)
+            raise
+        return self
+
+    def _abrir(self):
+        with self._lock_conexao:
+            if self._banco is not None:
+                return
+            if self._cliente is None:
+                self._cliente = pymongo.MongoClient(self.uri)
+            self._cliente.admin.command('ping')
+            self._banco = self._cliente.sistema
+            if self._criar_indices:
+                self.criar_indices()
+
+    @property
+    def cliente(self):
+        if self._banco is None:
+            self._abrir()
+        return self._cliente
+
+    @property
+    def banco(self):
+        if self._banco is None:
+            self._abrir()
+        return self._banco
+
+    def criar_indices(self):
+        """Aplica INDICES; índices que já existem com a mesma definição não mudam nada.
+        Devolve {coleção: nomes dos índices}"""
+        aplicados = {}
+        for nome_colecao, indices in INDICES.items():
+            try:
+                modelos = [pymongo.IndexModel(**indice) for indice in indices]
+                aplicados[nome_colecao] = self.banco[nome_colecao].create_indexes(modelos)
+            except pymongo.errors.OperationFailure as e:
+                # ex.: e-mails repetidos impedem o índice único
+                print(f"Erro ao criar índices de {nome_colecao}: {e}")
+        return aplicados
+
+    def explicar(self, nome_colecao, filtro, sort=None):
+        """Roda explain (executionStats) de um find e mostra plano, índice usado e docs examinados"""
+        comando = {"find": nome_colecao, "filter": filtro}
+        if sort:
+            comando["sort"] = sort
+        explain = self.banco.command("explain", comando, verbosity="executionStats")
+        estagios, indices = [], []
+
+        def percorrer(plano):
+            if isinstance(plano, dict):
+                if "stage" in plano:
+                    estagios.append(plano["stage"])
+                if "indexName" in plano:
+                    indices.append(plano["indexName"])
+                for valor in plano.values():
+                    percorrer(valor)
+            elif isinstance(plano, list):
+                for item in plano:
+                    percorrer(item)
+
+        percorrer(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        stats = explain.get("executionStats", {})
+        print(f"Plano: {' <- '.join(estagios) or '?'}; índice: {', '.join(indices) or 'nenhum (COLLSCAN)'}; "
+              f"chaves examinadas: {stats.get('totalKeysExamined')}, "
+              f"documentos examinados: {stats.get('totalDocsExamined')}, retornados: {stats.get('nReturned')}")
+        return explain
 
     def fechar_conexao(self):
-        if self.cliente:
-            self.cliente.close()
+        if self._cliente:
+            self._cliente.close()
+            self._cliente = None
+            self._banco = None
             print("Conexão fechada")
 
+    def _erro(self, erro, mensagem):
+        """Guarda a exceção da operação (ver ultimo_erro) e avisa o usuário"""
+        self._local.erro = erro
+        print(mensagem)
+
+    @property
+    def ultimo_erro(self):
+        """Exceção da última operação que falhou nesta thread"""
+        return getattr(self._local, "erro", None)
+
+    def _rodar(self, operacao, idempotente=True):
+        """Executa operacao() passando pelo disjuntor. Se for idempotente, falhas de
+        conexão são repetidas com backoff (além do retry único que o pymongo já faz);
+        inserts não são repetidos porque a primeira tentativa pode ter gravado."""
+        def tentativa():
+            with self.disjuntor.protegendo(_falha_de_conexao):
+                return operacao()
+        return self.retentativa.executar(tentativa, lambda erro: idempotente and _falha_de_conexao(erro))
+
     def get_next_sequence(self, collection_name):
         """Obtém o próximo ID sequencial para uma coleção"""
+        return self.ids.proximo(collection_name)
+
+    def reservar_sequencia(self, collection_name, quantidade):
+        """Reserva `quantidade` IDs de uma vez e devolve o primeiro deles"""
         try:
-            counter = self.banco.counters.find_one_and_update(
+            # repetir um $inc que chegou a gravar só deixa uma lacuna na sequência
+            counter = self._rodar(lambda: self.banco.counters.find_one_and_update(
                 {'_id': collection_name},
-                {'$inc': {'seq': 1}},
+                {'$inc': {'seq': quantidade}},
                 upsert=True,
-                return_document=True
-            )
-            return counter['seq']
+                return_document=pymongo.ReturnDocument.AFTER
+            ))
+            return counter['seq'] - quantidade + 1
         except Exception as e:
             print(f"Erro ao obter próximo ID sequencial: {e}")
             return None
 
+    def reservar_ids(self, colecao, quantidade):
+        """Lista com `quantidade` IDs novos da coleção (None se não foi possível reservar)"""
+        return self.ids.proximos(colecao, quantidade)
+
+    def ajustar_sequencia(self, colecao, minimo):
+        """Garante que o contador não entregue IDs até `minimo`, já usados por outro gerador"""
+        self._rodar(lambda: self.banco.counters.update_one({"_id": colecao}, {"$max": {"seq": minimo}},
+                                                           upsert=True))
+
+    def aplicar_estado(self, entidade, chave, registro):
+        """Deixa o documento `chave` igual a `registro` ({campo lógico: valor}, ver
+        comum/consulta.py), ou o remove se `registro` é None. Idempotente; levanta
+        a exceção em caso de erro (usado na reconciliação da escrita dupla)"""
+        colecao = self.banco[entidade]
+        if registro is None:
+            self._rodar(lambda: colecao.delete_one({"_id": chave}))
+        else:
+            # numeric do Postgres chega como Decimal, que o BSON não aceita
+            documento = {CAMPOS[entidade][campo][1]: float(valor) if isinstance(valor, Decimal) else valor
+                         for campo, valor in registro.items()}
+            documento["_id"] = chave
+            self._rodar(lambda: colecao.replace_one({"_id": chave}, documento, upsert=True))
+        self.cache.invalidar(f"mongo:{entidade[:-1]}:{chave}")
+
+    def _inserir_em_lote(self, colecao, documentos, inicio):
+        """insert_many não ordenado; devolve os índices (relativos ao lote) que falharam"""
+        falhas = []
+        try:
+            self._rodar(lambda: colecao.insert_many(documentos, ordered=False), idempotente=False)
+        except pymongo.errors.BulkWriteError as e:
+            for erro in e.details.get("writeErrors", []):
+                falhas.append((inicio + erro["index"], erro.get("errmsg")))
+        except Exception as e:
+            falhas = [(inicio + i, str(e)) for i in range(len(documentos))]
+        return falhas
+
+    def _resumo_lote(self, ids, falhas):
+        falhos = {indice for indice, _ in falhas}
+        ids = [None if i in falhos else id_ for i, id_ in enumerate(ids)]
+        print(f"{len(ids) - len(falhos)} documento(s) criado(s) com sucesso!")
+        if falhas:
+            print(f"Erro em {len(falhos)} documento(s)")
+        return ids, sorted(falhas)
+
+    def _criar_em_lote(self, nome_colecao, itens, montar, tamanho_lote, gerar_ids=True):
+        """Monta os documentos e insere em lote, com IDs do alocador ou, sem
+        gerar_ids, com o _id que montar() já põe (o CPF dos usuários). Itens que
+        não montam viram falhas da sua posição, sem parar o lote"""
+        ids, falhas = [], []
+        colecao = self.banco[nome_colecao]
+        for inicio, lote in _em_lotes(itens, tamanho_lote):
+            documentos, posicoes = [], []
+            for i, item in enumerate(lote):
+                try:
+                    documentos.append(montar(*item))
+                    posicoes.append(inicio + i)
+                except (TypeError, ValueError) as e:
+                    falhas.append((inicio + i, str(e)))
+            ids.extend([None] * len(lote))
+            if not documentos:
+                continue
+            if gerar_ids:
+                novos_ids = self.ids.proximos(nome_colecao, len(documentos))
+            else:
+                novos_ids = [documento["_id"] for documento in documentos]
+            if novos_ids is None:
+                falhas.extend((p, "Erro ao gerar ID") for p in posicoes)
+                continue
+            for documento, posicao, novo_id in zip(documentos, posicoes, novos_ids):
+                documento["_id"] = ids[posicao] = novo_id
+            for indice, erro in self._inserir_em_lote(colecao, documentos, 0):
+                falhas.append((posicoes[indice], erro))
+        return self._resumo_lote(ids, falhas)
+
+    def _iterar(self, colecao, limit, after, tamanho_lote, registro):
+        """Lê em streaming com paginação por _id ({_id: {$gt: after}} ordenado por _id).
+
+        A projeção traz só os campos do registro, então campos extras que o
+        documento tenha nem saem do servidor nem são decodificados."""
+        filtro = {} if after is None else {"_id": {"$gt": after}}
+        with self.disjuntor.protegendo(_falha_de_conexao):
+            cursor = colecao.find(filtro, registro.PROJECAO).sort("_id", 1).batch_size(tamanho_lote)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            try:
+                yield from map(registro.de_documento, cursor)
+            finally:
+                cursor.close()
+
+    def _ler(self, abrir, registro):
+        """Gera registros do cursor de abrir() em streaming. A primeira leva passa por
+        _rodar (retry e disjuntor, reabrindo o cursor); as seguintes só pelo
+        disjuntor, porque repetir no meio entregaria documentos de novo"""
+        def primeira_leva():
+            cursor = abrir()
+            return cursor, next(cursor, None)
+        cursor, primeiro = self._rodar(primeira_leva)
+        with self.disjuntor.protegendo(_falha_de_conexao):
+            try:
+                if primeiro is not None:
+                    yield registro.de_documento(primeiro)
+                    yield from map(registro.de_documento, cursor)
+            finally:
+                cursor.close()
+
+    def _buscar_um(self, colecao, chave, registro):
+        documento = self._rodar(lambda: colecao.find_one({"_id": chave}, registro.PROJECAO))
+        return None if documento is None else registro.de_documento(documento)
+
     def criar_usuario(self, cpf, nome, email):
         try:
-            self.banco.usuarios.insert_one({"_id": cpf, "nome": nome, "email": email})
+            self._rodar(lambda: self.banco.usuarios.insert_one({"_id": cpf, "nome": nome, "email": email}),
+                        idempotente=False)
             print("Usuário criado com sucesso!")
+            return cpf
         except Exception as e:
-            print(f"Erro ao criar usuário: {e}")
+            self._erro(e, f"Erro ao criar usuário: {e}")
+
+    def iterar_usuarios(self, limit=None, after=None, tamanho_lote=TAMANHO_LOTE):
+        """Gera Usuario em ordem de CPF, começando depois de `after`"""
+        return self._iterar(self.banco.usuarios, limit, after, tamanho_lote, Usuario)
+
+    def get_usuario(self, cpf):
+        """Busca o Usuario pelo CPF, passando pelo cache; None se não existir"""
+        return self.cache.obter(f"mongo:usuario:{cpf}", lambda: self._buscar_um(self.banco.usuarios, cpf, Usuario))
 
-    def ler_usuarios(self):
+    def ler_usuarios(self, limit=None, after=None):
         try:
-            usuarios = list(self.banco.usuarios.find())
-            if not usuarios:
+            achou = False
+            for usuario in self.iterar_usuarios(limit, after):
+                achou = True
+                print(f"CPF: {usuario.cpf}, Nome: {usuario.nome}, Email: {usuario.email}")
+            if not achou:
                 print("Nenhum usuário cadastrado.")
-                return
-                
-            for usuario in usuarios:
-                print(f"CPF: {usuario.get('_id')}, Nome: {usuario.get('nome')}, Email: {usuario.get('email')}")
         except Exception as e:
-            print(f"Erro ao ler usuários: {e}")
+            self._erro(e, f"Erro ao ler usuários: {e}")
 
     def atualizar_usuario(self, cpf, novo_nome, novo_email):
         try:
@@ -69,30 +411,38 @@ class MongoManager:
                 print("Nenhuma alteração informada")
                 return
                 
-            result = self.banco.usuarios.update_one({"_id": cpf}, {"$set": aux})
+            result = self._rodar(lambda: self.banco.usuarios.update_one({"_id": cpf}, {"$set": aux}))
             if result.matched_count == 0:
                 print("Usuário não encontrado.")
             elif result.modified_count > 0:
                 print("Usuário atualizado com sucesso!")
             else:
                 print("Nenhuma alteração realizada.")
+            return result.matched_count
         except Exception as e:
-            print(f"Erro ao atualizar usuário: {e}")
+            self._erro(e, f"Erro ao atualizar usuário: {e}")
+        finally:
+            self.cache.invalidar(f"mongo:usuario:{cpf}")
 
     def deletar_usuario(self, cpf):
         try:
-            result = self.banco.usuarios.delete_one({"_id": cpf})
+            result = self._rodar(lambda: self.banco.usuarios.delete_one({"_id": cpf}))
             if result.deleted_count == 0:
                 print("Usuário não encontrado.")
             else:
                 print("Usuário deletado com sucesso!")
+            return result.deleted_count
         except Exception as e:
-            print(f"Erro ao deletar usuário: {e}")
+            self._erro(e, f"Erro ao deletar usuário: {e}")
+        finally:
+            self.cache.invalidar(f"mongo:usuario:{cpf}")
 
-    def criar_produto(self, nome, valor, quantidade):
+    def criar_produto(self, nome, valor, quantidade, id_produto=None):
+        """`id_produto` grava com um ID já reservado (ex. pela escrita dupla)"""
         try:
             # Obter o próximo ID sequencial
-            id_produto = self.get_next_sequence('produtos')
+            if id_produto is None:
+                id_produto = self.get_next_sequence('produtos')
             if id_produto is None:
                 print("Erro ao gerar ID para o produto")
                 return None
@@ -100,68 +450,165 @@ class MongoManager:
             valor = float(valor)
             quantidade = int(quantidade)
             
-            result = self.banco.produtos.insert_one({
+            result = self._rodar(lambda: self.banco.produtos.insert_one({
                 "_id": id_produto,
                 "nome": nome, 
                 "valor": valor, 
                 "quantidade": quantidade
-            })
+            }), idempotente=False)
             print("Produto criado com sucesso!")
             return id_produto
-        except ValueError:
-            print("Erro: Valor ou quantidade inválidos. Certifique-se de usar números.")
+        except ValueError as e:
+            self._erro(e, "Erro: Valor ou quantidade inválidos. Certifique-se de usar números.")
             return None
         except Exception as e:
-            print(f"Erro ao criar produto: {e}")
+            self._erro(e, f"Erro ao criar produto: {e}")
             return None
     
-    def ler_produtos(self):
+    def iterar_produtos(self, limit=None, after=None, tamanho_lote=TAMANHO_LOTE):
+        """Gera Produto em ordem de ID, começando depois de `after`"""
+        return self._iterar(self.banco.produtos, limit, after, tamanho_lote, Produto)
+
+    def get_produto(self, id_produto):
+        """Busca o Produto pelo ID, passando pelo cache"""
+        id_produto = int(id_produto)
+        return self.cache.obter(f"mongo:produto:{id_produto}",
+                                lambda: self._buscar_um(self.banco.produtos, id_produto, Produto))
+
+    def ler_produtos(self, limit=None, after=None):
         try:
-            produtos = list(self.banco.produtos.find())
-            if not produtos:
+            achou = False
+            for produto in self.iterar_produtos(limit, after):
+                achou = True
+                print(f"ID: {produto.id}, Nome: {produto.nome}, Valor: R${produto.valor:.2f}, Quantidade: {produto.quantidade}")
+            if not achou:
                 print("Nenhum produto cadastrado.")
-                return
-                
-            for produto in produtos:
-                print(f"ID: {produto.get('_id')}, Nome: {produto.get('nome')}, Valor: R${produto.get('valor'):.2f}, Quantidade: {produto.get('quantidade')}")
         except Exception as e:
-            print(f"Erro ao ler produtos: {e}")
+            self._erro(e, f"Erro ao ler produtos: {e}")
 
     def atualizar_produto(self, id_produto, novo_valor):
         try:
             # Converter para inteiro
             id_produto = int(id_produto)
-            result = self.banco.produtos.update_one(
+            result = self._rodar(lambda: self.banco.produtos.update_one(
                 {"_id": id_produto},
                 {"$set": {"valor": float(novo_valor)}}
-            )
+            ))
             if result.matched_count == 0:
                 print("Produto não encontrado.")
             else:
                 print("Produto atualizado com sucesso.")
-        except ValueError:
-            print("ID do produto inválido. Deve ser um número inteiro.")
+            return result.matched_count
+        except ValueError as e:
+            self._erro(e, "ID do produto inválido. Deve ser um número inteiro.")
         except Exception as e:
-            print(f"Erro ao atualizar produto: {e}")
+            self._erro(e, f"Erro ao atualizar produto: {e}")
+        finally:
+            self.cache.invalidar(f"mongo:produto:{id_produto}")
             
+    def reservar_estoque(self, id_produto, quantidade):
+        """Baixa `quantidade` do estoque com um $inc condicional (atômico no documento).
+
+        Devolve o estoque restante, ou None se o produto não existe ou não tem
+        estoque suficiente; pedidos concorrentes nunca deixam o estoque negativo."""
+        try:
+            id_produto, quantidade = int(id_produto), int(quantidade)
+            if quantidade <= 0:
+                raise ValueError("quantidade deve ser positiva")
+            documento = self._rodar(lambda: self.banco.produtos.find_one_and_update(
+                {"_id": id_produto, "quantidade": {"$gte": quantidade}},
+                {"$inc": {"quantidade": -quantidade}},
+                projection={"quantidade": 1},
+                return_document=pymongo.ReturnDocument.AFTER
+            ), idempotente=False)
+            if documento is None:
+                print("Estoque insuficiente ou produto não encontrado.")
+                return None
+            return documento["quantidade"]
+        except ValueError as e:
+            self._erro(e, "ID e quantidade devem ser números inteiros positivos.")
+        except Exception as e:
+            self._erro(e, f"Erro ao reservar estoque: {e}")
+        finally:
+            self.cache.invalidar(f"mongo:produto:{id_produto}")
+
+    def reservar_estoques(self, pedidos):
+        """Reserva vários (id_produto, quantidade) de uma vez, tudo ou nada.
+
+        Sem transação (exigiria replica set): cada item é baixado com o $inc
+        condicional, em ordem de ID, e se algum não tiver estoque o que já foi
+        baixado é devolvido. Devolve {id_produto: estoque restante} ou None."""
+        quantidades = {}
+        reservados = {}
+        try:
+            for id_produto, quantidade in pedidos:
+                id_produto = int(id_produto)
+                quantidades[id_produto] = quantidades.get(id_produto, 0) + int(quantidade)
+            if any(quantidade <= 0 for quantidade in quantidades.values()):
+                raise ValueError("quantidade deve ser positiva")
+            for id_produto in sorted(quantidades):
+                documento = self._rodar(lambda: self.banco.produtos.find_one_and_update(
+                    {"_id": id_produto, "quantidade": {"$gte": quantidades[id_produto]}},
+                    {"$inc": {"quantidade": -quantidades[id_produto]}},
+                    projection={"quantidade": 1},
+                    return_document=pymongo.ReturnDocument.AFTER
+                ), idempotente=False)
+                if documento is None:
+                    print(f"Estoque insuficiente ou produto não encontrado: {id_produto}")
+                    self._devolver_estoque(reservados, quantidades)
+                    return None
+                reservados[id_produto] = documento["quantidade"]
+            return reservados
+        except ValueError as e:
+            self._erro(e, "IDs e quantidades devem ser números inteiros positivos.")
+        except Exception as e:
+            self._erro(e, f"Erro ao reservar estoque: {e}")
+            self._devolver_estoque(reservados, quantidades)
+        finally:
+            for id_produto in quantidades:
+                self.cache.invalidar(f"mongo:produto:{id_produto}")
+
+    def _devolver_estoque(self, reservados, quantidades):
+        """Devolve o que foi baixado em `reservados`, uma vez só: o dict é esvaziado
+        antes, porque o $inc não é idempotente. Falhas vão para _erro com os IDs"""
+        ids = list(reservados)
+        reservados.clear()
+        if not ids:
+            return
+        devolucoes = [pymongo.UpdateOne({"_id": id_produto}, {"$inc": {"quantidade": quantidades[id_produto]}})
+                      for id_produto in ids]
+        try:
+            self._rodar(lambda: self.banco.produtos.bulk_write(devolucoes, ordered=False), idempotente=False)
+        except pymongo.errors.BulkWriteError as e:
+            falhas = [ids[erro["index"]] for erro in e.details.get("writeErrors", [])]
+            self._erro(e, f"Erro ao devolver o estoque dos produtos {falhas}: {e}")
+        except Exception as e:
+            # sem resposta do servidor não dá para saber quais $inc foram aplicados
+            self._erro(e, f"Estoque talvez não devolvido dos produtos {ids}: {e}")
+
     def deletar_produto(self, id_produto):
         try:
             # Converter para inteiro
             id_produto = int(id_produto)
-            result = self.banco.produtos.delete_one({"_id": id_produto})
+            result = self._rodar(lambda: self.banco.produtos.delete_one({"_id": id_produto}))
             if result.deleted_count == 0:
                 print("Produto não encontrado.")
             else:
                 print("Produto deletado com sucesso.")
-        except ValueError:
-            print("ID do produto inválido. Deve ser um número inteiro.")
+            return result.deleted_count
+        except ValueError as e:
+            self._erro(e, "ID do produto inválido. Deve ser um número inteiro.")
         except Exception as e:
-            print(f"Erro ao deletar produto: {e}")
+            self._erro(e, f"Erro ao deletar produto: {e}")
+        finally:
+            self.cache.invalidar(f"mongo:produto:{id_produto}")
 
-    def criar_endereco(self, rua, numero, bairro, cidade, cep, complemento):
+    def criar_endereco(self, rua, numero, bairro, cidade, cep, complemento, id_endereco=None):
+        """`id_endereco` grava com um ID já reservado (ex. pela escrita dupla)"""
         try:
             # Obter o próximo ID sequencial
-            id_endereco = self.get_next_sequence('enderecos')
+            if id_endereco is None:
+                id_endereco = self.get_next_sequence('enderecos')
             if id_endereco is None:
                 print("Erro ao gerar ID para o endereço")
                 return None
@@ -175,55 +622,277 @@ class MongoManager:
                 "cep": cep, 
                 "complemento": complemento
             }
-            result = self.banco.enderecos.insert_one(documento)
+            result = self._rodar(lambda: self.banco.enderecos.insert_one(documento), idempotente=False)
             print("Endereço criado com sucesso!")
             return id_endereco
         except Exception as e:
-            print(f"Erro ao criar endereço: {e}")
+            self._erro(e, f"Erro ao criar endereço: {e}")
             return None
 
-    def ler_enderecos(self):
+    def iterar_enderecos(self, limit=None, after=None, tamanho_lote=TAMANHO_LOTE):
+        """Gera Endereco em ordem de ID, começando depois de `after`"""
+        return self._iterar(self.banco.enderecos, limit, after, tamanho_lote, Endereco)
+
+    def get_endereco(self, id_endereco):
+        """Busca o Endereco pelo ID, passando pelo cache"""
+        id_endereco = int(id_endereco)
+        return self.cache.obter(f"mongo:endereco:{id_endereco}",
+                                lambda: self._buscar_um(self.banco.enderecos, id_endereco, Endereco))
+
+    def ler_enderecos(self, limit=None, after=None):
         try:
-            enderecos = list(self.banco.enderecos.find())
-            if not enderecos:
+            achou = False
+            for end in self.iterar_enderecos(limit, after):
+                achou = True
+                print(f"ID: {end.id}, Rua: {end.rua}, N°: {end.numero}, Bairro: {end.bairro}, Cidade: {end.cidade}")
+            if not achou:
                 print("Nenhum endereço cadastrado.")
-                return
-                
-            for end in enderecos:
-                print(f"ID: {end.get('_id')}, Rua: {end.get('rua')}, N°: {end.get('numero')}, Bairro: {end.get('bairro')}, Cidade: {end.get('cidade')}")
         except Exception as e:
-            print(f"Erro ao ler endereços: {e}")
+            self._erro(e, f"Erro ao ler endereços: {e}")
 
-    def atualizar_endereco(self, id_endereco, nova_rua, novo_numero):
+    def atualizar_endereco(self, id_endereco, nova_rua, novo_numero, novo_complemento=_MANTER):
+        """Sem `novo_complemento` o complemento fica como está (None apaga)"""
         try:
             # Converter para inteiro
             id_endereco = int(id_endereco)
-            result = self.banco.enderecos.update_one(
+            alteracao = {"rua": nova_rua, "numero": novo_numero}
+            if novo_complemento is not _MANTER:
+                alteracao["complemento"] = novo_complemento
+            result = self._rodar(lambda: self.banco.enderecos.update_one(
                 {"_id": id_endereco},
-                {"$set": {"rua": nova_rua, "numero": novo_numero}}
-            )
+                {"$set": alteracao}
+            ))
             if result.matched_count == 0:
                 print("Endereço não encontrado.")
             else:
                 print("Endereço atualizado com sucesso.")
-        except ValueError:
-            print("ID do endereço inválido. Deve ser um número inteiro.")
+            return result.matched_count
+        except ValueError as e:
+            self._erro(e, "ID do endereço inválido. Deve ser um número inteiro.")
         except Exception as e:
-            print(f"Erro ao atualizar endereço: {e}")
+            self._erro(e, f"Erro ao atualizar endereço: {e}")
+        finally:
+            self.cache.invalidar(f"mongo:endereco:{id_endereco}")
 
     def deletar_endereco(self, id_endereco):
         try:
             # Converter para inteiro
             id_endereco = int(id_endereco)
-            result = self.banco.enderecos.delete_one({"_id": id_endereco})
+            result = self._rodar(lambda: self.banco.enderecos.delete_one({"_id": id_endereco}))
             if result.deleted_count == 0:
                 print("Endereço não encontrado.")
             else:
                 print("Endereço deletado com sucesso.")
-        except ValueError:
-            print("ID do endereço inválido. Deve ser um número inteiro.")
+            return result.deleted_count
+        except ValueError as e:
+            self._erro(e, "ID do endereço inválido. Deve ser um número inteiro.")
         except Exception as e:
-            print(f"Erro ao deletar endereço: {e}")
+            self._erro(e, f"Erro ao deletar endereço: {e}")
+        finally:
+            self.cache.invalidar(f"mongo:endereco:{id_endereco}")
+
+    def criar_usuarios(self, usuarios, tamanho_lote=TAMANHO_LOTE):
+        """Insere vários (cpf, nome, email); devolve (cpfs, falhas)"""
+        def montar(cpf, nome, email):
+            return {"_id": cpf, "nome": nome, "email": email}
+        return self._criar_em_lote('usuarios', usuarios, montar, tamanho_lote, gerar_ids=False)
+
+    def criar_produtos(self, produtos, tamanho_lote=TAMANHO_LOTE):
+        """Insere vários (nome, valor, quantidade); devolve (ids, falhas)"""
+        def montar(nome, valor, quantidade):
+            return {"nome": nome, "valor": float(valor), "quantidade": int(quantidade)}
+        return self._criar_em_lote('produtos', produtos, montar, tamanho_lote)
+
+    def criar_enderecos(self, enderecos, tamanho_lote=TAMANHO_LOTE):
+        """Insere vários (rua, numero, bairro, cidade, cep, complemento); devolve (ids, falhas)"""
+        def montar(rua, numero, bairro, cidade, cep, complemento):
+            return {"rua": rua, "numero": numero, "bairro": bairro,
+                    "cidade": cidade, "cep": cep, "complemento": complemento}
+        return self._criar_em_lote('enderecos', enderecos, montar, tamanho_lote)
+
+    def find_usuario_por_email(self, email):
+        """Usuário pelo e-mail (índice email_unico); None se não existir"""
+        documento = self._rodar(lambda: self.banco.usuarios.find_one({"email": email}, Usuario.PROJECAO))
+        return None if documento is None else Usuario.de_documento(documento)
+
+    def find_enderecos(self, cidade, bairro=None, limit=None):
+        """Endereco de uma cidade (e bairro), pelo índice cidade_bairro"""
+        filtro = {"cidade": cidade}
+        if bairro is not None:
+            filtro["bairro"] = bairro
+        def abrir():
+            cursor = self.banco.enderecos.find(filtro, Endereco.PROJECAO).batch_size(TAMANHO_LOTE)
+            return cursor if limit is None else cursor.limit(limit)
+        return self._ler(abrir, Endereco)
+
+    def find_enderecos_por_cep(self, cep):
+        return self._ler(lambda: self.banco.enderecos.find({"cep": cep}, Endereco.PROJECAO)
+                         .batch_size(TAMANHO_LOTE), Endereco)
+
+    def buscar_produtos(self, texto, limit=20):
+        """Produto cujo nome casa com o texto (índice nome_texto), dos mais relevantes para os menos"""
+        return self._ler(lambda: self.banco.produtos
+                         .find({"$text": {"$search": texto}}, {**Produto.PROJECAO, "score": {"$meta": "textScore"}})
+                         .sort([("score", {"$meta": "textScore"})])
+                         .limit(limit)
+                         .batch_size(TAMANHO_LOTE), Produto)
+
+    def consultar(self, entidade, consulta, tamanho_lote=TAMANHO_LOTE):
+        """Gera dicts {campo: valor} só com os documentos e campos pedidos na Consulta
+        (comum/consulta.py), filtrados e projetados no servidor"""
+        filtro, projecao, sort, limite, campos = para_mongo(consulta, entidade)
+        nomes = {campo: colunas[1] for campo, colunas in CAMPOS[entidade].items()}
+        with self.disjuntor.protegendo(_falha_de_conexao):
+            cursor = self.banco[entidade].find(filtro, projecao).batch_size(tamanho_lote)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limite is not None:
+                cursor = cursor.limit(limite)
+            try:
+                for documento in cursor:
+                    yield {campo: documento.get(nomes[campo]) for campo in campos}
+            finally:
+                cursor.close()
+
+    def consultar_usuarios(self, consulta):
+        return self.consultar("usuarios", consulta)
+
+    def consultar_produtos(self, consulta):
+        return self.consultar("produtos", consulta)
+
+    def consultar_enderecos(self, consulta):
+        return self.consultar("enderecos", consulta)
+
+    def relatorio(self, entidade, agrupar=(), consulta=None, resumo=False, tamanho_lote=TAMANHO_LOTE):
+        """Gera dicts {campo agrupado..., métrica...} calculados por aggregate() no
+        servidor (ver comum/relatorios.py); com `resumo` lê a coleção de resumo
+        gravada por atualizar_resumos()"""
+        nome_colecao, pipeline, campos = relatorios.para_mongo(entidade, agrupar, consulta, resumo)
+        vazio = True
+        with self.disjuntor.protegendo(_falha_de_conexao):
+            cursor = self.banco[nome_colecao].aggregate(pipeline, batchSize=tamanho_lote, allowDiskUse=True)
+            try:
+                for documento in cursor:
+                    vazio = False
+                    yield {campo: documento.get(campo) for campo in campos}
+            finally:
+                cursor.close()
+        if vazio and not agrupar:
+            # o $group não devolve nada sem documentos; o Postgres devolve a linha com zeros
+            yield dict.fromkeys(campos, 0)
+
+    def relatorio_estoque(self, resumo=False):
+        """{"produtos", "unidades", "valor_estoque"} somando todos os produtos"""
+        return next(self.relatorio("produtos", resumo=resumo))
+
+    def relatorio_enderecos(self, agrupar=("cidade",), consulta=None, resumo=False):
+        """Endereços por cidade (ou por cidade e bairro, com agrupar=("cidade", "bairro"))"""
+        return self.relatorio("enderecos", agrupar, consulta, resumo)
+
+    def atualizar_resumos(self):
+        """Recalcula as coleções de resumo no servidor (um aggregate com $out por
+        entidade; nenhum documento passa pelo cliente). Sem triggers no MongoDB,
+        o resumo vale para o momento da última chamada. Devolve as entidades."""
+        for entidade in relatorios.RESUMOS:
+            pipeline = relatorios.pipeline_resumo(entidade)
+            self._rodar(lambda: list(self.banco[entidade].aggregate(pipeline, allowDiskUse=True)))
+        print("Resumos atualizados")
+        return list(relatorios.RESUMOS)
+
+    def _escrever_em_lote(self, nome_colecao, itens, montar, tamanho_lote):
+        """Monta (chave, operação) para cada item e envia em bulk_write não ordenado.
+
+        O bulk_write só devolve totais, então antes de cada lote um find com $in
+        descobre quais chaves existem (uma ida ao banco por lote, não por item).
+        Devolve {"matched", "modified", "deleted", "encontrados": {chave: bool}, "falhas"}."""
+        colecao = self.banco[nome_colecao]
+        resumo = {"matched": 0, "modified": 0, "deleted": 0, "encontrados": {}, "falhas": []}
+        for inicio, lote in _em_lotes(itens, tamanho_lote):
+            chaves, operacoes, posicoes = [], [], []
+            for i, item in enumerate(lote):
+                try:
+                    chave, operacao = montar(item)
+                except (TypeError, ValueError) as e:
+                    resumo["falhas"].append((inicio + i, str(e)))
+                    continue
+                chaves.append(chave)
+                operacoes.append(operacao)
+                posicoes.append(inicio + i)
+            if not operacoes:
+                continue
+            try:
+                existentes = self._rodar(
+                    lambda: {doc["_id"] for doc in colecao.find({"_id": {"$in": chaves}}, {"_id": 1})})
+                try:
+                    # $set e delete por chave: repetir o lote inteiro dá o mesmo resultado
+                    result = self._rodar(lambda: colecao.bulk_write(operacoes, ordered=False))
+                    detalhes = result.bulk_api_result
+                except pymongo.errors.BulkWriteError as e:
+                    detalhes = e.details
+                    for erro in detalhes.get("writeErrors", []):
+                        resumo["falhas"].append((posicoes[erro["index"]], erro.get("errmsg")))
+                resumo["matched"] += detalhes.get("nMatched", 0)
+                resumo["modified"] += detalhes.get("nModified", 0)
+                resumo["deleted"] += detalhes.get("nRemoved", 0)
+                for chave in chaves:
+                    resumo["encontrados"][chave] = chave in existentes
+            except Exception as e:
+                resumo["falhas"].extend((posicao, str(e)) for posicao in posicoes)
+            finally:
+                for chave in chaves:
+                    self.cache.invalidar(f"mongo:{nome_colecao[:-1]}:{chave}")
+        encontrados = sum(resumo["encontrados"].values())
+        print(f"Encontrados: {encontrados}, alterados: {resumo['modified']}, deletados: {resumo['deleted']}")
+        if resumo["falhas"]:
+            resumo["falhas"].sort()
+            print(f"Erro em {len(resumo['falhas'])} operação(ões)")
+        return resumo
+
+    def atualizar_usuarios(self, alteracoes, tamanho_lote=TAMANHO_LOTE):
+        """Atualiza vários (cpf, novo_nome, novo_email) num bulk_write; None mantém o campo"""
+        def montar(item):
+            cpf, novo_nome, novo_email = item
+            aux = {}
+            if novo_nome:
+                aux['nome'] = novo_nome
+            if novo_email:
+                aux['email'] = novo_email
+            if not aux:
+                raise ValueError("Nenhuma alteração informada")
+            return cpf, pymongo.UpdateOne({"_id": cpf}, {"$set": aux})
+        return self._escrever_em_lote('usuarios', alteracoes, montar, tamanho_lote)
+
+    def deletar_usuarios(self, cpfs, tamanho_lote=TAMANHO_LOTE):
+        return self._escrever_em_lote('usuarios', cpfs,
+                                      lambda cpf: (cpf, pymongo.DeleteOne({"_id": cpf})), tamanho_lote)
+
+    def atualizar_produtos(self, alteracoes, tamanho_lote=TAMANHO_LOTE):
+        """Atualiza o valor de vários (id_produto, novo_valor) num bulk_write"""
+        def montar(item):
+            id_produto, novo_valor = int(item[0]), float(item[1])
+            return id_produto, pymongo.UpdateOne({"_id": id_produto}, {"$set": {"valor": novo_valor}})
+        return self._escrever_em_lote('produtos', alteracoes, montar, tamanho_lote)
+
+    def deletar_produtos(self, ids, tamanho_lote=TAMANHO_LOTE):
+        def montar(id_produto):
+            id_produto = int(id_produto)
+            return id_produto, pymongo.DeleteOne({"_id": id_produto})
+        return self._escrever_em_lote('produtos', ids, montar, tamanho_lote)
+
+    def atualizar_enderecos(self, alteracoes, tamanho_lote=TAMANHO_LOTE):
+        """Atualiza vários (id_endereco, nova_rua, novo_numero) num bulk_write"""
+        def montar(item):
+            id_endereco, nova_rua, novo_numero = item
+            id_endereco = int(id_endereco)
+            return id_endereco, pymongo.UpdateOne({"_id": id_endereco},
+                                          {"$set": {"rua": nova_rua, "numero": novo_numero}})
+        return self._escrever_em_lote('enderecos', alteracoes, montar, tamanho_lote)
+
+    def deletar_enderecos(self, ids, tamanho_lote=TAMANHO_LOTE):
+        def montar(id_endereco):
+            id_endereco = int(id_endereco)
+            return id_endereco, pymongo.DeleteOne({"_id": id_endereco})
+        return self._escrever_em_lote('enderecos', ids, montar, tamanho_lote)
 
 # Menus foram gerados com auxílio de IA para ficarem mais bonitos e de fácil usabilidade
 def menu_endereco(mongo_manager):
@@ -351,13 +1020,36 @@ def menu_mongo(mongo_manager):
             print("Opção inválida.")
 
 def main():
+    if sys.argv[1:] == ["resumos"]:
+        mongo_manager = MongoManager(MONGO_URI, criar_indices=False)
+        mongo_manager.atualizar_resumos()
+        mongo_manager.fechar_conexao()
+        return
+    if sys.argv[1:] == ["indices"]:
+        mongo_manager = MongoManager(MONGO_URI, criar_indices=False)
+        for nome_colecao, nomes in mongo_manager.criar_indices().items():
+            print(f"Índices de {nome_colecao}: {', '.join(nomes)}")
+        mongo_manager.fechar_conexao()
+        return
+    if len(sys.argv) > 1:
+        # modo não interativo, ex.: produtos import produtos.csv (ver cli.py)
+        from cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:], backend="mongo"))
     mongo_manager = None
+    snapshot = None
     try:
         mongo_manager = MongoManager(MONGO_URI)
+        mongo_manager.conectar()
+        from comum.metricas import configurar_pelo_ambiente
+        snapshot = configurar_pelo_ambiente(mongo_manager, "mongo")
         menu_mongo(mongo_manager)
+    except pymongo.errors.ConnectionFailure:
+        sys.exit(1)
     except Exception as e:
         print(f"Erro inesperado: {e}")
     finally:
+        if snapshot:
+            snapshot.parar()
         if mongo_manager:
             mongo_manager.fechar_conexao()
     print("Programa encerrado")
@@ -3,11 +3,27 @@
 # pip install psycopg2-binary
 
 
-import psycopg2
+import io
 import sys
+from itertools import count, islice, starmap
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+# permite importar o pacote comum/ também rodando o script direto (python SQL/bd.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from comum import relatorios
+from comum.cache import CacheLeitura, CacheLRU
+from comum.consulta import CAMPOS, TABELAS, para_sql
+from comum.inicializacao import ModuloPreguicoso
+from comum.registros import Endereco, Produto, Usuario
+from comum.resiliencia import CircuitoAberto, Disjuntor, Retentativa, classe_circuito_aberto
+
+# o psycopg2 só é importado na primeira conexão (ver comum/inicializacao.py)
+psycopg2 = ModuloPreguicoso("psycopg2")
+
 load_dotenv()  # carrega as credenciais do .env
 
 DB_CONFIG = {
@@ -18,172 +34,1244 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT")
 }
 
+# Pool de conexões (DB_POOL_MAX = 0 mantém uma conexão única)
+POOL_CONFIG = {
+    "minconn": int(os.getenv("DB_POOL_MIN", "1")),
+    "maxconn": int(os.getenv("DB_POOL_MAX", "0")),
+    "ping": os.getenv("DB_POOL_PING", "0") == "1"
+}
+
+# Cache das buscas por chave (DB_CACHE_MAX = 0 desliga)
+CACHE_CONFIG = {
+    "max_itens": int(os.getenv("DB_CACHE_MAX", "1024")),
+    "ttl": float(os.getenv("DB_CACHE_TTL", "30"))
+}
+
+# Group commit: junta até DB_GROUP_COMMIT_OPS operações ou DB_GROUP_COMMIT_MS ms
+# num único COMMIT (DB_GROUP_COMMIT_OPS = 0 desliga, commit a cada operação)
+GROUP_COMMIT_CONFIG = {
+    "max_ops": int(os.getenv("DB_GROUP_COMMIT_OPS", "0")),
+    "max_ms": float(os.getenv("DB_GROUP_COMMIT_MS", "10"))
+}
+
+# Retry com backoff (DB_RETRY_TENTATIVAS = 1 desliga) e disjuntor, que depois de
+# DB_DISJUNTOR_FALHAS falhas de conexão seguidas recusa tudo por DB_DISJUNTOR_ABERTO_S segundos
+RESILIENCIA_CONFIG = {
+    "tentativas": int(os.getenv("DB_RETRY_TENTATIVAS", "3")),
+    "base_ms": float(os.getenv("DB_RETRY_BASE_MS", "50")),
+    "teto_ms": float(os.getenv("DB_RETRY_TETO_MS", "2000")),
+    "falhas_para_abrir": int(os.getenv("DB_DISJUNTOR_FALHAS", "5")),
+    "aberto_s": float(os.getenv("DB_DISJUNTOR_ABERTO_S", "10"))
+}
+
+# Comandos de uma linha vão como PREPARE/EXECUTE (DB_PREPARE = 0 manda o SQL literal)
+PREPARAR = os.getenv("DB_PREPARE", "1") == "1"
+
+TAMANHO_LOTE = 1000
+
+# COPY ... FROM STDIN de cada entidade: tabela (colunas) e como completar a tupla de criar_*
+COPIA = {
+    "usuarios": ("mydb.Usuario (cpf, nome, email, Dados_bancarios_idDados_bancarios)",
+                 lambda linha: (*linha, 1)),
+    "produtos": ("mydb.Produto (nome, valor, quantidade, descricao, porcao_peso)",
+                 lambda linha: (*linha, "N/A", 0)),
+    "enderecos": ("mydb.Endereco (rua, numero, bairo, cidade, cep, complemento)", tuple)
+}
+
+# colunas obrigatórias do Postgres que não vêm do MongoDB, com o valor que criar_* usa
+COLUNAS_EXTRAS = {
+    "usuarios": {"Dados_bancarios_idDados_bancarios": 1},
+    "produtos": {"descricao": "N/A", "porcao_peso": 0}
+}
+
+
+# Escritas de uma linha, usadas pelos criar_*/atualizar_*/deletar_* do
+# PostgresManager e pelo Pipeline. As que têm RETURNING devolvem a chave
+# criada; as outras, quantas linhas foram alteradas
+ESCRITAS = {
+    "criar_usuario": """
+        INSERT INTO mydb.Usuario (cpf, nome, email, Dados_bancarios_idDados_bancarios) 
+        VALUES (%s, %s, %s, 1) RETURNING cpf;
+        """,
+    "atualizar_usuario": "UPDATE mydb.Usuario SET email = %s WHERE cpf = %s;",
+    "deletar_usuario": "DELETE FROM mydb.Usuario WHERE cpf = %s;",
+    "criar_produto": """
+        INSERT INTO mydb.Produto (nome, valor, quantidade, descricao, porcao_peso) 
+        VALUES (%s, %s, %s, 'N/A', 0) RETURNING idProduto;
+        """,
+    "criar_produto_com_id": """
+        INSERT INTO mydb.Produto (idProduto, nome, valor, quantidade, descricao, porcao_peso) 
+        VALUES (%s, %s, %s, %s, 'N/A', 0) RETURNING idProduto;
+        """,
+    "atualizar_produto": "UPDATE mydb.Produto SET valor = %s WHERE idProduto = %s;",
+    "deletar_produto": "DELETE FROM mydb.Produto WHERE idProduto = %s;",
+    "criar_endereco": """
+        INSERT INTO mydb.Endereco (rua, numero, bairo, cidade, cep, complemento) 
+        VALUES (%s, %s, %s, %s, %s, %s) RETURNING idEndereco;
+        """,
+    "criar_endereco_com_id": """
+        INSERT INTO mydb.Endereco (idEndereco, rua, numero, bairo, cidade, cep, complemento) 
+        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING idEndereco;
+        """,
+    "atualizar_endereco": "UPDATE mydb.Endereco SET rua = %s, numero = %s, complemento = %s WHERE idEndereco = %s;",
+    "deletar_endereco": "DELETE FROM mydb.Endereco WHERE idEndereco = %s;"
+}
+
+
+def _sequencia(entidade):
+    """(tabela, coluna) do serial da entidade, para pg_get_serial_sequence"""
+    return TABELAS[entidade], CAMPOS[entidade]["id"][0].lower()
+
+
+def _em_lotes(linhas, tamanho):
+    """Quebra um iterável em listas de até `tamanho` itens, junto com o índice inicial"""
+    linhas = iter(linhas)
+    inicio = 0
+    while True:
+        lote = list(islice(linhas, tamanho))
+        if not lote:
+            return
+        yield inicio, lote
+        inicio += len(lote)
+
+
+def _para_prepare(sql):
+    """Troca os %s do psycopg2 pelos $1, $2... que o PREPARE espera"""
+    partes = sql.strip().rstrip(";").split("%s")
+    return "".join(parte + (f"${i}" if i < len(partes) else "") for i, parte in enumerate(partes, start=1))
+
+
+def _campo_copy(valor):
+    """Valor no formato texto do COPY (\\N é NULL; barra, tab e quebras de linha escapadas)"""
+    if valor is None:
+        return "\\N"
+    return (str(valor).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _falha_de_conexao(erro):
+    """Rede caiu ou banco fora do ar (não erro de SQL, deadlock ou timeout de comando)"""
+    return (isinstance(erro, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            and not isinstance(erro, (psycopg2.extensions.TransactionRollbackError,
+                                      psycopg2.extensions.QueryCanceledError, CircuitoAberto)))
+
+
+def _pode_repetir(erro, idempotente):
+    # deadlock/conflito de serialização: a transação foi desfeita, repetir é sempre seguro;
+    # queda de conexão: o COMMIT pode ter chegado ao banco, só repete o que é idempotente
+    if isinstance(erro, psycopg2.extensions.TransactionRollbackError):
+        return True
+    return idempotente and _falha_de_conexao(erro)
+
+
+def _circuito_aberto(mensagem):
+    return classe_circuito_aberto(psycopg2.OperationalError)(mensagem)
+
+
+_conexao_preparada = None
+_cursor_registro = None
+
+# sufixo dos cursores server-side: nomes repetidos colidem na mesma conexão
+_numeros_cursor = count(1)
+
+
+def _classe_cursor():
+    """CursorRegistro: com `registro` definido (ver comum/registros.py), as linhas
+    saem já como instâncias dele em vez de tuplas; sem, é um cursor comum"""
+    global _cursor_registro
+    if _cursor_registro is None:
+        class CursorRegistro(psycopg2.extensions.cursor):
+            registro = None
+
+            def fetchone(self):
+                linha = super().fetchone()
+                return linha if linha is None or self.registro is None else self.registro(*linha)
+
+            def fetchmany(self, size=None):
+                linhas = super().fetchmany() if size is None else super().fetchmany(size)
+                return linhas if self.registro is None else list(starmap(self.registro, linhas))
+
+            def fetchall(self):
+                linhas = super().fetchall()
+                return linhas if self.registro is None else list(starmap(self.registro, linhas))
+
+            def __iter__(self):
+                linhas = super().__iter__()
+                if self.registro is None:
+                    return linhas
+                # o iterador do psycopg2 é o próprio cursor: iter(linhas) voltaria para cá
+                return starmap(self.registro, iter(linhas.__next__, None))
+
+        _cursor_registro = CursorRegistro
+    return _cursor_registro
+
+
+def _classe_conexao():
+    """ConexaoPreparada: conexão que lembra quais comandos já receberam PREPARE
+    nesta sessão. A classe é criada no primeiro uso porque herda do psycopg2,
+    que só é importado aí."""
+    global _conexao_preparada
+    if _conexao_preparada is None:
+        class ConexaoPreparada(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.cursor_factory = _classe_cursor()
+                self.preparados = set()
+                self.geracao = 0  # ver PostgresManager._circuito_abriu
+                self.leituras = 0  # cursores server-side abertos fora de transacao()
+
+        _conexao_preparada = ConexaoPreparada
+    return _conexao_preparada
+
+
+def _conectar(config):
+    return psycopg2.connect(connection_factory=_classe_conexao(), **config)
+
+
+class GrupoCommit:
+    """Conexão de escrita que junta várias operações num único COMMIT.
+
+    Cada operação roda dentro de um SAVEPOINT, então um comando que falha só
+    desfaz a si mesmo. O COMMIT acontece a cada `max_ops` operações ou quando
+    a mais antiga pendente passa de `max_ms` (uma thread confere o prazo).
+    Operações já respondidas mas ainda não commitadas se perdem se a conexão
+    cair antes do COMMIT."""
+
+    def __init__(self, config, max_ops, max_ms):
+        self.config = config
+        self.max_ops = max_ops
+        self.max_ms = max_ms
+        self.conn = None  # aberta na primeira operação (ou em conectar())
+        self.pendentes = 0
+        self._primeira = None
+        self._lock = threading.RLock()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._vigiar_prazo, daemon=True)
+        self._thread.start()
+
+    def _vigiar_prazo(self):
+        while not self._parar.wait(self.max_ms / 1000):
+            with self._lock:
+                if self.pendentes and (time.monotonic() - self._primeira) * 1000 >= self.max_ms:
+                    try:
+                        self.flush()
+                    except psycopg2.Error:
+                        print("Erro")
+
+    def conectar(self):
+        with self._lock:
+            if self.conn is None or self.conn.closed:
+                self.conn = _conectar(self.config)
+
+    @contextmanager
+    def cursor(self):
+        with self._lock:
+            self.conectar()
+            try:
+                with self.conn.cursor() as cursor:
+                    cursor.execute("SAVEPOINT operacao;")
+                    try:
+                        yield cursor
+                    except Exception as e:
+                        if not isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                            cursor.execute("ROLLBACK TO SAVEPOINT operacao;")
+                        raise
+                    cursor.execute("RELEASE SAVEPOINT operacao;")
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self._descartar()
+                raise
+            if not self.pendentes:
+                self._primeira = time.monotonic()
+            self.pendentes += 1
+            if self.pendentes >= self.max_ops:
+                self.flush()
+
+    def flush(self):
+        """Faz o COMMIT das operações pendentes"""
+        with self._lock:
+            if not self.pendentes:
+                return
+            try:
+                self.conn.commit()
+            except psycopg2.Error:
+                self._descartar()
+                raise
+            self.pendentes = 0
+
+    def _descartar(self):
+        if self.pendentes:
+            print(f"Erro: {self.pendentes} operação(ões) sem commit foram perdidas")
+        self.pendentes = 0
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+
+    def fechar(self):
+        self._parar.set()
+        self._thread.join()
+        with self._lock:
+            try:
+                self.flush()
+            finally:
+                if self.conn is not None:
+                    self.conn.close()
+
+
+# resultado de cada operação do Pipeline, guardado no mesmo envio e lido de volta
+# no fim dele (a tabela é da sessão; o DELETE deixa ela vazia para o próximo)
+_RESULTADOS_PIPELINE = """
+CREATE TEMP TABLE IF NOT EXISTS resultado_pipeline (ordem integer, valor text);
+"""
+
+
+class Pipeline:
+    """Fila de criar_*/atualizar_*/deletar_* enviada ao Postgres de uma vez.
+
+        with pg_manager.pipeline() as pipe:
+            pipe.criar_produto("Arroz", 10.0, 5)
+            pipe.atualizar_produto(1, 12.0)
+        print(pipe.resultados, pipe.falhas)
+
+    Cada operação enfileirada devolve seu índice. A cada `tamanho` operações (e
+    em flush() ou no fim do bloco with) a fila vira uma única string com todos
+    os comandos, executada numa ida e volta ao servidor e numa transação: o
+    custo de latência é o mesmo para 1 ou 1000 operações. Cada comando grava
+    seu resultado numa tabela temporária, lida no fim do mesmo envio.
+
+    Se algum comando falhar, o envio é desfeito e as operações são refeitas uma
+    a uma, cada uma num SAVEPOINT, para isolar as que falharam (as outras são
+    gravadas). `resultados` fica alinhado com as operações: a chave criada ou
+    as linhas alteradas, None nas que falharam; `falhas` lista (índice, operação,
+    mensagem). Os comandos vão como SQL literal, sem PREPARE."""
+
+    def __init__(self, manager, tamanho=TAMANHO_LOTE):
+        self.manager = manager
+        self.tamanho = tamanho
+        self.resultados = []
+        self.falhas = []
+        self._fila = []  # (nome, params, converter, chave do cache)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, rastro):
+        if tipo is None:
+            self.flush()
+        else:
+            self._fila = []  # o bloco falhou: o que ainda não foi enviado é descartado
+
+    def _enfileirar(self, nome, params, converter=int, chave_cache=None):
+        self._fila.append((nome, params, converter, chave_cache))
+        indice = len(self.resultados) + len(self._fila) - 1
+        if len(self._fila) >= self.tamanho:
+            self.flush()
+        return indice
+
+    def criar_usuario(self, cpf, nome, email):
+        return self._enfileirar("criar_usuario", (cpf, nome, email), str)
+
+    def atualizar_usuario(self, cpf, email):
+        return self._enfileirar("atualizar_usuario", (email, cpf), chave_cache=f"pg:usuario:{cpf}")
+
+    def deletar_usuario(self, cpf):
+        return self._enfileirar("deletar_usuario", (cpf,), chave_cache=f"pg:usuario:{cpf}")
+
+    def criar_produto(self, nome, valor, quantidade, id_prod=None):
+        if id_prod is not None:
+            return self._enfileirar("criar_produto_com_id", (id_prod, nome, valor, quantidade))
+        return self._enfileirar("criar_produto", (nome, valor, quantidade))
+
+    def atualizar_produto(self, id_prod, valor):
+        return self._enfileirar("atualizar_produto", (valor, id_prod), chave_cache=f"pg:produto:{id_prod}")
+
+    def deletar_produto(self, id_prod):
+        return self._enfileirar("deletar_produto", (id_prod,), chave_cache=f"pg:produto:{id_prod}")
+
+    def criar_endereco(self, rua, numero, bairo, cidade, cep, complemento, id_endereco=None):
+        params = (rua, numero, bairo, cidade, cep, complemento)
+        if id_endereco is not None:
+            return self._enfileirar("criar_endereco_com_id", (id_endereco, *params))
+        return self._enfileirar("criar_endereco", params)
+
+    def atualizar_endereco(self, id_endereco, rua, numero, complemento):
+        return self._enfileirar("atualizar_endereco", (rua, numero, complemento, id_endereco),
+                                chave_cache=f"pg:endereco:{id_endereco}")
+
+    def deletar_endereco(self, id_endereco):
+        return self._enfileirar("deletar_endereco", (id_endereco,), chave_cache=f"pg:endereco:{id_endereco}")
+
+    def flush(self):
+        """Envia a fila; devolve (resultados, falhas) das operações enviadas agora"""
+        fila, self._fila = self._fila, []
+        if not fila:
+            return [], []
+        inicio = len(self.resultados)
+        try:
+            with self.manager._cursor() as cursor:
+                try:
+                    resultados, falhas = self._enviar(cursor, fila), []
+                except psycopg2.OperationalError:
+                    raise
+                except psycopg2.Error:
+                    cursor.execute("ROLLBACK TO SAVEPOINT pipeline;")
+                    resultados, falhas = self._uma_a_uma(cursor, fila, inicio)
+        except psycopg2.Error as e:
+            # conexão caiu ou o COMMIT falhou: não dá para saber o que foi gravado
+            self.manager._erro(e)
+            resultados = [None] * len(fila)
+            falhas = [(inicio + i, nome, str(e).strip()) for i, (nome, _, _, _) in enumerate(fila)]
+        finally:
+            for _, _, _, chave_cache in fila:
+                if chave_cache is not None:
+                    self.manager.cache.invalidar(chave_cache)
+        self.resultados.extend(resultados)
+        self.falhas.extend(falhas)
+        print(f"Pipeline: {len(fila) - len(falhas)} operação(ões) gravada(s)")
+        for indice, nome, mensagem in falhas:
+            print(f"Erro na operação {indice} ({nome}): {mensagem}")
+        return resultados, falhas
+
+    def _enviar(self, cursor, fila):
+        """Todos os comandos numa só execução; cada um grava seu resultado em resultado_pipeline"""
+        comandos = ["SAVEPOINT pipeline;", _RESULTADOS_PIPELINE]
+        for ordem, (nome, params, _, _) in enumerate(fila):
+            sql = ESCRITAS[nome].strip().rstrip(";")
+            if "RETURNING" in sql:
+                valor = "valor::text"
+            else:
+                sql, valor = sql + " RETURNING 1", "count(*)::text"
+            comandos.append(cursor.mogrify(
+                f"WITH r(valor) AS ({sql}) INSERT INTO pg_temp.resultado_pipeline SELECT %s, {valor} FROM r;",
+                (*params, ordem)).decode())
+        comandos.append("RELEASE SAVEPOINT pipeline;")
+        comandos.append("DELETE FROM pg_temp.resultado_pipeline RETURNING ordem, valor;")
+        cursor.execute("\n".join(comandos))
+        resultados = [None] * len(fila)
+        for ordem, valor in cursor.fetchall():
+            resultados[ordem] = fila[ordem][2](valor)
+        return resultados
+
+    def _uma_a_uma(self, cursor, fila, inicio):
+        resultados, falhas = [], []
+        for i, (nome, params, _, _) in enumerate(fila):
+            sql = ESCRITAS[nome]
+            cursor.execute("SAVEPOINT operacao_pipeline;")
+            try:
+                cursor.execute(sql, params)
+                resultados.append(cursor.fetchone()[0] if "RETURNING" in sql else cursor.rowcount)
+                cursor.execute("RELEASE SAVEPOINT operacao_pipeline;")
+            except psycopg2.OperationalError:
+                raise
+            except psycopg2.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT operacao_pipeline;")
+                resultados.append(None)
+                falhas.append((inicio + i, nome, str(e).strip()))
+        return resultados, falhas
+
 
 class PostgresManager:
-    def __init__(self, config):
+    def __init__(self, config, pool_config=None, cache=None, preparar=PREPARAR, group_commit=None,
+                 resiliencia=RESILIENCIA_CONFIG):
+        """Não conecta aqui: a conexão (ou o pool) abre na primeira operação ou em conectar()"""
+        self.config = config
+        self.preparar = preparar
+        self.cache = cache if cache is not None else CacheLeitura(CacheLRU(**CACHE_CONFIG))
         self.conn = None
-        self.cursor = None
+        self.pool = None
+        self.grupo = None
+        self._pool_config = None
+        self._vagas = None
+        self._ping = False
+        self._lock_conexao = threading.Lock()
+        self._local = threading.local()  # transação aberta por transacao() nesta thread
+        resiliencia = resiliencia or {}
+        self.retentativa = Retentativa(resiliencia.get("tentativas", 1), resiliencia.get("base_ms", 50),
+                                       resiliencia.get("teto_ms", 2000))
+        self.disjuntor = Disjuntor(resiliencia.get("falhas_para_abrir", 0), resiliencia.get("aberto_s", 10),
+                                   excecao=_circuito_aberto, ao_abrir=self._circuito_abriu)
+        self._geracao = 0
+        if group_commit and group_commit.get("max_ops", 0) > 0:
+            self.grupo = GrupoCommit(config, group_commit["max_ops"], group_commit.get("max_ms", 10))
+        if pool_config and pool_config.get("maxconn", 0) > 0:
+            self._pool_config = pool_config
+            # getconn() não espera por conexão livre, o semáforo faz esse papel
+            self._vagas = threading.BoundedSemaphore(pool_config["maxconn"])
+            self._ping = pool_config.get("ping", False)
+
+    def conectar(self):
+        """Abre agora a conexão (ou o pool e a conexão do group commit), para falhar
+        cedo se o banco estiver fora; devolve o próprio manager"""
         try:
-            self.conn = psycopg2.connect(**config)
-            self.cursor = self.conn.cursor()
+            self._abrir()
             print("Conectou")
         except psycopg2.OperationalError:
             print("Erro")
-            sys.exit(1)
+            raise
+        return self
+
+    def _abrir(self):
+        with self._lock_conexao:
+            if self._pool_config is not None:
+                if self.pool is None:
+                    maxconn = self._pool_config["maxconn"]
+                    minconn = min(self._pool_config.get("minconn", 1), maxconn)
+                    self.pool = psycopg2.pool.ThreadedConnectionPool(
+                        minconn, maxconn, connection_factory=_classe_conexao(), **self.config)
+            elif self.conn is None or self.conn.closed:
+                self.conn = _conectar(self.config)
+            if self.grupo:
+                self.grupo.conectar()
 
     def fechar_conexao(self):
-        if self.cursor:
-            self.cursor.close()
+        if self.grupo:
+            self.grupo.fechar()
+            self.grupo = None
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+            print("Fechou")
         if self.conn:
             self.conn.close()
+            self.conn = None
             print("Fechou")
 
+    def _circuito_abriu(self):
+        """O banco caiu: conexões paradas no pool provavelmente morreram junto, então
+        cada uma passa por um SELECT 1 antes de ser usada de novo (ver _saudavel;
+        uma única conexão caída já faz o mesmo, ver _devolver_conexao)"""
+        self._geracao += 1
+        print("Erro: banco indisponível, operações recusadas por enquanto")
+
+    def _saudavel(self, conn):
+        """Health check feito ao tirar uma conexão do pool"""
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if self._ping or conn.geracao < self._geracao:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1;")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+            conn.geracao = self._geracao
+        return True
+
+    def _pegar_conexao(self):
+        if self._pool_config is None:
+            # conecta no primeiro uso e reconecta se a conexão caiu numa operação anterior
+            if self.conn is None or self.conn.closed:
+                self.conn = _conectar(self.config)
+            if self.conn.leituras:
+                # há uma leitura em streaming aberta na conexão única: um commit nela
+                # fecharia o cursor no meio, então esta operação usa uma conexão à parte
+                return _conectar(self.config)
+            return self.conn
+        if self.pool is None:
+            self._abrir()
+        self._vagas.acquire()
+        try:
+            while True:
+                conn = self.pool.getconn()
+                if self._saudavel(conn):
+                    return conn
+                self.pool.putconn(conn, close=True)
+        except BaseException:
+            self._vagas.release()
+            raise
+
+    def _devolver_conexao(self, conn, quebrada):
+        if self._pool_config is None:
+            if quebrada or conn is not self.conn:
+                conn.close()
+            return
+        if quebrada and conn.closed:
+            # a conexão caiu (queda de rede, banco reiniciado): as outras paradas no
+            # pool provavelmente também, então passam por um SELECT 1 antes de serem
+            # usadas (ver _saudavel), em vez de cada uma perder uma escrita
+            self._geracao += 1
+        try:
+            self.pool.putconn(conn, close=quebrada)
+        finally:
+            self._vagas.release()
+
+    @contextmanager
+    def _cursor(self, nome=None):
+        """Cursor próprio para uma operação; commit no fim e rollback em caso de erro.
+
+        Com `nome` o cursor é server-side (named cursor) e as linhas vêm do
+        servidor aos poucos, de `itersize` em `itersize`. Toda operação passa
+        pelo disjuntor: com o circuito aberto falha na hora."""
+        with self.disjuntor.protegendo(_falha_de_conexao):
+            with self._cursor_da_conexao(nome) as cursor:
+                yield cursor
+
+    @contextmanager
+    def _cursor_da_conexao(self, nome):
+        if nome is not None:
+            nome = f"{nome}_{next(_numeros_cursor)}"
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            # dentro de transacao(): sem commit aqui, só marca a transação como falha
+            try:
+                with conn.cursor(name=nome) as cursor:
+                    yield cursor
+            except Exception:
+                self._local.falhou = True
+                raise
+            return
+        if self.grupo is not None:
+            if nome is None:
+                with self.grupo.cursor() as cursor:
+                    yield cursor
+                return
+            # leituras em outra conexão precisam enxergar o que já foi escrito
+            self.grupo.flush()
+        conn = self._pegar_conexao()
+        quebrada = False
+        if nome is not None:
+            conn.leituras += 1
+        try:
+            with conn.cursor(name=nome) as cursor:
+                yield cursor
+            conn.commit()
+        except BaseException as e:
+            # OperationalError/InterfaceError: descarta a conexão, a próxima operação reconecta
+            quebrada = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    quebrada = True
+            quebrada = quebrada or bool(conn.closed)
+            raise
+        finally:
+            if nome is not None:
+                conn.leituras -= 1
+            self._devolver_conexao(conn, quebrada)
+
+    def _do_cache(self, chave, carregar):
+        """get_* passando pelo cache. Dentro de transacao() lê direto do banco: a
+        transação pode ter escritas ainda não commitadas, que não podem ir para o cache"""
+        if getattr(self._local, "conn", None) is not None:
+            return carregar()
+        return self.cache.obter(chave, carregar)
+
+    def _invalidar(self, chave):
+        """Tira a chave do cache; dentro de transacao() tira de novo depois do
+        COMMIT/ROLLBACK, porque até lá outro leitor pode recolocar a versão antiga"""
+        self.cache.invalidar(chave)
+        if getattr(self._local, "conn", None) is not None:
+            self._local.tocadas.add(chave)
+
+    @contextmanager
+    def transacao(self):
+        """Executa as operações do bloco numa única transação, com um COMMIT no final.
+
+            with pg_manager.transacao():
+                pg_manager.criar_produto("Arroz", 10.0, 5)
+                pg_manager.atualizar_produto(1, 12.0)
+
+        Se qualquer operação falhar (psycopg2.Error) ou o bloco levantar uma
+        exceção, tudo é desfeito com ROLLBACK. Leituras em streaming (iterar_*,
+        consultar, relatorio) abertas dentro do bloco usam a conexão da
+        transação e precisam ser consumidas antes de ele terminar: o COMMIT
+        fecha os cursores delas."""
+        if getattr(self._local, "conn", None) is not None:
+            yield  # transação aninhada entra na de fora
+            return
+        conn = self._pegar_conexao()
+        self._local.conn = conn
+        self._local.falhou = False
+        self._local.tocadas = set()
+        quebrada = False
+        try:
+            yield
+            if self._local.falhou:
+                conn.rollback()
+                print("Erro: transação desfeita")
+            else:
+                conn.commit()
+        except BaseException as e:
+            quebrada = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    quebrada = True
+            raise
+        finally:
+            self._local.conn = None
+            self._devolver_conexao(conn, quebrada or bool(conn.closed))
+            for chave in self._local.tocadas:
+                self.cache.invalidar(chave)
+            self._local.tocadas = set()
+
+    def pipeline(self, tamanho=TAMANHO_LOTE):
+        """Pipeline que junta até `tamanho` escritas numa ida e volta ao servidor (ver Pipeline)"""
+        return Pipeline(self, tamanho)
+
+    def _erro(self, erro):
+        """Guarda a exceção da operação (ver ultimo_erro) e avisa o usuário"""
+        self._local.erro = erro
+        print("Erro")
+
+    @property
+    def ultimo_erro(self):
+        """Exceção da última operação que falhou nesta thread"""
+        return getattr(self._local, "erro", None)
+
+    def _executar(self, cursor, nome, sql, params):
+        """Executa `sql` pelo comando preparado `nome`.
+
+        O PREPARE é feito uma vez por conexão; uma conexão nova (pool ou
+        reconexão) começa sem nenhum e prepara de novo no primeiro uso."""
+        if not self.preparar:
+            cursor.execute(sql, params)
+            return
+        conn = cursor.connection
+        if nome not in conn.preparados:
+            cursor.execute(f"PREPARE {nome} AS {_para_prepare(sql)};")
+            conn.preparados.add(nome)
+        marcadores = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {nome} ({marcadores});", params)
+
+    def _comando(self, nome, sql, params, resultado=lambda cursor: cursor.rowcount, idempotente=True):
+        """Executa um comando de uma linha na sua própria transação e devolve resultado(cursor).
+
+        Falhas transitórias são repetidas com backoff (ver _pode_repetir), menos
+        dentro de transacao() ou com group commit, onde repetir só o comando
+        deixaria o resto da transação para trás."""
+        def rodar():
+            with self._cursor() as cursor:
+                self._executar(cursor, nome, sql, params)
+                return resultado(cursor)
+        if getattr(self._local, "conn", None) is not None or self.grupo is not None:
+            return rodar()
+        return self.retentativa.executar(rodar, lambda erro: _pode_repetir(erro, idempotente))
+
+    def _iterar(self, sql, chave, limit, after, tamanho_lote, registro=None):
+        """Lê em streaming com paginação por chave (WHERE chave > after ORDER BY chave);
+        com `registro` as linhas saem como instâncias dele, senão como tuplas.
+
+        Outras operações feitas enquanto a leitura está aberta não a interrompem:
+        com conexão única elas vão para uma conexão à parte (ver _pegar_conexao)"""
+        params = []
+        if after is not None:
+            sql += f" WHERE {chave} > %s"
+            params.append(after)
+        sql += f" ORDER BY {chave}"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        with self._cursor(nome="leitura") as cursor:
+            cursor.itersize = tamanho_lote
+            cursor.registro = registro
+            cursor.execute(sql, params)
+            yield from cursor
+
     def criar_usuario(self, cpf, nome, email):
-        sql = """
-        INSERT INTO mydb.Usuario (cpf, nome, email, Dados_bancarios_idDados_bancarios) 
-        VALUES (%s, %s, %s, 1) RETURNING cpf;
-        """
         try:
-            self.cursor.execute(sql, (cpf, nome, email))
-            self.conn.commit()
+            self._comando("criar_usuario", ESCRITAS["criar_usuario"], (cpf, nome, email), idempotente=False)
             print("Criou")
-        except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+            return cpf
+        except psycopg2.Error as e:
+            self._erro(e)
+
+    def iterar_usuarios(self, limit=None, after=None, tamanho_lote=TAMANHO_LOTE):
+        """Gera Usuario em ordem de CPF, começando depois de `after`"""
+        return self._iterar("SELECT cpf, nome, email FROM mydb.Usuario",
+                            "cpf", limit, after, tamanho_lote, Usuario)
+
+    def _buscar_um(self, nome, sql, chave, registro=None):
+        def resultado(cursor):
+            cursor.registro = registro
+            return cursor.fetchone()
+        return self._comando(nome, sql, (chave,), resultado)
 
-    def ler_usuarios(self):
-        self.cursor.execute("SELECT cpf, nome, email FROM mydb.Usuario;")
-        aux = self.cursor.fetchall()
-        if not aux:
+    def get_usuario(self, cpf):
+        """Busca o Usuario pelo CPF, passando pelo cache; None se não existir"""
+        sql = "SELECT cpf, nome, email FROM mydb.Usuario WHERE cpf = %s;"
+        return self._do_cache(f"pg:usuario:{cpf}", lambda: self._buscar_um("get_usuario", sql, cpf, Usuario))
+
+    def ler_usuarios(self, limit=None, after=None):
+        achou = False
+        try:
+            for usuario in self.iterar_usuarios(limit, after):
+                achou = True
+                print(f"CPF: {usuario.cpf}, Nome: {usuario.nome}, Email: {usuario.email}")
+        except psycopg2.Error as e:
+            self._erro(e)
+            return
+        if not achou:
             print("Não achou")
-        for linha in aux:
-            print(f"CPF: {linha[0]}, Nome: {linha[1]}, Email: {linha[2]}")
 
     def atualizar_usuario(self, cpf, email):
-        sql = "UPDATE mydb.Usuario SET email = %s WHERE cpf = %s;"
         try:
-            self.cursor.execute(sql, (email, cpf))
-            self.conn.commit()
-            if self.cursor.rowcount == 0:
+            alterados = self._comando("atualizar_usuario", ESCRITAS["atualizar_usuario"], (email, cpf))
+            if alterados == 0:
                 print("Não achou")
             else:
                 print("E-mail atualizado")
-        except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+            return alterados
+        except psycopg2.Error as e:
+            self._erro(e)
+        finally:
+            self._invalidar(f"pg:usuario:{cpf}")
 
     def deletar_usuario(self, cpf):
-        sql = "DELETE FROM mydb.Usuario WHERE cpf = %s;"
         try:
-            self.cursor.execute(sql, (cpf,))
-            self.conn.commit()
-            if self.cursor.rowcount == 0:
+            alterados = self._comando("deletar_usuario", ESCRITAS["deletar_usuario"], (cpf,))
+            if alterados == 0:
                 print("Não encontrado")
             else:
                 print("Deletado")
-        except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+            return alterados
+        except psycopg2.Error as e:
+            self._erro(e)
+        finally:
+            self._invalidar(f"pg:usuario:{cpf}")
 
-    def criar_produto(self, nome, valor, quantidade):
-        sql = """
-        INSERT INTO mydb.Produto (nome, valor, quantidade, descricao, porcao_peso) 
-        VALUES (%s, %s, %s, 'N/A', 0) RETURNING idProduto;
-        """
+    def criar_produto(self, nome, valor, quantidade, id_prod=None):
+        """`id_prod` grava com um ID já reservado (ex. pela escrita dupla)"""
+        comando, params = "criar_produto", (nome, valor, quantidade)
+        if id_prod is not None:
+            comando, params = "criar_produto_com_id", (id_prod, nome, valor, quantidade)
         try:
-            self.cursor.execute(sql, (nome, valor, quantidade))
-            id_prod = self.cursor.fetchone()[0]
-            self.conn.commit()
+            id_prod = self._comando(comando, ESCRITAS[comando], params, lambda cursor: cursor.fetchone()[0], idempotente=False)
             print("Criou")
             return id_prod
-        except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+        except psycopg2.Error as e:
+            self._erro(e)
             return None
 
-    def ler_produtos(self):
-        self.cursor.execute("SELECT idProduto, nome, valor, quantidade FROM mydb.Produto;")
-        aux = self.cursor.fetchall()
-        if not aux:
+    def iterar_produtos(self, limit=None, after=None, tamanho_lote=TAMANHO_LOTE):
+        """Gera Produto em ordem de ID, começando depois de `after`"""
+        return self._iterar("SELECT idProduto, nome, valor, quantidade FROM mydb.Produto",
+                            "idProduto", limit, after, tamanho_lote, Produto)
+
+    def get_produto(self, id_prod):
+        """Busca o Produto pelo ID, passando pelo cache"""
+        sql = "SELECT idProduto, nome, valor, quantidade FROM mydb.Produto WHERE idProduto = %s;"
+        return self._do_cache(f"pg:produto:{id_prod}",
+                                lambda: self._buscar_um("get_produto", sql, id_prod, Produto))
+
+    def ler_produtos(self, limit=None, after=None):
+        achou = False
+        try:
+            for produto in self.iterar_produtos(limit, after):
+                achou = True
+                print(f"ID: {produto.id}, Nome: {produto.nome}, Valor: R${produto.valor:.2f}, Qtd: {produto.quantidade}")
+        except psycopg2.Error as e:
+            self._erro(e)
+            return
+        if not achou:
             print("Nenhum produto encontrado.")
-        for linha in aux:
-            print(f"ID: {linha[0]}, Nome: {linha[1]}, Valor: R${linha[2]:.2f}, Qtd: {linha[3]}")
 
 
     def atualizar_produto(self, id_prod, valor):
-        sql = "UPDATE mydb.Produto SET valor = %s WHERE idProduto = %s;"
         try:
-            self.cursor.execute(sql, (valor, id_prod))
-            self.conn.commit()
-            if self.cursor.rowcount == 0:
+            alterados = self._comando("atualizar_produto", ESCRITAS["atualizar_produto"], (valor, id_prod))
+            if alterados == 0:
                 print("Não encontrado")
             else:
                 print("Valor atualizado")
-        except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+            return alterados
+        except psycopg2.Error as e:
+            self._erro(e)
+        finally:
+            self._invalidar(f"pg:produto:{id_prod}")
     
+    def reservar_estoque(self, id_prod, quantidade):
+        """Baixa `quantidade` do estoque numa única instrução atômica (sem ler antes).
+
+        Devolve o estoque restante, ou None se o produto não existe ou não tem
+        estoque suficiente; pedidos concorrentes nunca deixam o estoque negativo."""
+        sql = """
+        UPDATE mydb.Produto SET quantidade = quantidade - %s
+        WHERE idProduto = %s AND quantidade >= %s RETURNING quantidade;
+        """
+        if quantidade <= 0:
+            print("Quantidade deve ser positiva")
+            return None
+        try:
+            linha = self._comando("reservar_estoque", sql, (quantidade, id_prod, quantidade),
+                                  lambda cursor: cursor.fetchone(), idempotente=False)
+            if linha is None:
+                print("Estoque insuficiente ou produto não encontrado")
+                return None
+            return linha[0]
+        except psycopg2.Error as e:
+            self._erro(e)
+        finally:
+            self._invalidar(f"pg:produto:{id_prod}")
+
+    def reservar_estoques(self, pedidos):
+        """Reserva vários (id_prod, quantidade) de uma vez, tudo ou nada.
+
+        Devolve {id_prod: estoque restante}, ou None se algum item não pôde ser
+        reservado (nesse caso nenhum estoque é alterado)."""
+        sql = """
+        UPDATE mydb.Produto AS p SET quantidade = p.quantidade - v.qtd
+        FROM (VALUES %s) AS v(id, qtd)
+        WHERE p.idProduto = v.id AND p.quantidade >= v.qtd
+        RETURNING p.idProduto, p.quantidade;
+        """
+        quantidades = {}
+        for id_prod, quantidade in pedidos:
+            quantidades[id_prod] = quantidades.get(id_prod, 0) + quantidade
+        if any(quantidade <= 0 for quantidade in quantidades.values()):
+            print("Quantidade deve ser positiva")
+            return None
+        if not quantidades:
+            return {}
+        ids = sorted(quantidades)
+        try:
+            with self._cursor() as cursor:
+                cursor.execute("SAVEPOINT reserva;")
+                # trava as linhas sempre na mesma ordem, para dois pedidos não esperarem um pelo outro
+                cursor.execute("SELECT idProduto FROM mydb.Produto WHERE idProduto = ANY(%s) "
+                               "ORDER BY idProduto FOR UPDATE;", (ids,))
+                retorno = psycopg2.extras.execute_values(cursor, sql, [(i, quantidades[i]) for i in ids],
+                                                         template="(%s, %s)", page_size=len(ids), fetch=True)
+                restantes = dict(retorno)
+                if len(restantes) < len(ids):
+                    cursor.execute("ROLLBACK TO SAVEPOINT reserva;")
+                else:
+                    cursor.execute("RELEASE SAVEPOINT reserva;")
+            if len(restantes) < len(ids):
+                faltando = [i for i in ids if i not in restantes]
+                print(f"Estoque insuficiente ou produto não encontrado: {faltando}")
+                return None
+            return restantes
+        except psycopg2.Error as e:
+            self._erro(e)
+        finally:
+            for id_prod in ids:
+                self._invalidar(f"pg:produto:{id_prod}")
+
     def deletar_produto(self, id_prod):
-        sql = "DELETE FROM mydb.Produto WHERE idProduto = %s;"
         try:
-            self.cursor.execute(sql, (id_prod,))
-            self.conn.commit()
-            if self.cursor.rowcount == 0:
+            alterados = self._comando("deletar_produto", ESCRITAS["deletar_produto"], (id_prod,))
+            if alterados == 0:
                 print("Não encontrado")
             else:
                 print("Deletado")
-        except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+            return alterados
+        except psycopg2.Error as e:
+            self._erro(e)
+        finally:
+            self._invalidar(f"pg:produto:{id_prod}")
 
-    def criar_endereco(self, rua, numero, bairo, cidade, cep, complemento):
-        sql = """
-        INSERT INTO mydb.Endereco (rua, numero, bairo, cidade, cep, complemento) 
-        VALUES (%s, %s, %s, %s, %s, %s) RETURNING idEndereco;
-        """
+    def criar_endereco(self, rua, numero, bairo, cidade, cep, complemento, id_endereco=None):
+        """`id_endereco` grava com um ID já reservado (ex. pela escrita dupla)"""
+        comando, params = "criar_endereco", (rua, numero, bairo, cidade, cep, complemento)
+        if id_endereco is not None:
+            comando, params = "criar_endereco_com_id", (id_endereco, *params)
         try:
-            self.cursor.execute(sql, (rua, numero, bairo, cidade, cep, complemento))
-            id_endereco = self.cursor.fetchone()[0]
-            self.conn.commit()
+            id_endereco = self._comando(comando, ESCRITAS[comando], params, lambda cursor: cursor.fetchone()[0],
+                                        idempotente=False)
             print("Criou")
             return id_endereco
-        except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+        except psycopg2.Error as e:
+            self._erro(e)
+
+    def iterar_enderecos(self, limit=None, after=None, tamanho_lote=TAMANHO_LOTE):
+        """Gera Endereco em ordem de ID, começando depois de `after`"""
+        return self._iterar("SELECT idEndereco, rua, numero, bairo, cidade, cep, complemento FROM mydb.Endereco",
+                            "idEndereco", limit, after, tamanho_lote, Endereco)
 
-    def ler_enderecos(self):
-        self.cursor.execute("SELECT idEndereco, rua, numero, bairo, cidade, cep FROM mydb.Endereco;")
-        aux = self.cursor.fetchall()
-        if not aux:
+    def get_endereco(self, id_endereco):
+        """Busca o Endereco pelo ID, passando pelo cache"""
+        sql = ("SELECT idEndereco, rua, numero, bairo, cidade, cep, complemento "
+               "FROM mydb.Endereco WHERE idEndereco = %s;")
+        return self._do_cache(f"pg:endereco:{id_endereco}",
+                                lambda: self._buscar_um("get_endereco", sql, id_endereco, Endereco))
+
+    def ler_enderecos(self, limit=None, after=None):
+        achou = False
+        try:
+            for endereco in self.iterar_enderecos(limit, after):
+                achou = True
+                print(f"ID: {endereco.id}, Rua: {endereco.rua}, Nº: {endereco.numero}, Bairro: {endereco.bairro}, "
+                      f"Cidade: {endereco.cidade}, CEP: {endereco.cep}")
+        except psycopg2.Error as e:
+            self._erro(e)
+            return
+        if not achou:
             print("Não encontrado")
-        for linha in aux:
-            print(f"ID: {linha[0]}, Rua: {linha[1]}, Nº: {linha[2]}, Bairro: {linha[3]}, Cidade: {linha[4]}, CEP: {linha[5]}")
 
     def atualizar_endereco(self, id_endereco, rua, numero, complemento):
-        sql = "UPDATE mydb.Endereco SET rua = %s, numero = %s, complemento = %s WHERE idEndereco = %s;"
         try:
-            self.cursor.execute(sql, (rua, numero, complemento, id_endereco))
-            self.conn.commit()
-            if self.cursor.rowcount == 0:
+            alterados = self._comando("atualizar_endereco", ESCRITAS["atualizar_endereco"], (rua, numero, complemento, id_endereco))
+            if alterados == 0:
                 print("Não encontrado")
             else:
                 print("Endereço atualizado")
-        except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+            return alterados
+        except psycopg2.Error as e:
+            self._erro(e)
+        finally:
+            self._invalidar(f"pg:endereco:{id_endereco}")
 
     def deletar_endereco(self, id_endereco):
-        sql = "DELETE FROM mydb.Endereco WHERE idEndereco = %s;"
         try:
-            self.cursor.execute(sql, (id_endereco,))
-            self.conn.commit()
-            if self.cursor.rowcount == 0:
+            alterados = self._comando("deletar_endereco", ESCRITAS["deletar_endereco"], (id_endereco,))
+            if alterados == 0:
                 print("Não encontrado")
             else:
                 print("Endereço deletado")
+            return alterados
+        except psycopg2.Error as e:
+            self._erro(e)
+        finally:
+            self._invalidar(f"pg:endereco:{id_endereco}")
+
+    def consultar(self, entidade, consulta, tamanho_lote=TAMANHO_LOTE):
+        """Gera dicts {campo: valor} só com as linhas e colunas pedidas na Consulta
+        (comum/consulta.py), filtradas e ordenadas no servidor"""
+        sql, params, campos = para_sql(consulta, entidade)
+        with self._cursor(nome="consulta") as cursor:
+            cursor.itersize = tamanho_lote
+            cursor.execute(sql, params)
+            for linha in cursor:
+                yield dict(zip(campos, linha))
+
+    def consultar_usuarios(self, consulta):
+        return self.consultar("usuarios", consulta)
+
+    def consultar_produtos(self, consulta):
+        return self.consultar("produtos", consulta)
+
+    def consultar_enderecos(self, consulta):
+        return self.consultar("enderecos", consulta)
+
+    def relatorio(self, entidade, agrupar=(), consulta=None, resumo=False, tamanho_lote=TAMANHO_LOTE):
+        """Gera dicts {campo agrupado..., métrica...} calculados com GROUP BY no
+        servidor (ver comum/relatorios.py); com `resumo` lê a tabela de resumo
+        mantida pelos triggers de atualizar_resumos()"""
+        sql, params, campos = relatorios.para_sql(entidade, agrupar, consulta, resumo)
+        with self._cursor(nome="relatorio") as cursor:
+            cursor.itersize = tamanho_lote
+            cursor.execute(sql, params)
+            for linha in cursor:
+                yield dict(zip(campos, linha))
+
+    def relatorio_estoque(self, resumo=False):
+        """{"produtos", "unidades", "valor_estoque"} somando todos os produtos"""
+        return next(self.relatorio("produtos", resumo=resumo))
+
+    def relatorio_enderecos(self, agrupar=("cidade",), consulta=None, resumo=False):
+        """Endereços por cidade (ou por cidade e bairro, com agrupar=("cidade", "bairro"))"""
+        return self.relatorio("enderecos", agrupar, consulta, resumo)
+
+    def atualizar_resumos(self):
+        """Cria as tabelas de resumo e os triggers que as mantêm a cada escrita, e as
+        recalcula do zero (ver relatorios.sql_resumo). Só precisa rodar uma vez;
+        rodar de novo é seguro. Devolve as entidades com resumo."""
+        with self._cursor() as cursor:
+            for entidade in relatorios.RESUMOS:
+                cursor.execute(relatorios.sql_resumo(entidade))
+        print("Resumos atualizados")
+        return list(relatorios.RESUMOS)
+
+    def _inserir_em_lote(self, sql, template, linhas, tamanho_lote):
+        """INSERT ... VALUES em lotes com execute_values, um commit por lote.
+
+        Devolve (ids, falhas): ids alinhados com a entrada (None nas linhas que
+        falharam) e falhas como lista de (indice, mensagem)."""
+        ids, falhas = [], []
+        for inicio, lote in _em_lotes(linhas, tamanho_lote):
+            try:
+                with self._cursor() as cursor:
+                    retorno = psycopg2.extras.execute_values(cursor, sql, lote, template=template,
+                                                             page_size=len(lote), fetch=True)
+                ids.extend(linha[0] for linha in retorno)
+            except psycopg2.OperationalError as e:
+                ids.extend([None] * len(lote))
+                falhas.extend((inicio + i, str(e).strip()) for i in range(len(lote)))
+            except psycopg2.Error:
+                # alguma linha do lote é inválida: refaz linha a linha para isolar as falhas
+                ids_lote, falhas_lote = self._inserir_linha_a_linha(sql, template, lote, inicio)
+                ids.extend(ids_lote)
+                falhas.extend(falhas_lote)
+        return ids, falhas
+
+    def _inserir_linha_a_linha(self, sql, template, lote, inicio):
+        ids, falhas = [], []
+        try:
+            with self._cursor() as cursor:
+                for i, linha in enumerate(lote):
+                    cursor.execute("SAVEPOINT linha;")
+                    try:
+                        retorno = psycopg2.extras.execute_values(cursor, sql, [linha], template=template,
+                                                                 fetch=True)
+                        cursor.execute("RELEASE SAVEPOINT linha;")
+                        ids.append(retorno[0][0])
+                    except psycopg2.OperationalError:
+                        raise
+                    except psycopg2.Error as e:
+                        cursor.execute("ROLLBACK TO SAVEPOINT linha;")
+                        ids.append(None)
+                        falhas.append((inicio + i, str(e).strip()))
+        except psycopg2.Error as e:
+            ids = [None] * len(lote)
+            falhas = [(inicio + i, str(e).strip()) for i in range(len(lote))]
+        return ids, falhas
+
+    def _resumo_lote(self, ids, falhas):
+        print(f"Criou {len(ids) - len(falhas)}")
+        if falhas:
+            print(f"Erro em {len(falhas)} linha(s)")
+        return ids, falhas
+
+    def criar_usuarios(self, usuarios, tamanho_lote=TAMANHO_LOTE):
+        """Insere vários (cpf, nome, email); devolve (cpfs, falhas)"""
+        sql = """
+        INSERT INTO mydb.Usuario (cpf, nome, email, Dados_bancarios_idDados_bancarios) 
+        VALUES %s RETURNING cpf;
+        """
+        ids, falhas = self._inserir_em_lote(sql, "(%s, %s, %s, 1)", usuarios, tamanho_lote)
+        return self._resumo_lote(ids, falhas)
+
+    def criar_produtos(self, produtos, tamanho_lote=TAMANHO_LOTE):
+        """Insere vários (nome, valor, quantidade); devolve (ids, falhas)"""
+        sql = """
+        INSERT INTO mydb.Produto (nome, valor, quantidade, descricao, porcao_peso) 
+        VALUES %s RETURNING idProduto;
+        """
+        ids, falhas = self._inserir_em_lote(sql, "(%s, %s, %s, 'N/A', 0)", produtos, tamanho_lote)
+        return self._resumo_lote(ids, falhas)
+
+    def criar_enderecos(self, enderecos, tamanho_lote=TAMANHO_LOTE):
+        """Insere vários (rua, numero, bairo, cidade, cep, complemento); devolve (ids, falhas)"""
+        sql = """
+        INSERT INTO mydb.Endereco (rua, numero, bairo, cidade, cep, complemento) 
+        VALUES %s RETURNING idEndereco;
+        """
+        ids, falhas = self._inserir_em_lote(sql, "(%s, %s, %s, %s, %s, %s)", enderecos, tamanho_lote)
+        return self._resumo_lote(ids, falhas)
+
+    def copiar(self, entidade, linhas):
+        """Insere as tuplas de criar_{entidade} com COPY ... FROM STDIN, o caminho mais
+        rápido do Postgres, mas sem RETURNING (não devolve IDs).
+
+        O COPY é tudo ou nada: se alguma linha for inválida, o lote é refeito
+        por criar_{entidade} para isolar as falhas. Devolve (criadas, falhas)."""
+        destino, completar = COPIA[entidade]
+        linhas = list(linhas)
+        buffer = io.StringIO()
+        for linha in linhas:
+            buffer.write("\t".join(map(_campo_copy, completar(linha))) + "\n")
+        buffer.seek(0)
+        try:
+            with self._cursor() as cursor:
+                cursor.copy_expert(f"COPY {destino} FROM STDIN", buffer)
+            return len(linhas), []
+        except psycopg2.OperationalError as e:
+            self._erro(e)
+            return 0, [(i, str(e).strip()) for i in range(len(linhas))]
         except psycopg2.Error:
-            self.conn.rollback()
-            print("Erro")
+            ids, falhas = getattr(self, f"criar_{entidade}")(linhas, len(linhas))
+            return len(ids) - len(falhas), falhas
+
+    def reservar_ids(self, entidade, quantidade):
+        """Lista com `quantidade` IDs novos da sequência da tabela (None se não foi possível reservar)"""
+        sql = "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s);"
+        try:
+            # repetir só deixa uma lacuna na sequência
+            return self._comando("reservar_ids", sql, (*_sequencia(entidade), quantidade),
+                                 lambda cursor: [linha[0] for linha in cursor.fetchall()])
+        except psycopg2.Error as e:
+            self._erro(e)
+            return None
+
+    def ajustar_sequencia(self, entidade, minimo):
+        """Garante que a sequência não entregue IDs até `minimo`, já usados por outro gerador"""
+        sql = """
+        SELECT setval(s.seq::regclass, %s)
+        FROM (SELECT pg_get_serial_sequence(%s, %s) AS seq) AS s
+        JOIN pg_sequences AS p ON p.schemaname || '.' || p.sequencename = s.seq
+        WHERE COALESCE(p.last_value, 0) < %s;
+        """
+        self._comando("ajustar_sequencia", sql, (minimo, *_sequencia(entidade), minimo))
+
+    def aplicar_estado(self, entidade, chave, registro):
+        """Deixa a linha `chave` igual a `registro` ({campo lógico: valor}, ver
+        comum/consulta.py) com INSERT ... ON CONFLICT, ou a apaga se `registro` é
+        None. Idempotente; levanta a exceção em caso de erro (usado na
+        reconciliação da escrita dupla)"""
+        colunas = {campo: nomes[0] for campo, nomes in CAMPOS[entidade].items()}
+        chave_primaria = next(iter(colunas.values()))
+        if registro is None:
+            sql = f"DELETE FROM {TABELAS[entidade]} WHERE {chave_primaria} = %s;"
+            self._comando(f"apagar_estado_{entidade}", sql, (chave,))
+        else:
+            valores = {coluna: registro.get(campo) for campo, coluna in colunas.items()}
+            valores[chave_primaria] = chave
+            valores.update(COLUNAS_EXTRAS.get(entidade, {}))
+            atualizar = ", ".join(f"{coluna} = EXCLUDED.{coluna}" for coluna in colunas.values()
+                                  if coluna != chave_primaria)
+            sql = f"""
+            INSERT INTO {TABELAS[entidade]} ({", ".join(valores)}) VALUES ({", ".join(["%s"] * len(valores))})
+            ON CONFLICT ({chave_primaria}) DO UPDATE SET {atualizar};
+            """
+            self._comando(f"aplicar_estado_{entidade}", sql, tuple(valores.values()))
+        self._invalidar(f"pg:{entidade[:-1]}:{chave}")
+
+    def exportar_copy(self, entidade, consulta, criar_destino):
+        """Roda a Consulta como COPY (...) TO STDOUT (FORMAT binary), o jeito mais
+        rápido de tirar linhas do Postgres.
+
+        `criar_destino(campos, oids)` recebe os campos e os OIDs dos tipos das
+        colunas (para decodificar o formato binário) e devolve um objeto com
+        write(bytes), que recebe o fluxo do COPY à medida que chega. Devolve os campos."""
+        sql, params, campos = para_sql(consulta, entidade)
+        with self._cursor() as cursor:
+            select = cursor.mogrify(sql, params).decode()
+            # LIMIT 0 só para descobrir os tipos das colunas
+            cursor.execute(f"SELECT * FROM ({select}) AS consulta LIMIT 0")
+            destino = criar_destino(campos, [coluna.type_code for coluna in cursor.description])
+            cursor.copy_expert(f"COPY ({select}) TO STDOUT (FORMAT binary)", destino)
+        return campos
+
+    def copiar_snapshot(self, entidades, criar_destino):
+        """COPY ... TO STDOUT das tabelas inteiras (todas as colunas) das `entidades`,
+        todas lidas do mesmo snapshot: uma conexão própria numa transação
+        REPEATABLE READ só de leitura, que não trava as escritas.
+
+        `criar_destino(entidade, colunas)` devolve um objeto com write(bytes), que
+        recebe o COPY (formato texto, uma linha da tabela por linha). Devolve
+        {entidade: último valor da sequência} das entidades com ID serial."""
+        with self.disjuntor.protegendo(_falha_de_conexao):
+            conn = _conectar(self.config)
+            try:
+                conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+                with conn.cursor() as cursor:
+                    # o snapshot é tirado no primeiro comando e vale até o fim da transação
+                    for entidade in entidades:
+                        tabela = TABELAS[entidade]
+                        cursor.execute(f"SELECT * FROM {tabela} LIMIT 0")
+                        colunas = [coluna.name for coluna in cursor.description]
+                        cursor.copy_expert(f"COPY {tabela} ({', '.join(colunas)}) TO STDOUT",
+                                           criar_destino(entidade, colunas))
+                    # sequências não são transacionais: lidas depois dos COPY, cobrem todos os IDs copiados
+                    sequencias = {}
+                    for entidade in entidades:
+                        if "id" in CAMPOS[entidade]:
+                            cursor.execute("SELECT pg_sequence_last_value(pg_get_serial_sequence(%s, %s)::regclass);",
+                                           _sequencia(entidade))
+                            sequencias[entidade] = cursor.fetchone()[0]
+                conn.rollback()
+                return sequencias
+            finally:
+                conn.close()
+
+    def restaurar_copy(self, entidade, colunas, arquivo):
+        """COPY ... FROM STDIN de `arquivo` (formato texto de copiar_snapshot) na tabela
+        da entidade, numa transação; levanta a exceção em caso de erro"""
+        with self._cursor() as cursor:
+            cursor.copy_expert(f"COPY {TABELAS[entidade]} ({', '.join(colunas)}) FROM STDIN", arquivo)
 
 
 # Menus foram gerados com auxílio de IA para ficarem mais bonitos e de fácil usabilidade
@@ -300,11 +1388,28 @@ def menu_principal(pg_manager):
             print("Opção inválida. Tente novamente.")
 
 def main():
+    if sys.argv[1:] == ["resumos"]:
+        pg_manager = PostgresManager(DB_CONFIG)
+        pg_manager.atualizar_resumos()
+        pg_manager.fechar_conexao()
+        return
+    if len(sys.argv) > 1:
+        # modo não interativo, ex.: produtos import produtos.csv (ver cli.py)
+        from cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:], backend="pg"))
     pg_manager = None
+    snapshot = None
     try:
-        pg_manager = PostgresManager(DB_CONFIG)
+        pg_manager = PostgresManager(DB_CONFIG, POOL_CONFIG, group_commit=GROUP_COMMIT_CONFIG)
+        pg_manager.conectar()
+        from comum.metricas import configurar_pelo_ambiente
+        snapshot = configurar_pelo_ambiente(pg_manager, "pg")
         menu_principal(pg_manager)
+    except psycopg2.OperationalError:
+        sys.exit(1)
     finally:
+        if snapshot:
+            snapshot.parar()
         if pg_manager:
             pg_manager.fechar_conexao()
     print("Programa finalizado.")
@@ -0,0 +1,364 @@
+"""Backup consistente e restauração rápida dos dois bancos
+
+    python backup.py salvar pg backups/pg
+    python backup.py salvar mongo backups/mongo --linhas 50000 --nivel 1
+    python backup.py restaurar pg backups/pg --workers 8
+    python backup.py restaurar mongo backups/mongo --substituir
+
+O backup é um diretório com partes comprimidas com gzip, de até `--linhas`
+linhas/documentos cada, e um manifest.json gravado por último: sem ele o
+backup está incompleto. Tudo é lido e gravado em streaming, então a memória
+não depende do tamanho das tabelas.
+
+- Postgres: mydb.Usuario, mydb.Produto e mydb.Endereco inteiras (todas as
+  colunas) com COPY ... TO STDOUT, todas na mesma transação REPEATABLE READ
+  só de leitura (PostgresManager.copiar_snapshot). No formato texto do COPY
+  cada linha da tabela é uma linha do arquivo, então as partes são cortadas
+  em quebras de linha e cada uma pode ser carregada sozinha. O manifesto
+  guarda também o último valor das sequências.
+- MongoDB: todas as coleções de `sistema`, inclusive counters, como BSON cru
+  (RawBSONDocument: os documentos não são decodificados nem recodificados),
+  lidas numa sessão snapshot quando o servidor é replica set ou sharded
+  (MongoDB 5.0+; o snapshot só dura minSnapshotHistoryWindowInSeconds, 5
+  minutos por padrão). Num servidor standalone cada coleção é lida num
+  momento diferente, e o backup avisa. O manifesto guarda os índices.
+
+A restauração carrega as partes em paralelo, `--workers` threads com uma
+conexão cada: COPY ... FROM STDIN no Postgres, insert_many não ordenado no
+MongoDB. Os índices secundários são criados só depois da carga (no Postgres
+são removidos e recriados; os que sustentam PRIMARY KEY/UNIQUE ficam). O
+destino precisa estar vazio, ou use `--substituir` (TRUNCATE no Postgres,
+drop das coleções no MongoDB). Cada parte é uma transação: se a carga falhar
+no meio, o destino fica com parte dos dados. No fim as sequências do Postgres
+e os counters do MongoDB são ajustados para não entregar IDs já usados
+(processos já rodando podem ter blocos de IDs reservados antes, então
+reinicie-os).
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from comum.consulta import CAMPOS, TABELAS
+
+FORMATO = 1
+MANIFESTO = "manifest.json"
+LINHAS_POR_PARTE = 100000
+NIVEL_GZIP = 6
+WORKERS = 4
+TAMANHO_LOTE = 1000  # documentos por ida ao MongoDB no backup
+
+_IDENTIFICADOR = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+SQL_INDICES_SECUNDARIOS = """
+SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+FROM pg_index AS i
+WHERE i.indrelid = ANY(%s::regclass[])
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint AS c WHERE c.conindid = i.indexrelid);
+"""
+
+
+class _Partes:
+    """Grava registros em arquivos gzip de até `limite` registros cada"""
+
+    def __init__(self, diretorio, prefixo, limite, nivel):
+        self.diretorio = diretorio
+        self.prefixo = prefixo
+        self.limite = limite
+        self.nivel = nivel
+        self.partes = []
+        self.total = 0
+        self._arquivo = None
+        self._registros = 0
+
+    def adicionar(self, dados, registros=1):
+        if self._arquivo is None or self._registros >= self.limite:
+            self._proxima()
+        self._arquivo.write(dados)
+        self._registros += registros
+        self.total += registros
+
+    def write(self, dados):
+        # destino do COPY TO: a libpq entrega sempre uma linha inteira por vez
+        self.adicionar(dados, dados.count(b"\n"))
+        return len(dados)
+
+    def _proxima(self):
+        self.fechar()
+        nome = f"{self.prefixo}.{len(self.partes):05d}.gz"
+        self._arquivo = gzip.open(os.path.join(self.diretorio, nome), "wb", compresslevel=self.nivel)
+        self.partes.append(nome)
+        self._registros = 0
+
+    def fechar(self):
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+
+def _preparar_diretorio(diretorio):
+    os.makedirs(diretorio, exist_ok=True)
+    if os.listdir(diretorio):
+        raise ValueError(f"o diretório {diretorio} não está vazio")
+
+
+def _gravar_manifesto(diretorio, manifesto, default=None):
+    caminho = os.path.join(diretorio, MANIFESTO)
+    with open(caminho + ".tmp", "w", encoding="utf-8") as arquivo:
+        json.dump(manifesto, arquivo, ensure_ascii=False, indent=2, default=default)
+    os.replace(caminho + ".tmp", caminho)
+
+
+def _ler_manifesto(diretorio, backend, object_hook=None):
+    caminho = os.path.join(diretorio, MANIFESTO)
+    if not os.path.exists(caminho):
+        raise ValueError(f"{caminho} não existe: o backup está incompleto")
+    with open(caminho, encoding="utf-8") as arquivo:
+        manifesto = json.load(arquivo, object_hook=object_hook)
+    if manifesto.get("formato") != FORMATO or manifesto.get("backend") != backend:
+        raise ValueError(f"{caminho} não é um backup {backend} no formato {FORMATO}")
+    return manifesto
+
+
+def _em_paralelo(funcao, tarefas, workers):
+    """Roda funcao(tarefa) em `workers` threads; a primeira exceção é levantada no fim"""
+    with ThreadPoolExecutor(workers) as executor:
+        for _ in executor.map(funcao, tarefas):
+            pass
+
+
+def _maiores_primeiro(diretorio, tarefas):
+    # as partes grandes começam antes, para nenhuma thread ficar sozinha no final
+    return sorted(tarefas, key=lambda tarefa: os.path.getsize(os.path.join(diretorio, tarefa[1])), reverse=True)
+
+
+def salvar_pg(pg_manager, diretorio, linhas=LINHAS_POR_PARTE, nivel=NIVEL_GZIP):
+    """Backup das tabelas de TABELAS num snapshot só; devolve o manifesto"""
+    _preparar_diretorio(diretorio)
+    inicio = time.perf_counter()
+    destinos, colunas_por_entidade = {}, {}
+
+    def criar_destino(entidade, colunas):
+        colunas_por_entidade[entidade] = colunas
+        destinos[entidade] = _Partes(diretorio, f"{TABELAS[entidade]}.copy", linhas, nivel)
+        return destinos[entidade]
+
+    try:
+        sequencias = pg_manager.copiar_snapshot(list(TABELAS), criar_destino)
+    finally:
+        for destino in destinos.values():
+            destino.fechar()
+
+    tabelas = {}
+    for entidade, destino in destinos.items():
+        tabelas[entidade] = {"colunas": colunas_por_entidade[entidade], "partes": destino.partes,
+                             "linhas": destino.total}
+        print(f"{TABELAS[entidade]}: {destino.total} linha(s) em {len(destino.partes)} parte(s)")
+    manifesto = {"formato": FORMATO, "backend": "pg", "criado_em": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "tabelas": tabelas, "sequencias": sequencias}
+    _gravar_manifesto(diretorio, manifesto)
+    print(f"Backup do Postgres em {diretorio} ({time.perf_counter() - inicio:.1f}s)")
+    return manifesto
+
+
+def restaurar_pg(pg_manager, diretorio, workers=WORKERS, substituir=False):
+    """Carrega um backup de salvar_pg; `pg_manager` deve ter um pool de `workers` conexões"""
+    manifesto = _ler_manifesto(diretorio, "pg")
+    tabelas = manifesto["tabelas"]
+    for entidade, info in tabelas.items():
+        if entidade not in TABELAS or not all(_IDENTIFICADOR.match(coluna) for coluna in info["colunas"]):
+            raise ValueError(f"tabela ou colunas inválidas no manifesto: {entidade}")
+    nomes = [TABELAS[entidade] for entidade in tabelas]
+    inicio = time.perf_counter()
+
+    with pg_manager._cursor() as cursor:
+        if substituir:
+            cursor.execute(f"TRUNCATE {', '.join(nomes)};")
+        else:
+            for nome in nomes:
+                cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {nome});")
+                if cursor.fetchone()[0]:
+                    raise ValueError(f"{nome} não está vazia (use --substituir)")
+        cursor.execute(SQL_INDICES_SECUNDARIOS, (nomes,))
+        indices = cursor.fetchall()
+        for nome, _ in indices:
+            cursor.execute(f"DROP INDEX {nome};")
+
+    def carregar(tarefa):
+        entidade, parte = tarefa
+        with gzip.open(os.path.join(diretorio, parte), "rb") as arquivo:
+            pg_manager.restaurar_copy(entidade, tabelas[entidade]["colunas"], arquivo)
+
+    tarefas = [(entidade, parte) for entidade, info in tabelas.items() for parte in info["partes"]]
+    try:
+        _em_paralelo(carregar, _maiores_primeiro(diretorio, tarefas), workers)
+    finally:
+        # os índices voltam mesmo se a carga falhou no meio
+        with pg_manager._cursor() as cursor:
+            for _, definicao in indices:
+                cursor.execute(definicao)
+    print(f"{len(indices)} índice(s) recriado(s)")
+
+    with pg_manager._cursor() as cursor:
+        cursor.execute(f"ANALYZE {', '.join(nomes)};")
+        for entidade in tabelas:
+            if "id" not in CAMPOS[entidade]:
+                continue
+            cursor.execute(f"SELECT max({CAMPOS[entidade]['id'][0]}) FROM {TABELAS[entidade]};")
+            valores = [cursor.fetchone()[0], manifesto["sequencias"].get(entidade)]
+            valores = [valor for valor in valores if valor is not None]
+            if valores:
+                pg_manager.ajustar_sequencia(entidade, max(valores))
+    for entidade, info in tabelas.items():
+        print(f"{TABELAS[entidade]}: {info['linhas']} linha(s)")
+    print(f"Postgres restaurado de {diretorio} ({time.perf_counter() - inicio:.1f}s)")
+
+
+def _tem_snapshot(banco):
+    """Leituras snapshot precisam de replica set ou cluster sharded"""
+    try:
+        hello = banco.command("hello")
+    except Exception:
+        return False
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+
+def salvar_mongo(mongo_manager, diretorio, linhas=LINHAS_POR_PARTE, nivel=NIVEL_GZIP):
+    """Backup de todas as coleções do banco, se possível num snapshot só; devolve o manifesto"""
+    from bson import json_util
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+
+    _preparar_diretorio(diretorio)
+    inicio = time.perf_counter()
+    banco = mongo_manager.banco
+    cru = CodecOptions(document_class=RawBSONDocument)
+    sessao = None
+    if _tem_snapshot(banco):
+        sessao = mongo_manager.cliente.start_session(snapshot=True)
+    else:
+        print("Aviso: servidor sem replica set, sem leitura snapshot: "
+              "cada coleção é lida num momento diferente", file=sys.stderr)
+
+    colecoes = {}
+    try:
+        # listCollections e listIndexes não rodam em sessão snapshot
+        for nome in sorted(banco.list_collection_names()):
+            if nome.startswith("system."):
+                continue
+            colecao = banco.get_collection(nome, codec_options=cru)
+            indices = [dict(indice) for indice in banco[nome].list_indexes() if indice["name"] != "_id_"]
+            partes = _Partes(diretorio, f"{nome}.bson", linhas, nivel)
+            try:
+                for documento in colecao.find({}, session=sessao).batch_size(TAMANHO_LOTE):
+                    partes.adicionar(documento.raw)
+            finally:
+                partes.fechar()
+            colecoes[nome] = {"partes": partes.partes, "documentos": partes.total, "indices": indices}
+            print(f"{nome}: {partes.total} documento(s) em {len(partes.partes)} parte(s)")
+    finally:
+        if sessao is not None:
+            sessao.end_session()
+
+    manifesto = {"formato": FORMATO, "backend": "mongo", "criado_em": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "snapshot": sessao is not None, "colecoes": colecoes}
+    _gravar_manifesto(diretorio, manifesto, default=json_util.default)
+    print(f"Backup do MongoDB em {diretorio} ({time.perf_counter() - inicio:.1f}s)")
+    return manifesto
+
+
+def restaurar_mongo(mongo_manager, diretorio, workers=WORKERS, substituir=False):
+    """Carrega um backup de salvar_mongo; `mongo_manager` deve ser criado com
+    criar_indices=False, os índices do backup são criados depois da carga"""
+    import bson
+    from bson import json_util
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+
+    manifesto = _ler_manifesto(diretorio, "mongo", object_hook=json_util.object_hook)
+    colecoes = manifesto["colecoes"]
+    banco = mongo_manager.banco
+    inicio = time.perf_counter()
+
+    existentes = set(banco.list_collection_names())
+    for nome in colecoes:
+        if nome in existentes and not substituir and banco[nome].estimated_document_count():
+            raise ValueError(f"a coleção {nome} não está vazia (use --substituir)")
+    # coleções vazias também saem, com os índices que tiverem
+    for nome in colecoes:
+        if nome in existentes:
+            banco.drop_collection(nome)
+
+    cru = CodecOptions(document_class=RawBSONDocument)
+
+    def carregar(tarefa):
+        nome, parte = tarefa
+        with gzip.open(os.path.join(diretorio, parte), "rb") as arquivo:
+            documentos = bson.decode_all(arquivo.read(), cru)
+        # o próprio insert_many divide em mensagens do tamanho máximo do servidor
+        banco[nome].insert_many(documentos, ordered=False)
+
+    tarefas = [(nome, parte) for nome, info in colecoes.items() for parte in info["partes"]]
+    _em_paralelo(carregar, _maiores_primeiro(diretorio, tarefas), workers)
+
+    for nome, info in colecoes.items():
+        # a definição vai como está no backup, como faz o mongorestore
+        indices = [{chave: valor for chave, valor in indice.items() if chave not in ("v", "ns")}
+                   for indice in info["indices"]]
+        if indices:
+            banco.command("createIndexes", nome, indexes=indices)
+        print(f"{nome}: {info['documentos']} documento(s), {len(indices)} índice(s)")
+
+    # counters volta com o backup; o $max garante que nenhum contador fique
+    # abaixo do maior _id numérico da sua coleção
+    for nome in colecoes:
+        if nome == "counters":
+            continue
+        maior = banco[nome].find_one({"_id": {"$type": "number"}}, {"_id": 1}, sort=[("_id", -1)])
+        if maior is not None:
+            mongo_manager.ajustar_sequencia(nome, maior["_id"])
+    print(f"MongoDB restaurado de {diretorio} ({time.perf_counter() - inicio:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup e restauração dos bancos")
+    parser.add_argument("comando", choices=["salvar", "restaurar"])
+    parser.add_argument("backend", choices=["pg", "mongo"])
+    parser.add_argument("diretorio")
+    parser.add_argument("--linhas", type=int, default=LINHAS_POR_PARTE,
+                        help="salvar: linhas/documentos por parte")
+    parser.add_argument("--nivel", type=int, choices=range(1, 10), default=NIVEL_GZIP,
+                        help="salvar: nível do gzip (1 = mais rápido, 9 = menor)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="restaurar: partes carregadas em paralelo")
+    parser.add_argument("--substituir", action="store_true",
+                        help="restaurar: apaga o que já existir no destino")
+    args = parser.parse_args()
+
+    if args.backend == "pg":
+        from SQL.bd import PostgresManager, DB_CONFIG, POOL_CONFIG
+        # uma conexão por worker na restauração
+        manager = PostgresManager(DB_CONFIG, dict(POOL_CONFIG, maxconn=max(args.workers, 1)))
+    else:
+        from NOSQL.bdnosql import MongoManager, MONGO_URI
+        manager = MongoManager(MONGO_URI, criar_indices=False)
+    try:
+        if args.comando == "salvar":
+            salvar = salvar_pg if args.backend == "pg" else salvar_mongo
+            salvar(manager, args.diretorio, args.linhas, args.nivel)
+        else:
+            restaurar = restaurar_pg if args.backend == "pg" else restaurar_mongo
+            restaurar(manager, args.diretorio, args.workers, args.substituir)
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        manager.fechar_conexao()
+
+
+if __name__ == "__main__":
+    main()
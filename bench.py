@@ -0,0 +1,480 @@
+"""Benchmarks dos gerenciadores de banco (rodar a partir da raiz do repositório)
+
+    python bench.py pool --workers 1 4 8 --ops 2000
+    python bench.py prepared --ops 5000
+    python bench.py crud --backend pg mongo --linhas 5000 --concorrencia 1 8 --saida crud.json
+    python bench.py crud --backend mongo --mongomock
+    python bench.py estoque --backend pg mongo --produtos 4 --concorrencia 32 --ops 4000
+    python bench.py inicio --conectar --backend pg mongo
+    python bench.py registros --linhas 200000
+    python bench.py pipeline --latencia 0 1 5 20 --ops 500
+"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+_DEVNULL = open(os.devnull, "w")
+
+
+def _silencioso():
+    """Esconde os print() dos managers durante a medição"""
+    return redirect_stdout(_DEVNULL)
+
+
+def _medir(operacao, total, workers):
+    """Executa operacao(i) total vezes em `workers` threads e devolve ops/s"""
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(operacao, range(total)))
+    return total / (time.perf_counter() - inicio)
+
+
+def _percentil(ordenados, p):
+    """Percentil pelo método nearest-rank de uma lista já ordenada"""
+    if not ordenados:
+        return 0.0
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+def _medir_latencias(operacao, itens, workers):
+    """Executa operacao(item) para cada item e devolve throughput e p50/p95/p99 em ms"""
+    def cronometrar(item):
+        inicio = time.perf_counter()
+        resultado = operacao(item)
+        return time.perf_counter() - inicio, resultado
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        medidas = list(executor.map(cronometrar, itens))
+    total = time.perf_counter() - inicio
+    latencias = sorted(tempo * 1000 for tempo, _ in medidas)
+    estatisticas = {
+        "ops": len(medidas),
+        "ops_s": round(len(medidas) / total, 1) if total else 0.0,
+        "p50_ms": round(_percentil(latencias, 50), 3),
+        "p95_ms": round(_percentil(latencias, 95), 3),
+        "p99_ms": round(_percentil(latencias, 99), 3)
+    }
+    return estatisticas, [resultado for _, resultado in medidas]
+
+
+def _ciclo_produto(pg_manager, i):
+    id_prod = pg_manager.criar_produto(f"bench-{i}", 1.0, 1)
+    if id_prod is not None:
+        pg_manager.deletar_produto(id_prod)
+
+
+def bench_pool(args):
+    from SQL.bd import PostgresManager, DB_CONFIG
+
+    resultados = []
+    for workers in args.workers:
+        # 1 worker = conexão única (modo antigo), N workers = pool com N conexões
+        pool_config = {"minconn": workers, "maxconn": workers} if workers > 1 else None
+        pg_manager = PostgresManager(DB_CONFIG, pool_config).conectar()
+        try:
+            with _silencioso():
+                ops_s = _medir(lambda i: _ciclo_produto(pg_manager, i), args.ops, workers)
+        finally:
+            pg_manager.fechar_conexao()
+        resultados.append({"workers": workers, "ops": args.ops, "ops_s": round(ops_s, 1)})
+    print(json.dumps(resultados, indent=2))
+
+
+def bench_prepared(args):
+    from SQL.bd import PostgresManager, DB_CONFIG
+
+    resultados = []
+    for preparar in (False, True):
+        pg_manager = PostgresManager(DB_CONFIG, preparar=preparar).conectar()
+        try:
+            id_prod = pg_manager.criar_produto("bench", 1.0, 1)
+            with _silencioso():
+                # ciclo de escrita + busca por chave sem cache, tudo comando de uma linha
+                def operacao(i):
+                    pg_manager.atualizar_produto(id_prod, float(i))
+                    pg_manager._buscar_um("get_produto", "SELECT idProduto, nome, valor, quantidade "
+                                          "FROM mydb.Produto WHERE idProduto = %s;", id_prod)
+                ops_s = _medir(operacao, args.ops, 1)
+            pg_manager.deletar_produto(id_prod)
+        finally:
+            pg_manager.fechar_conexao()
+        resultados.append({"preparado": preparar, "ops": args.ops, "ops_s": round(ops_s, 1),
+                           "latencia_media_ms": round(1000 / ops_s, 3)})
+    print(json.dumps(resultados, indent=2))
+
+
+def _abrir_manager(backend, concorrencia, mongomock):
+    """Manager ainda sem conexão (ela abre no primeiro uso ou em conectar())"""
+    # cache desligado: a ideia é medir o banco, não o dicionário em memória
+    from comum.cache import CacheLeitura, CacheLRU
+    sem_cache = CacheLeitura(CacheLRU(max_itens=0))
+    if backend == "pg":
+        from SQL.bd import PostgresManager, DB_CONFIG
+        pool_config = {"minconn": concorrencia, "maxconn": concorrencia} if concorrencia > 1 else None
+        return PostgresManager(DB_CONFIG, pool_config, cache=sem_cache)
+    from NOSQL.bdnosql import MongoManager, MONGO_URI
+    cliente = None
+    if mongomock:
+        import mongomock as _mongomock
+        cliente = _mongomock.MongoClient()
+    return MongoManager(MONGO_URI, cache=sem_cache, cliente=cliente)
+
+
+def bench_crud(args):
+    relatorio = []
+    for backend in args.backend:
+        for concorrencia in args.concorrencia:
+            manager = _abrir_manager(backend, concorrencia, args.mongomock)
+            operacoes = {}
+            try:
+                manager.conectar()
+                with _silencioso():
+                    operacoes["criar"], ids = _medir_latencias(
+                        lambda i: manager.criar_produto(f"bench-{i}", 1.0, 1),
+                        range(args.linhas), concorrencia)
+                    ids = [id_prod for id_prod in ids if id_prod is not None]
+                    operacoes["ler"], _ = _medir_latencias(manager.get_produto, ids, concorrencia)
+                    operacoes["atualizar"], _ = _medir_latencias(
+                        lambda id_prod: manager.atualizar_produto(id_prod, 2.0), ids, concorrencia)
+                    inicio = time.perf_counter()
+                    lidas = sum(1 for _ in manager.iterar_produtos())
+                    duracao = time.perf_counter() - inicio
+                    operacoes["listar"] = {"linhas": lidas, "linhas_s": round(lidas / duracao, 1) if duracao else 0.0}
+                    operacoes["deletar"], _ = _medir_latencias(manager.deletar_produto, ids, concorrencia)
+            finally:
+                manager.fechar_conexao()
+            relatorio.append({"backend": backend, "linhas": args.linhas,
+                              "concorrencia": concorrencia, "operacoes": operacoes})
+    saida = json.dumps(relatorio, indent=2)
+    if args.saida:
+        with open(args.saida, "w") as arquivo:
+            arquivo.write(saida)
+    print(saida)
+
+
+def bench_estoque(args):
+    """Muitos reservadores concorrentes disputando poucos produtos "quentes".
+
+    Pede mais unidades do que existem, então parte das reservas é recusada; no
+    fim confere que o estoque bate com as reservas aceitas (sem venda a mais)."""
+    from comum.consulta import Consulta
+
+    relatorio = []
+    for backend in args.backend:
+        manager = _abrir_manager(backend, args.concorrencia, args.mongomock)
+        try:
+            manager.conectar()
+            with _silencioso():
+                ids, _ = manager.criar_produtos([(f"quente-{i}", 1.0, args.estoque) for i in range(args.produtos)])
+                sorteio = random.Random(42)
+                alvos = [sorteio.choice(ids) for _ in range(args.ops)]
+                estatisticas, restantes = _medir_latencias(
+                    lambda id_prod: manager.reservar_estoque(id_prod, 1), alvos, args.concorrencia)
+                consulta = Consulta().onde("id", "em", ids).selecionar("quantidade")
+                estoque_final = [produto["quantidade"] for produto in manager.consultar_produtos(consulta)]
+                for id_prod in ids:
+                    manager.deletar_produto(id_prod)
+        finally:
+            manager.fechar_conexao()
+        aceitas = sum(1 for restante in restantes if restante is not None)
+        estatisticas.update({
+            "aceitas": aceitas,
+            "recusadas": args.ops - aceitas,
+            "consistente": min(estoque_final) >= 0 and sum(estoque_final) == args.produtos * args.estoque - aceitas
+        })
+        relatorio.append({"backend": backend, "produtos": args.produtos, "estoque": args.estoque,
+                          "concorrencia": args.concorrencia, "reservas": estatisticas})
+    print(json.dumps(relatorio, indent=2))
+
+
+# roda num processo novo, para o import não aproveitar módulos já carregados
+_SCRIPT_IMPORT = """
+import sys, time
+inicio = time.perf_counter()
+import {modulo}
+print(time.perf_counter() - inicio, "psycopg2" in sys.modules, "pymongo" in sys.modules)
+"""
+
+
+def _medir_import(modulo, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, "-c", _SCRIPT_IMPORT.format(modulo=modulo)],
+                               capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+        tempos.append(float(saida[0]))
+    return {"modulo": modulo, "mediana_ms": round(statistics.median(tempos) * 1000, 1),
+            "psycopg2": saida[1] == "True", "pymongo": saida[2] == "True"}
+
+
+def bench_inicio(args):
+    """Tempo de import dos módulos (e se puxam os drivers), de criar os managers e,
+    com --conectar, de conectar nos backends em sequência e em paralelo"""
+    from comum.inicializacao import conectar_em_paralelo
+
+    relatorio = {"imports": [_medir_import(modulo, args.repeticoes)
+                             for modulo in ("SQL.bd", "NOSQL.bdnosql", "cli", "psycopg2", "pymongo")]}
+    with _silencioso():
+        inicio = time.perf_counter()
+        managers = [_abrir_manager(backend, 1, args.mongomock) for backend in args.backend]
+        relatorio["criar_managers_ms"] = round((time.perf_counter() - inicio) * 1000, 3)
+        for manager in managers:
+            manager.fechar_conexao()
+    if args.conectar:
+        with _silencioso():
+            managers = [_abrir_manager(backend, 1, args.mongomock) for backend in args.backend]
+            inicio = time.perf_counter()
+            duracoes = []
+            for manager in managers:
+                antes = time.perf_counter()
+                manager.conectar()
+                duracoes.append(time.perf_counter() - antes)
+            sequencial = time.perf_counter() - inicio
+            for manager in managers:
+                manager.fechar_conexao()
+            managers = [_abrir_manager(backend, 1, args.mongomock) for backend in args.backend]
+            inicio = time.perf_counter()
+            conectar_em_paralelo(*managers)
+            paralelo = time.perf_counter() - inicio
+            for manager in managers:
+                manager.fechar_conexao()
+        relatorio["conectar_ms"] = {
+            "por_backend": {backend: round(duracao * 1000, 1) for backend, duracao in zip(args.backend, duracoes)},
+            "sequencial": round(sequencial * 1000, 1),
+            "paralelo": round(paralelo * 1000, 1)
+        }
+    print(json.dumps(relatorio, indent=2))
+
+
+class _ProxyLatencia:
+    """Proxy TCP local que atrasa cada trecho em `atraso_ms / 2` em cada sentido,
+    simulando um banco a `atraso_ms` de ida e volta (RTT)"""
+
+    def __init__(self, destino, atraso_ms):
+        self.destino = destino
+        self.atraso = atraso_ms / 2000
+        self._servidor = socket.create_server(("127.0.0.1", 0))
+        self.porta = self._servidor.getsockname()[1]
+        threading.Thread(target=self._aceitar, daemon=True).start()
+
+    def _aceitar(self):
+        while True:
+            try:
+                cliente, _ = self._servidor.accept()
+            except OSError:
+                return  # servidor fechado
+            banco = socket.create_connection(self.destino)
+            for origem, alvo in ((cliente, banco), (banco, cliente)):
+                threading.Thread(target=self._repassar, args=(origem, alvo), daemon=True).start()
+
+    def _repassar(self, origem, alvo):
+        """Lê de `origem` e entrega em `alvo` `atraso` segundos depois, sem segurar
+        a leitura (trechos seguidos atrasam o mesmo tanto, não se somam)"""
+        fila = queue.Queue()
+
+        def entregar():
+            while True:
+                momento, dados = fila.get()
+                espera = momento - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                try:
+                    if not dados:
+                        alvo.shutdown(1)  # SHUT_WR
+                        return
+                    alvo.sendall(dados)
+                except OSError:
+                    return
+
+        threading.Thread(target=entregar, daemon=True).start()
+        while True:
+            try:
+                dados = origem.recv(65536)
+            except OSError:
+                dados = b""
+            fila.put((time.perf_counter() + self.atraso, dados))
+            if not dados:
+                return
+
+    def fechar(self):
+        self._servidor.close()
+
+
+def bench_pipeline(args):
+    """Escritas um a um x pelo Pipeline, com o banco atrás de um proxy que
+    simula cada latência pedida. Cada operação do ciclo cria, atualiza e
+    deleta um produto (3 escritas)."""
+    from SQL.bd import PostgresManager, DB_CONFIG
+
+    destino = (DB_CONFIG["host"] or "localhost", int(DB_CONFIG["port"] or 5432))
+    relatorio = []
+    for latencia in args.latencia:
+        proxy = _ProxyLatencia(destino, latencia)
+        pg_manager = PostgresManager(dict(DB_CONFIG, host="127.0.0.1", port=proxy.porta)).conectar()
+        resultado = {"latencia_ms": latencia, "ops": args.ops * 3}
+        try:
+            with _silencioso():
+                inicio = time.perf_counter()
+                for i in range(args.ops):
+                    id_prod = pg_manager.criar_produto(f"bench-{i}", 1.0, 1)
+                    pg_manager.atualizar_produto(id_prod, 2.0)
+                    pg_manager.deletar_produto(id_prod)
+                resultado["um_a_um_ops_s"] = round(args.ops * 3 / (time.perf_counter() - inicio), 1)
+
+                inicio = time.perf_counter()
+                with pg_manager.pipeline(args.lote) as pipe:
+                    criados = [pipe.criar_produto(f"bench-{i}", 1.0, 1) for i in range(args.ops)]
+                ids = [pipe.resultados[indice] for indice in criados]
+                with pg_manager.pipeline(args.lote) as pipe:
+                    for id_prod in ids:
+                        pipe.atualizar_produto(id_prod, 2.0)
+                    for id_prod in ids:
+                        pipe.deletar_produto(id_prod)
+                resultado["pipeline_ops_s"] = round(args.ops * 3 / (time.perf_counter() - inicio), 1)
+        finally:
+            pg_manager.fechar_conexao()
+            proxy.fechar()
+        resultado["ganho"] = round(resultado["pipeline_ops_s"] / resultado["um_a_um_ops_s"], 1)
+        relatorio.append(resultado)
+    print(json.dumps(relatorio, indent=2))
+
+
+def _medir_montagem(montar, repeticoes):
+    """Melhor tempo de montar() e memória (tracemalloc) do que ela devolve"""
+    import gc
+    import tracemalloc
+
+    tempos = []
+    for _ in range(repeticoes):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = montar()
+        tempos.append(time.perf_counter() - inicio)
+        del resultado
+    gc.collect()
+    tracemalloc.start()
+    resultado = montar()
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return min(tempos), memoria, len(resultado)
+
+
+def bench_registros(args):
+    """Montagem das linhas lidas, com dados sintéticos (não precisa de banco):
+
+    - Postgres: tupla do driver x dict por linha x Produto (comum/registros.py),
+      que é o que o CursorRegistro monta;
+    - MongoDB: documento completo decodificado em dict (como era) x documento
+      projetado (só os campos do registro vêm do servidor) virando Produto x
+      RawBSONDocument, que adia o decode mas decodifica tudo no primeiro acesso."""
+    from itertools import starmap
+
+    import bson
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+    from comum.registros import Produto
+
+    n = args.linhas
+    linhas = [(i, f"produto {i}", i * 1.5, i % 100) for i in range(n)]
+    colunas = Produto.__slots__
+    documentos = [{"_id": i, "nome": f"produto {i}", "valor": i * 1.5, "quantidade": i % 100,
+                   "descricao": "descrição longa " * 10, "tags": ["a", "b", "c"],
+                   "fornecedor": {"nome": "fornecedor", "cnpj": "00.000.000/0001-00"}}
+                  for i in range(n)]
+    completos = b"".join(map(bson.encode, documentos))
+    projetados = b"".join(bson.encode({campo: doc[campo] for campo in Produto.CAMPOS_MONGO})
+                          for doc in documentos)
+    raw = CodecOptions(document_class=RawBSONDocument)
+
+    cenarios = {
+        "pg": {
+            # tupla nova por linha, como o driver entrega (tuple() devolveria a mesma)
+            "tupla": lambda: [(a, b, c, d) for a, b, c, d in linhas],
+            "dict": lambda: [dict(zip(colunas, linha)) for linha in linhas],
+            "registro": lambda: list(starmap(Produto, linhas))
+        },
+        "mongo": {
+            "dict_completo": lambda: bson.decode_all(completos),
+            "projetado_registro": lambda: list(map(Produto.de_documento, bson.decode_all(projetados))),
+            "rawbson_registro": lambda: list(map(Produto.de_documento, bson.decode_all(completos, raw)))
+        }
+    }
+    relatorio = {"linhas": n, "bytes_bson": {"completo": len(completos), "projetado": len(projetados)}}
+    for backend, montagens in cenarios.items():
+        relatorio[backend] = {}
+        for nome, montar in montagens.items():
+            segundos, memoria, total = _medir_montagem(montar, args.repeticoes)
+            relatorio[backend][nome] = {"ms": round(segundos * 1000, 1),
+                                        "ns_por_linha": round(segundos / total * 1e9),
+                                        "bytes_por_linha": round(memoria / total)}
+    print(json.dumps(relatorio, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do CRUD Postgres/MongoDB")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("pool", help="ops/s do PostgresManager com 1 vs N workers")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    p.add_argument("--ops", type=int, default=2000)
+    p.set_defaults(func=bench_pool)
+
+    p = sub.add_parser("prepared", help="PREPARE/EXECUTE vs SQL literal no PostgresManager")
+    p.add_argument("--ops", type=int, default=5000)
+    p.set_defaults(func=bench_prepared)
+
+    p = sub.add_parser("crud", help="criar/ler/atualizar/deletar com throughput e p50/p95/p99 em JSON")
+    p.add_argument("--backend", choices=["pg", "mongo"], nargs="+", default=["pg", "mongo"])
+    p.add_argument("--linhas", type=int, default=2000)
+    p.add_argument("--concorrencia", type=int, nargs="+", default=[1])
+    p.add_argument("--mongomock", action="store_true", help="usa mongomock no lugar de um mongod")
+    p.add_argument("--saida", help="grava o JSON também neste arquivo")
+    p.set_defaults(func=bench_crud)
+
+    p = sub.add_parser("estoque", help="reservar_estoque com muitos reservadores em poucos produtos")
+    p.add_argument("--backend", choices=["pg", "mongo"], nargs="+", default=["pg", "mongo"])
+    p.add_argument("--produtos", type=int, default=4, help="produtos disputados")
+    p.add_argument("--estoque", type=int, default=500, help="estoque inicial de cada produto")
+    p.add_argument("--ops", type=int, default=4000, help="reservas de 1 unidade")
+    p.add_argument("--concorrencia", type=int, default=32)
+    p.add_argument("--mongomock", action="store_true", help="usa mongomock no lugar de um mongod")
+    p.set_defaults(func=bench_estoque)
+
+    p = sub.add_parser("inicio", help="tempo de import, de criar os managers e de conectar")
+    p.add_argument("--backend", choices=["pg", "mongo"], nargs="+", default=["pg", "mongo"])
+    p.add_argument("--repeticoes", type=int, default=5, help="processos por medição de import")
+    p.add_argument("--conectar", action="store_true", help="mede também a conexão (sequencial x paralela)")
+    p.add_argument("--mongomock", action="store_true", help="usa mongomock no lugar de um mongod")
+    p.set_defaults(func=bench_inicio)
+
+    p = sub.add_parser("registros", help="memória e tempo de montar linhas: tupla/dict/registro e decode BSON")
+    p.add_argument("--linhas", type=int, default=100000)
+    p.add_argument("--repeticoes", type=int, default=3)
+    p.set_defaults(func=bench_registros)
+
+    p = sub.add_parser("pipeline", help="escritas um a um x Pipeline com latência de rede simulada")
+    p.add_argument("--latencia", type=float, nargs="+", default=[0, 1, 5, 20],
+                   help="ida e volta simulada, em ms")
+    p.add_argument("--ops", type=int, default=500, help="ciclos criar/atualizar/deletar")
+    p.add_argument("--lote", type=int, default=1000, help="operações por envio do Pipeline")
+    p.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
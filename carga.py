@@ -0,0 +1,132 @@
+"""Carga em paralelo com vários processos (um manager, e uma conexão, por processo)
+
+    python cli.py produtos import produtos.csv --backend pg --workers 4
+    python NOSQL/bdnosql.py usuarios import usuarios.jsonl --workers 8 --lote 5000
+
+Um processo só não passa de alguns milhares de linhas/s, bem abaixo do que o
+Postgres e o MongoDB absorvem. Aqui o processo principal lê o arquivo em
+streaming e o parte em blocos de `lote` registros, que vão para uma fila
+limitada: com a fila cheia a leitura espera (backpressure), então a memória
+fica em torno de 2 blocos por worker, seja qual for o tamanho do arquivo.
+Cada worker grava os blocos que pega com COPY (Postgres, ver
+PostgresManager.copiar) ou insert_many (MongoDB, via criar_* em lote). Os
+resultados voltam por outra fila e são somados no principal, com a posição
+global de cada linha que falhou.
+"""
+
+import multiprocessing
+import os
+import queue
+from contextlib import redirect_stdout
+from itertools import islice
+
+
+def _abrir_manager(backend):
+    # conexão única: cada worker é um processo com a sua
+    if backend == "pg":
+        from SQL.bd import PostgresManager, DB_CONFIG
+        return PostgresManager(DB_CONFIG)
+    from NOSQL.bdnosql import MongoManager, MONGO_URI
+    return MongoManager(MONGO_URI, criar_indices=False)
+
+
+def _gravar(manager, backend, entidade, tuplas):
+    """Devolve (criadas, falhas) com as posições das falhas relativas ao bloco"""
+    if backend == "pg":
+        return manager.copiar(entidade, tuplas)
+    ids, falhas = getattr(manager, f"criar_{entidade}")(tuplas, len(tuplas))
+    return len(ids) - len(falhas), falhas
+
+
+def _worker(backend, entidade, entrada, saida):
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        manager = _abrir_manager(backend)
+        try:
+            while True:
+                bloco = entrada.get()
+                if bloco is None:
+                    break
+                inicio, tuplas = bloco
+                try:
+                    criadas, falhas = _gravar(manager, backend, entidade, tuplas)
+                except Exception as e:
+                    criadas, falhas = 0, [(i, str(e)) for i in range(len(tuplas))]
+                saida.put((inicio, criadas, [(inicio + i, erro) for i, erro in falhas]))
+        finally:
+            manager.fechar_conexao()
+
+
+def carregar(backend, entidade, tuplas, workers=4, lote=1000, progresso=None):
+    """Grava as tuplas de criar_{entidade} usando `workers` processos.
+
+    `progresso(lidas, criadas, falhas)` é chamado a cada bloco concluído.
+    Devolve (lidas, criadas, falhas), com falhas como lista ordenada de
+    (posição na entrada, mensagem)."""
+    entrada = multiprocessing.Queue(maxsize=workers * 2)
+    saida = multiprocessing.Queue()
+    processos = [multiprocessing.Process(target=_worker, args=(backend, entidade, entrada, saida), daemon=True)
+                 for _ in range(workers)]
+    for processo in processos:
+        processo.start()
+
+    lidas = criadas = 0
+    falhas = []
+    pendentes = {}  # início do bloco -> tamanho, até o worker responder
+
+    def receber(espera):
+        nonlocal lidas, criadas
+        try:
+            inicio, criadas_bloco, falhas_bloco = saida.get(timeout=espera)
+        except queue.Empty:
+            return False
+        lidas += pendentes.pop(inicio)
+        criadas += criadas_bloco
+        falhas.extend(falhas_bloco)
+        if progresso:
+            progresso(lidas, criadas, len(falhas))
+        return True
+
+    def vivos():
+        return any(processo.is_alive() for processo in processos)
+
+    def enviar(item):
+        # put() com a fila cheia espera: a leitura anda no ritmo dos workers
+        while True:
+            try:
+                entrada.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                while receber(0):
+                    pass
+                if not vivos():
+                    return False
+
+    try:
+        tuplas = iter(tuplas)
+        inicio = 0
+        while vivos():
+            bloco = list(islice(tuplas, lote))
+            if not bloco:
+                break
+            pendentes[inicio] = len(bloco)
+            if not enviar((inicio, bloco)):
+                break
+            inicio += len(bloco)
+            while receber(0):
+                pass
+        for _ in processos:
+            enviar(None)
+        while pendentes:
+            if not receber(0.5) and not vivos():
+                break
+        # worker que morreu no meio (ex.: sem memória): os blocos sem resposta contam como falha
+        for inicio, tamanho in sorted(pendentes.items()):
+            lidas += tamanho
+            falhas.extend((inicio + i, "worker terminou sem gravar o bloco") for i in range(tamanho))
+    finally:
+        for processo in processos:
+            processo.join(timeout=5)
+            if processo.is_alive():
+                processo.terminate()
+    falhas.sort()
+    return lidas, criadas, falhas
@@ -0,0 +1,201 @@
+"""Modo não interativo (scriptável) dos CRUDs
+
+    python cli.py produtos import produtos.csv --backend pg
+    python cli.py usuarios import usuarios.jsonl --backend mongo --lote 5000
+    python cli.py enderecos listar --backend pg > enderecos.jsonl
+    python cli.py produtos import produtos.csv --backend pg --workers 4
+    python cli.py produtos exportar produtos.parquet --backend pg --copy-binario
+    python cli.py enderecos relatorio --backend mongo --agrupar cidade bairro
+    python cli.py produtos relatorio --backend pg --resumo
+
+Também dá para chamar pelos scripts de cada banco, que já sabem o backend:
+
+    python SQL/bd.py produtos import produtos.csv
+    python NOSQL/bdnosql.py produtos import produtos.csv
+
+A importação lê o arquivo (CSV com cabeçalho ou JSONL; `-` para stdin) em
+streaming e envia pelos métodos criar_* em lote, mostrando progresso e
+throughput no stderr. Linhas que falham são listadas no stderr e o código de
+saída fica 1. Com --workers N a gravação é dividida entre N processos (ver
+carga.py), com COPY no Postgres. O exportar grava Parquet ou Arrow IPC em lotes
+(ver exportacao.py). O relatorio escreve em JSONL as métricas agregadas no banco
+(ver comum/relatorios.py).
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+from decimal import Decimal
+from itertools import islice
+
+# campos de cada entidade, na ordem dos argumentos de criar_*
+CAMPOS = {
+    "usuarios": ("cpf", "nome", "email"),
+    "produtos": ("nome", "valor", "quantidade"),
+    "enderecos": ("rua", "numero", "bairro", "cidade", "cep", "complemento")
+}
+# nomes alternativos aceitos no arquivo (a coluna do Postgres é "bairo")
+APELIDOS = {"bairo": "bairro"}
+
+
+def abrir_manager(backend):
+    if backend == "pg":
+        from SQL.bd import PostgresManager, DB_CONFIG, POOL_CONFIG
+        return PostgresManager(DB_CONFIG, POOL_CONFIG)
+    from NOSQL.bdnosql import MongoManager, MONGO_URI
+    return MongoManager(MONGO_URI)
+
+
+def ler_registros(caminho, formato=None):
+    """Gera dicts do arquivo CSV/JSONL, uma linha por vez"""
+    if formato is None:
+        formato = "jsonl" if caminho.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+    arquivo = sys.stdin if caminho == "-" else open(caminho, newline="", encoding="utf-8")
+    try:
+        if formato == "csv":
+            yield from csv.DictReader(arquivo)
+        else:
+            for linha in arquivo:
+                if linha.strip():
+                    yield json.loads(linha)
+    finally:
+        if arquivo is not sys.stdin:
+            arquivo.close()
+
+
+def para_tupla(entidade, registro):
+    registro = {APELIDOS.get(chave, chave): valor for chave, valor in registro.items()}
+    return tuple(registro.get(campo) for campo in CAMPOS[entidade])
+
+
+def _mostrar_progresso(lidas, criadas, falhas, inicio):
+    duracao = time.perf_counter() - inicio
+    print(f"\r{lidas} linha(s) lidas, {criadas} criada(s), {falhas} falha(s), "
+          f"{lidas / duracao:.0f} linhas/s", end="", file=sys.stderr)
+
+
+def _relatar_falhas(falhas):
+    print(file=sys.stderr)
+    for indice, erro in falhas:
+        print(f"Registro {indice + 1}: {erro}", file=sys.stderr)
+    return 1 if falhas else 0
+
+
+def importar(manager, entidade, caminho, formato=None, lote=1000):
+    criar_em_lote = getattr(manager, f"criar_{entidade}")
+    tuplas = (para_tupla(entidade, registro) for registro in ler_registros(caminho, formato))
+    total = criadas = 0
+    falhas = []
+    inicio = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        while True:
+            bloco = list(islice(tuplas, lote))
+            if not bloco:
+                break
+            with redirect_stdout(devnull):
+                ids, falhas_bloco = criar_em_lote(bloco, lote)
+            falhas.extend((total + indice, erro) for indice, erro in falhas_bloco)
+            total += len(bloco)
+            criadas += len(ids) - len(falhas_bloco)
+            _mostrar_progresso(total, criadas, len(falhas), inicio)
+    return _relatar_falhas(falhas)
+
+
+def importar_em_paralelo(backend, entidade, caminho, formato=None, lote=1000, workers=4):
+    """Como importar(), mas gravando com `workers` processos (carga.py)"""
+    from carga import carregar
+
+    tuplas = (para_tupla(entidade, registro) for registro in ler_registros(caminho, formato))
+    inicio = time.perf_counter()
+    _, _, falhas = carregar(backend, entidade, tuplas, workers, lote,
+                            lambda lidas, criadas, falhas: _mostrar_progresso(lidas, criadas, falhas, inicio))
+    return _relatar_falhas(falhas)
+
+
+def _serializavel(valor):
+    return float(valor) if isinstance(valor, Decimal) else valor
+
+
+def listar(manager, entidade):
+    """Escreve os registros em JSONL no stdout, em streaming (mesmos campos nos dois backends)"""
+    for registro in getattr(manager, f"iterar_{entidade}")():
+        print(json.dumps({campo: _serializavel(valor) for campo, valor in registro.como_dict().items()},
+                         ensure_ascii=False))
+    return 0
+
+
+def relatorio(manager, entidade, agrupar, resumo=False):
+    """Escreve em JSONL as linhas do relatório agregado no banco"""
+    for linha in manager.relatorio(entidade, agrupar, resumo=resumo):
+        print(json.dumps({campo: _serializavel(valor) for campo, valor in linha.items()}, ensure_ascii=False))
+    return 0
+
+
+def exportar(manager, entidade, caminho, formato=None, lote=None, copy_binario=False, compressao=None):
+    """Grava a entidade inteira em Parquet/Arrow (exportacao.py), com progresso no stderr"""
+    import exportacao
+
+    inicio = time.perf_counter()
+
+    def progresso(linhas):
+        duracao = time.perf_counter() - inicio
+        print(f"\r{linhas} linha(s) exportadas, {linhas / duracao:.0f} linhas/s", end="", file=sys.stderr)
+
+    total = exportacao.exportar(manager, entidade, caminho, formato, lote=lote or exportacao.TAMANHO_LOTE,
+                                copy_binario=copy_binario, compressao=compressao, progresso=progresso)
+    print(f"\r{total} linha(s) exportadas para {caminho}", file=sys.stderr)
+    return 0
+
+
+def main(argv=None, backend=None):
+    parser = argparse.ArgumentParser(description="CRUD não interativo para Postgres/MongoDB")
+    parser.add_argument("entidade", choices=list(CAMPOS))
+    parser.add_argument("acao", choices=["import", "listar", "exportar", "relatorio"])
+    parser.add_argument("arquivo", nargs="?", help="import: CSV com cabeçalho ou JSONL (- para stdin); "
+                                                   "exportar: arquivo .parquet ou .arrow")
+    if backend is None:
+        parser.add_argument("--backend", choices=["pg", "mongo"], required=True)
+    parser.add_argument("--formato", choices=["csv", "jsonl", "parquet", "arrow"],
+                        help="padrão: pela extensão do arquivo")
+    parser.add_argument("--lote", type=int, help="linhas por bloco (padrão: 1000 no import, 65536 no exportar)")
+    parser.add_argument("--workers", type=int, default=1, help="import: processos gravando em paralelo")
+    parser.add_argument("--copy-binario", action="store_true",
+                        help="exportar: lê do Postgres com COPY (FORMAT binary)")
+    parser.add_argument("--compressao", help="exportar: codec (ex.: snappy, zstd, lz4)")
+    parser.add_argument("--agrupar", nargs="+", default=[], help="relatorio: campos de agrupamento")
+    parser.add_argument("--resumo", action="store_true", help="relatorio: lê a tabela/coleção de resumo")
+    args = parser.parse_args(argv)
+    backend = backend or args.backend
+    if args.acao in ("import", "exportar") and not args.arquivo:
+        parser.error(f"{args.acao} precisa do arquivo")
+    if args.acao == "exportar" and args.formato in ("csv", "jsonl"):
+        parser.error("exportar grava parquet ou arrow")
+    if args.acao == "import" and args.formato in ("parquet", "arrow"):
+        parser.error("import lê csv ou jsonl")
+    lote = args.lote or 1000
+
+    if args.acao == "import" and args.workers > 1:
+        return importar_em_paralelo(backend, args.entidade, args.arquivo, args.formato, lote, args.workers)
+
+    with redirect_stdout(sys.stderr):
+        manager = abrir_manager(backend)
+    try:
+        if args.acao == "import":
+            return importar(manager, args.entidade, args.arquivo, args.formato, lote)
+        if args.acao == "relatorio":
+            return relatorio(manager, args.entidade, args.agrupar, args.resumo)
+        if args.acao == "exportar":
+            return exportar(manager, args.entidade, args.arquivo, args.formato, args.lote,
+                            args.copy_binario, args.compressao)
+        return listar(manager, args.entidade)
+    finally:
+        with redirect_stdout(sys.stderr):
+            manager.fechar_conexao()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
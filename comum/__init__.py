@@ -0,0 +1 @@
+"""Código compartilhado entre SQL/bd.py e NOSQL/bdnosql.py"""
@@ -0,0 +1,102 @@
+"""Cache read-through para as buscas por chave (get_usuario/get_produto/get_endereco)"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+AUSENTE = object()  # marca "não está no cache" (None é um valor válido para o backend)
+
+
+class CacheLRU:
+    """Backend em memória com TTL e despejo LRU, seguro para várias threads"""
+
+    def __init__(self, max_itens=1024, ttl=30.0):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return AUSENTE
+            expira_em, valor = item
+            if expira_em < time.monotonic():
+                del self._itens[chave]
+                return AUSENTE
+            self._itens.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor):
+        if self.max_itens <= 0:
+            return
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + self.ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def delete(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def __len__(self):
+        return len(self._itens)
+
+
+class CacheRedis:
+    """Backend compartilhado entre processos sobre um cliente redis-py (redis.Redis)"""
+
+    def __init__(self, cliente, ttl=30.0, prefixo="crud:"):
+        self.cliente = cliente
+        self.ttl = ttl
+        self.prefixo = prefixo
+
+    def get(self, chave):
+        dado = self.cliente.get(self.prefixo + chave)
+        return AUSENTE if dado is None else pickle.loads(dado)
+
+    def set(self, chave, valor):
+        self.cliente.set(self.prefixo + chave, pickle.dumps(valor), px=int(self.ttl * 1000))
+
+    def delete(self, chave):
+        self.cliente.delete(self.prefixo + chave)
+
+
+class CacheLeitura:
+    """Read-through sobre um backend (CacheLRU, CacheRedis ou qualquer objeto com
+    get/set/delete), contando hits e misses para dimensionar o cache."""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else CacheLRU()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave, carregar):
+        """Devolve o valor do cache ou chama carregar(); None não é guardado"""
+        valor = self.backend.get(chave)
+        if valor is not AUSENTE:
+            with self._lock:
+                self.hits += 1
+            return valor
+        with self._lock:
+            self.misses += 1
+        valor = carregar()
+        if valor is not None:
+            self.backend.set(chave, valor)
+        return valor
+
+    def invalidar(self, chave):
+        self.backend.delete(chave)
+
+    def estatisticas(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "itens": len(self.backend) if hasattr(self.backend, "__len__") else None
+        }
@@ -0,0 +1,164 @@
+"""Construtor de consultas com filtro, ordenação, limite e projeção
+
+Uma Consulta descreve o que se quer em termos dos campos lógicos de cada
+entidade, e é traduzida para SQL parametrizado (para_sql) ou para filtro e
+projeção do MongoDB (para_mongo):
+
+    consulta = (Consulta()
+                .onde("valor", "entre", (10, 50))
+                .onde("quantidade", ">", 0)
+                .onde("nome", "prefixo", "Arroz")
+                .selecionar("id", "nome", "valor")
+                .ordenar("valor", desc=True)
+                .limitar(100))
+    for produto in pg_manager.consultar_produtos(consulta): ...
+
+Só nomes de campo conhecidos (ver CAMPOS) entram no SQL; valores vão sempre
+como parâmetros.
+"""
+
+import re
+
+# campo lógico -> (coluna no Postgres, campo no MongoDB)
+CAMPOS = {
+    "usuarios": {
+        "cpf": ("cpf", "_id"),
+        "nome": ("nome", "nome"),
+        "email": ("email", "email")
+    },
+    "produtos": {
+        "id": ("idProduto", "_id"),
+        "nome": ("nome", "nome"),
+        "valor": ("valor", "valor"),
+        "quantidade": ("quantidade", "quantidade")
+    },
+    "enderecos": {
+        "id": ("idEndereco", "_id"),
+        "rua": ("rua", "rua"),
+        "numero": ("numero", "numero"),
+        "bairro": ("bairo", "bairro"),
+        "cidade": ("cidade", "cidade"),
+        "cep": ("cep", "cep"),
+        "complemento": ("complemento", "complemento")
+    }
+}
+
+TABELAS = {"usuarios": "mydb.Usuario", "produtos": "mydb.Produto", "enderecos": "mydb.Endereco"}
+
+_OPERADORES_SQL = {"=": "=", "!=": "<>", ">": ">", ">=": ">=", "<": "<", "<=": "<="}
+_OPERADORES_MONGO = {"=": "$eq", "!=": "$ne", ">": "$gt", ">=": "$gte", "<": "$lt", "<=": "$lte"}
+OPERADORES = tuple(_OPERADORES_SQL) + ("entre", "prefixo", "em")
+
+
+class Consulta:
+    def __init__(self):
+        self.filtros = []   # (campo, operador, valor)
+        self.campos = None  # None = todos
+        self.ordem = []     # (campo, desc)
+        self.limite = None
+
+    def onde(self, campo, operador, valor):
+        if operador not in OPERADORES:
+            raise ValueError(f"Operador inválido: {operador}")
+        self.filtros.append((campo, operador, valor))
+        return self
+
+    def selecionar(self, *campos):
+        self.campos = list(campos)
+        return self
+
+    def ordenar(self, campo, desc=False):
+        self.ordem.append((campo, desc))
+        return self
+
+    def limitar(self, limite):
+        self.limite = int(limite)
+        return self
+
+    def campos_de(self, entidade):
+        """Campos pedidos (ou todos), validados contra CAMPOS"""
+        conhecidos = CAMPOS[entidade]
+        campos = self.campos or list(conhecidos)
+        usados = campos + [c for c, _, _ in self.filtros] + [c for c, _ in self.ordem]
+        for campo in usados:
+            if campo not in conhecidos:
+                raise ValueError(f"Campo desconhecido em {entidade}: {campo}")
+        return campos
+
+
+def _escapar_like(texto):
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def filtro_sql(consulta, entidade):
+    """Devolve (condicoes, params) dos filtros da Consulta, para juntar com AND num WHERE"""
+    coluna = {campo: colunas[0] for campo, colunas in CAMPOS[entidade].items()}
+    condicoes, params = [], []
+    for campo, operador, valor in consulta.filtros:
+        if operador == "entre":
+            condicoes.append(f"{coluna[campo]} BETWEEN %s AND %s")
+            params.extend(valor)
+        elif operador == "prefixo":
+            condicoes.append(f"{coluna[campo]} LIKE %s")
+            params.append(_escapar_like(valor) + "%")
+        elif operador == "em":
+            condicoes.append(f"{coluna[campo]} = ANY(%s)")
+            params.append(list(valor))
+        else:
+            condicoes.append(f"{coluna[campo]} {_OPERADORES_SQL[operador]} %s")
+            params.append(valor)
+    return condicoes, params
+
+
+def para_sql(consulta, entidade):
+    """Devolve (sql, params, campos) para executar no psycopg2"""
+    campos = consulta.campos_de(entidade)
+    coluna = {campo: colunas[0] for campo, colunas in CAMPOS[entidade].items()}
+    condicoes, params = filtro_sql(consulta, entidade)
+    sql = f"SELECT {', '.join(coluna[c] for c in campos)} FROM {TABELAS[entidade]}"
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    if consulta.ordem:
+        sql += " ORDER BY " + ", ".join(f"{coluna[c]}{' DESC' if desc else ''}" for c, desc in consulta.ordem)
+    if consulta.limite is not None:
+        sql += " LIMIT %s"
+        params.append(consulta.limite)
+    return sql, params, campos
+
+
+def filtro_mongo(consulta, entidade):
+    """Filtro do MongoDB equivalente aos filtros da Consulta (todos em AND, como no SQL)"""
+    nome = {campo: colunas[1] for campo, colunas in CAMPOS[entidade].items()}
+    filtro = {}
+    extras = []
+    for campo, operador, valor in consulta.filtros:
+        if operador == "entre":
+            condicao = {"$gte": valor[0], "$lte": valor[1]}
+        elif operador == "prefixo":
+            # regex ancorada no início consegue usar índice
+            condicao = {"$regex": "^" + re.escape(valor)}
+        elif operador == "em":
+            condicao = {"$in": list(valor)}
+        else:
+            condicao = {_OPERADORES_MONGO[operador]: valor}
+        existente = filtro.setdefault(nome[campo], {})
+        if existente.keys() & condicao.keys():
+            # o mesmo operador duas vezes no campo: juntar no dict trocaria um valor pelo outro
+            extras.append({nome[campo]: condicao})
+        else:
+            existente.update(condicao)
+    if extras:
+        filtro["$and"] = extras
+    return filtro
+
+
+def para_mongo(consulta, entidade):
+    """Devolve (filtro, projecao, sort, limite, campos) para o find() do pymongo"""
+    campos = consulta.campos_de(entidade)
+    nome = {campo: colunas[1] for campo, colunas in CAMPOS[entidade].items()}
+    filtro = filtro_mongo(consulta, entidade)
+    projecao = {nome[c]: 1 for c in campos}
+    if "_id" not in projecao:
+        projecao["_id"] = 0
+    sort = [(nome[c], -1 if desc else 1) for c, desc in consulta.ordem]
+    return filtro, projecao, sort, consulta.limite, campos
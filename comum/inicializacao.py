@@ -0,0 +1,69 @@
+"""Inicialização rápida: imports de driver adiados e conexão em paralelo
+
+    psycopg2 = ModuloPreguicoso("psycopg2")   # nada é importado aqui
+    psycopg2.connect(...)                     # importa no primeiro uso
+
+    conectar_em_paralelo(pg_manager, mongo_manager)
+"""
+
+import importlib
+import threading
+import time
+
+
+class ModuloPreguicoso:
+    """Módulo que só é importado no primeiro acesso a um atributo.
+
+    Submódulos também são importados sob demanda (psycopg2.extras,
+    pymongo.errors). Cada atributo resolvido fica guardado na instância, então
+    os acessos seguintes não passam mais por __getattr__."""
+
+    def __init__(self, nome):
+        self._nome = nome
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if atributo.startswith("__"):
+            raise AttributeError(atributo)
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nome)
+        try:
+            valor = getattr(self._modulo, atributo)
+        except AttributeError:
+            try:
+                valor = importlib.import_module(f"{self._nome}.{atributo}")
+            except ModuleNotFoundError:
+                raise AttributeError(f"módulo {self._nome} não tem atributo {atributo}") from None
+        setattr(self, atributo, valor)
+        return valor
+
+    def __repr__(self):
+        estado = "importado" if self._modulo is not None else "ainda não importado"
+        return f"<ModuloPreguicoso {self._nome} ({estado})>"
+
+
+def conectar_em_paralelo(*managers):
+    """Chama conectar() de cada manager numa thread própria e espera todos.
+
+    Devolve a duração de cada conexão em segundos, na ordem dos managers; se
+    alguma falhar, a primeira exceção é levantada depois que todas terminarem."""
+    duracoes = [None] * len(managers)
+    erros = []
+
+    def conectar(i, manager):
+        inicio = time.perf_counter()
+        try:
+            manager.conectar()
+        except BaseException as e:
+            erros.append(e)
+        finally:
+            duracoes[i] = time.perf_counter() - inicio
+
+    threads = [threading.Thread(target=conectar, args=(i, manager)) for i, manager in enumerate(managers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if erros:
+        raise erros[0]
+    return duracoes
@@ -0,0 +1,233 @@
+"""Métricas por operação (latência, linhas, erros) para os managers
+
+    metricas = Metricas(limite_lento_ms=200)
+    instrumentar(pg_manager, "pg", metricas)
+    print(metricas.exportar_prometheus())
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+# limites dos buckets do histograma, em segundos
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# métodos embrulhados por instrumentar()
+PREFIXOS_CRUD = ("criar_", "ler_", "iterar_", "get_", "consultar", "relatorio", "atualizar_", "deletar_",
+                 "reservar_")
+
+# geradores de ID que casam com os prefixos mas não são operações CRUD
+# (já são medidos dentro do criar_* que os chama)
+FORA_DO_CRUD = ("get_next_sequence", "reservar_sequencia", "reservar_ids")
+
+log_lento = logging.getLogger("crud.lento")
+
+
+class _Serie:
+    __slots__ = ("buckets", "soma", "total", "linhas", "erros")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.soma = 0.0
+        self.total = 0
+        self.linhas = 0
+        self.erros = defaultdict(int)  # tipo da exceção -> quantidade
+
+
+class Metricas:
+    """Acumula latência, linhas e erros por (backend, operação); seguro para threads"""
+
+    def __init__(self, limite_lento_ms=None):
+        self.limite_lento_ms = limite_lento_ms
+        self._series = defaultdict(_Serie)
+        self._lock = threading.Lock()
+
+    def registrar(self, backend, operacao, segundos, linhas=0, erro=None):
+        with self._lock:
+            serie = self._series[(backend, operacao)]
+            serie.total += 1
+            serie.soma += segundos
+            serie.linhas += linhas
+            for i, limite in enumerate(BUCKETS):
+                if segundos <= limite:
+                    serie.buckets[i] += 1
+                    break
+            if erro is not None:
+                serie.erros[type(erro).__name__] += 1
+        if self.limite_lento_ms is not None and segundos * 1000 >= self.limite_lento_ms:
+            log_lento.warning("%s.%s levou %.1f ms (%d linha(s))", backend, operacao, segundos * 1000, linhas)
+
+    def snapshot(self):
+        """Estado atual como dict serializável em JSON"""
+        with self._lock:
+            operacoes = []
+            for (backend, operacao), serie in sorted(self._series.items()):
+                operacoes.append({
+                    "backend": backend,
+                    "operacao": operacao,
+                    "total": serie.total,
+                    "media_ms": round(serie.soma / serie.total * 1000, 3) if serie.total else 0.0,
+                    "linhas": serie.linhas,
+                    "erros": dict(serie.erros),
+                    "buckets_s": dict(zip(map(str, BUCKETS), serie.buckets))
+                })
+        return {"timestamp": time.time(), "operacoes": operacoes}
+
+    def exportar_prometheus(self):
+        """Texto no formato de exposição do Prometheus"""
+        linhas = [
+            "# HELP crud_operacao_segundos Latência das operações CRUD",
+            "# TYPE crud_operacao_segundos histogram"
+        ]
+        contadores_linhas, contadores_erros = [], []
+        with self._lock:
+            for (backend, operacao), serie in sorted(self._series.items()):
+                rotulos = f'backend="{backend}",operacao="{operacao}"'
+                acumulado = 0
+                for limite, quantidade in zip(BUCKETS, serie.buckets):
+                    acumulado += quantidade
+                    linhas.append(f'crud_operacao_segundos_bucket{{{rotulos},le="{limite}"}} {acumulado}')
+                linhas.append(f'crud_operacao_segundos_bucket{{{rotulos},le="+Inf"}} {serie.total}')
+                linhas.append(f"crud_operacao_segundos_sum{{{rotulos}}} {serie.soma}")
+                linhas.append(f"crud_operacao_segundos_count{{{rotulos}}} {serie.total}")
+                contadores_linhas.append(f"crud_linhas_total{{{rotulos}}} {serie.linhas}")
+                for tipo, quantidade in sorted(serie.erros.items()):
+                    contadores_erros.append(f'crud_erros_total{{{rotulos},tipo="{tipo}"}} {quantidade}')
+        linhas += ["# HELP crud_linhas_total Linhas/documentos afetados ou lidos",
+                   "# TYPE crud_linhas_total counter"] + contadores_linhas
+        linhas += ["# HELP crud_erros_total Operações que falharam, por tipo de exceção",
+                   "# TYPE crud_erros_total counter"] + contadores_erros
+        return "\n".join(linhas) + "\n"
+
+
+class SnapshotPeriodico:
+    """Grava metricas.snapshot() em JSON (e opcionalmente o texto do Prometheus, para o
+    textfile collector do node_exporter) a cada `intervalo` segundos"""
+
+    def __init__(self, metricas, caminho_json, intervalo=10.0, caminho_prometheus=None):
+        self.metricas = metricas
+        self.caminho_json = caminho_json
+        self.caminho_prometheus = caminho_prometheus
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._rodar, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _gravar(caminho, conteudo):
+        # escreve num temporário e renomeia, para quem lê nunca ver arquivo pela metade
+        temporario = caminho + ".tmp"
+        with open(temporario, "w") as arquivo:
+            arquivo.write(conteudo)
+        os.replace(temporario, caminho)
+
+    def gravar(self):
+        if self.caminho_json:
+            self._gravar(self.caminho_json, json.dumps(self.metricas.snapshot(), indent=2))
+        if self.caminho_prometheus:
+            self._gravar(self.caminho_prometheus, self.metricas.exportar_prometheus())
+
+    def _rodar(self):
+        while not self._parar.wait(self.intervalo):
+            self.gravar()
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+        self.gravar()
+
+
+def _contar_linhas(resultado):
+    """Estimativa de linhas a partir do retorno de um método CRUD"""
+    if resultado is None:
+        return 0
+    if isinstance(resultado, bool):
+        return int(resultado)
+    if isinstance(resultado, int):
+        return resultado  # rowcount de atualizar_*/deletar_* (outros escalares, ver _instrumentar)
+    if isinstance(resultado, tuple) and len(resultado) == 2 and isinstance(resultado[1], list):
+        ids, falhas = resultado  # criar_* em lote
+        return len(ids) - len(falhas)
+    if isinstance(resultado, dict) and "encontrados" in resultado:
+        return sum(resultado["encontrados"].values())  # atualizar_*/deletar_* em lote
+    if isinstance(resultado, dict):
+        return len(resultado)  # reservar_estoques: {id: estoque restante}
+    return 1
+
+
+def _instrumentar(metodo, backend, operacao, manager, metricas):
+    @functools.wraps(metodo)
+    def embrulho(*args, **kwargs):
+        erro_antes = getattr(manager, "ultimo_erro", None)
+        inicio = time.perf_counter()
+        try:
+            resultado = metodo(*args, **kwargs)
+        except Exception as e:
+            metricas.registrar(backend, operacao, time.perf_counter() - inicio, erro=e)
+            raise
+        if inspect.isgenerator(resultado):
+            return _medir_gerador(resultado, backend, operacao, metricas, inicio)
+        erro = getattr(manager, "ultimo_erro", None)
+        erro = erro if erro is not erro_antes else None
+        if (isinstance(resultado, int) and not isinstance(resultado, bool)
+                and not operacao.startswith(("atualizar_", "deletar_"))):
+            # só atualizar_*/deletar_* devolvem uma contagem; o int de criar_* é o ID
+            # e o de reservar_estoque, o estoque restante
+            linhas = 1
+        else:
+            linhas = _contar_linhas(resultado)
+        metricas.registrar(backend, operacao, time.perf_counter() - inicio, linhas, erro)
+        return resultado
+    return embrulho
+
+
+def _medir_gerador(gerador, backend, operacao, metricas, inicio):
+    """Leituras em streaming: mede do início até o consumidor terminar de iterar"""
+    linhas = 0
+    erro = None
+    try:
+        for item in gerador:
+            linhas += 1
+            yield item
+    except Exception as e:
+        erro = e
+        raise
+    finally:
+        metricas.registrar(backend, operacao, time.perf_counter() - inicio, linhas, erro)
+
+
+def instrumentar(manager, backend, metricas):
+    """Embrulha os métodos CRUD da instância (criar_*, ler_*, iterar_*, get_*,
+    consultar*, relatorio*, atualizar_*, deletar_*, reservar_*, menos FORA_DO_CRUD)
+    para registrar latência, linhas e erros em `metricas`"""
+    for nome, metodo in inspect.getmembers(manager, inspect.ismethod):
+        if nome.startswith(PREFIXOS_CRUD) and nome not in FORA_DO_CRUD:
+            setattr(manager, nome, _instrumentar(metodo, backend, nome, manager, metricas))
+    return manager
+
+
+def configurar_pelo_ambiente(manager, backend):
+    """Liga a instrumentação conforme o .env; devolve o SnapshotPeriodico (ou None).
+
+    DB_METRICAS_JSON / DB_METRICAS_PROM: arquivos gravados periodicamente
+    DB_METRICAS_INTERVALO: segundos entre gravações (padrão 10)
+    DB_LENTO_MS: loga no logger "crud.lento" operações acima deste tempo
+    """
+    caminho_json = os.getenv("DB_METRICAS_JSON")
+    caminho_prometheus = os.getenv("DB_METRICAS_PROM")
+    lento_ms = os.getenv("DB_LENTO_MS")
+    if not (caminho_json or caminho_prometheus or lento_ms):
+        return None
+    if lento_ms:
+        logging.basicConfig(level=logging.WARNING)
+    metricas = Metricas(float(lento_ms) if lento_ms else None)
+    instrumentar(manager, backend, metricas)
+    if not (caminho_json or caminho_prometheus):
+        return None
+    intervalo = float(os.getenv("DB_METRICAS_INTERVALO", "10"))
+    return SnapshotPeriodico(metricas, caminho_json, intervalo, caminho_prometheus)
@@ -0,0 +1,84 @@
+"""Tipos de registro devolvidos pelas leituras dos managers
+
+    for produto in pg_manager.iterar_produtos():
+        print(produto.id, produto.nome, produto.valor)
+
+Os mesmos tipos saem dos dois backends, com os nomes de campo lógicos de
+comum/consulta.py. Usam __slots__: sem __dict__ por instância, cada registro
+ocupa bem menos memória que um dict e o acesso por atributo é direto.
+Iterar um registro dá os valores na ordem dos campos, então
+`cpf, nome, email = usuario` e `tuple(usuario)` continuam funcionando.
+"""
+
+from comum.consulta import CAMPOS
+
+
+class Registro:
+    __slots__ = ()
+    ENTIDADE = None
+    CAMPOS_MONGO = ()  # nome no MongoDB de cada campo, na ordem de __slots__
+    PROJECAO = {}      # projeção do find() com só os campos do registro
+
+    @classmethod
+    def de_documento(cls, documento):
+        """Registro a partir de um documento do MongoDB (campos ausentes viram None)"""
+        return cls(*map(documento.get, cls.CAMPOS_MONGO))
+
+    def como_dict(self):
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+    def __iter__(self):
+        return (getattr(self, campo) for campo in self.__slots__)
+
+    def __eq__(self, outro):
+        if type(outro) is not type(self):
+            return NotImplemented
+        return tuple(self) == tuple(outro)
+
+    __hash__ = None
+
+    def __repr__(self):
+        valores = ", ".join(f"{campo}={getattr(self, campo)!r}" for campo in self.__slots__)
+        return f"{type(self).__name__}({valores})"
+
+
+class Usuario(Registro):
+    __slots__ = ("cpf", "nome", "email")
+    ENTIDADE = "usuarios"
+
+    def __init__(self, cpf, nome, email):
+        self.cpf = cpf
+        self.nome = nome
+        self.email = email
+
+
+class Produto(Registro):
+    __slots__ = ("id", "nome", "valor", "quantidade")
+    ENTIDADE = "produtos"
+
+    def __init__(self, id, nome, valor, quantidade):
+        self.id = id
+        self.nome = nome
+        self.valor = valor
+        self.quantidade = quantidade
+
+
+class Endereco(Registro):
+    __slots__ = ("id", "rua", "numero", "bairro", "cidade", "cep", "complemento")
+    ENTIDADE = "enderecos"
+
+    def __init__(self, id, rua, numero, bairro, cidade, cep, complemento=None):
+        self.id = id
+        self.rua = rua
+        self.numero = numero
+        self.bairro = bairro
+        self.cidade = cidade
+        self.cep = cep
+        self.complemento = complemento
+
+
+REGISTROS = {classe.ENTIDADE: classe for classe in (Usuario, Produto, Endereco)}
+
+for _classe in REGISTROS.values():
+    _classe.CAMPOS_MONGO = tuple(CAMPOS[_classe.ENTIDADE][campo][1] for campo in _classe.__slots__)
+    _classe.PROJECAO = dict.fromkeys(_classe.CAMPOS_MONGO, 1)
@@ -0,0 +1,237 @@
+"""Relatórios agregados calculados no próprio banco
+
+    for linha in pg_manager.relatorio("enderecos", agrupar=["cidade"]):
+        print(linha["cidade"], linha["enderecos"])
+    estoque = mongo_manager.relatorio_estoque()  # {"produtos", "unidades", "valor_estoque"}
+
+Cada entidade tem suas métricas (METRICAS); o relatório agrupa pelos campos
+lógicos pedidos (comum/consulta.py) e vira um GROUP BY no Postgres (para_sql)
+ou um aggregate() no MongoDB (para_mongo). Só as linhas agregadas saem do
+banco. Uma Consulta opcional filtra as linhas antes de agregar e pode ordenar
+e limitar o resultado, também por métrica:
+
+    top = Consulta().ordenar("enderecos", desc=True).limitar(10)
+    pg_manager.relatorio("enderecos", ["cidade", "bairro"], top)
+
+Resumos: para as entidades de RESUMOS existe uma tabela (Postgres) ou coleção
+(MongoDB) pré-agregada, e `resumo=True` lê dela em vez da tabela inteira. No
+Postgres ela é mantida por triggers (sql_resumo) a cada escrita; no MongoDB é
+recalculada no servidor por pipeline_resumo. O resumo serve qualquer
+relatório da entidade agrupado por um subconjunto de RESUMOS[entidade] e
+filtrado só por esses campos.
+
+No Postgres, contagens vêm como int e somas como Decimal (numeric).
+"""
+
+from comum.consulta import CAMPOS, TABELAS, Consulta, filtro_mongo, filtro_sql
+
+# métrica -> ("contar",) ou ("somar", campo[, campo...]), em que vários campos são multiplicados
+METRICAS = {
+    "usuarios": {"usuarios": ("contar",)},
+    "produtos": {
+        "produtos": ("contar",),
+        "unidades": ("somar", "quantidade"),
+        "valor_estoque": ("somar", "valor", "quantidade")
+    },
+    "enderecos": {"enderecos": ("contar",)}
+}
+
+# entidade -> campos de agrupamento guardados no resumo
+RESUMOS = {
+    "produtos": (),
+    "enderecos": ("cidade", "bairro")
+}
+
+# linhas por grupo no resumo do Postgres: cada conexão soma na fatia do seu PID,
+# então escritas concorrentes não ficam todas esperando a mesma linha
+FATIAS = 16
+
+_TIPOS_SQL = {"contar": "bigint", "somar": "numeric"}
+
+
+def _validar(entidade, agrupar, consulta, resumo):
+    conhecidos = CAMPOS[entidade]
+    metricas = METRICAS[entidade]
+    for campo in list(agrupar) + [c for c, _, _ in consulta.filtros]:
+        if campo not in conhecidos:
+            raise ValueError(f"Campo desconhecido em {entidade}: {campo}")
+    for campo, _ in consulta.ordem:
+        if campo not in agrupar and campo not in metricas:
+            raise ValueError(f"Ordenação por {campo}: use um campo agrupado ou uma métrica")
+    if resumo:
+        guardados = RESUMOS.get(entidade)
+        if guardados is None:
+            raise ValueError(f"{entidade} não tem resumo")
+        fora = [c for c in list(agrupar) + [c for c, _, _ in consulta.filtros] if c not in guardados]
+        if fora:
+            raise ValueError(f"O resumo de {entidade} só agrupa e filtra por {', '.join(guardados) or 'nada'}")
+
+
+def _contagem(entidade):
+    return next(nome for nome, (operacao, *_) in METRICAS[entidade].items() if operacao == "contar")
+
+
+def _expressoes_sql(entidade):
+    """métrica -> expressão por linha (1 para contar, produto das colunas para somar)"""
+    coluna = {campo: nomes[0] for campo, nomes in CAMPOS[entidade].items()}
+    return {nome: "1" if operacao == "contar" else " * ".join(coluna[c] for c in campos)
+            for nome, (operacao, *campos) in METRICAS[entidade].items()}
+
+
+def para_sql(entidade, agrupar=(), consulta=None, resumo=False):
+    """Devolve (sql, params, campos) do relatório; campos = agrupamento + métricas"""
+    consulta = consulta or Consulta()
+    agrupar = list(agrupar)
+    _validar(entidade, agrupar, consulta, resumo)
+    coluna = {campo: nomes[0] for campo, nomes in CAMPOS[entidade].items()}
+    metricas = METRICAS[entidade]
+    if resumo:
+        tabela = f"mydb.resumo_{entidade}"
+        grupos = [f"NULLIF({coluna[c]}, '') AS {c}" for c in agrupar]
+        agregados = [f"sum({nome})::{_TIPOS_SQL[operacao]} AS {nome}" for nome, (operacao, *_) in metricas.items()]
+    else:
+        tabela = TABELAS[entidade]
+        grupos = [f"{coluna[c]} AS {c}" for c in agrupar]
+        agregados = [f"count(*) AS {nome}" if expressao == "1" else f"COALESCE(sum({expressao}), 0)::numeric AS {nome}"
+                     for nome, expressao in _expressoes_sql(entidade).items()]
+    condicoes, params = filtro_sql(consulta, entidade)
+    sql = f"SELECT {', '.join(grupos + agregados)} FROM {tabela}"
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    if agrupar:
+        sql += " GROUP BY " + ", ".join(str(i) for i in range(1, len(agrupar) + 1))
+        if resumo:
+            contagem = _contagem(entidade)
+            sql += f" HAVING sum({contagem}) > 0"  # grupos que já tiveram linhas e ficaram vazios
+    ordem = consulta.ordem or [(c, False) for c in agrupar]
+    if ordem:
+        sql += " ORDER BY " + ", ".join(f"{c}{' DESC' if desc else ''}" for c, desc in ordem)
+    if consulta.limite is not None:
+        sql += " LIMIT %s"
+        params.append(consulta.limite)
+    return sql, params, agrupar + list(metricas)
+
+
+def para_mongo(entidade, agrupar=(), consulta=None, resumo=False):
+    """Devolve (coleção, pipeline, campos) para o aggregate() do pymongo"""
+    consulta = consulta or Consulta()
+    agrupar = list(agrupar)
+    _validar(entidade, agrupar, consulta, resumo)
+    nome = {campo: nomes[1] for campo, nomes in CAMPOS[entidade].items()}
+    metricas = METRICAS[entidade]
+    if resumo:
+        colecao = f"resumo_{entidade}"
+        acumuladores = {metrica: {"$sum": f"${metrica}"} for metrica in metricas}
+    else:
+        colecao = entidade
+        acumuladores = {}
+        for metrica, (operacao, *campos) in metricas.items():
+            if operacao == "contar":
+                acumuladores[metrica] = {"$sum": 1}
+            elif len(campos) == 1:
+                acumuladores[metrica] = {"$sum": f"${nome[campos[0]]}"}
+            else:
+                acumuladores[metrica] = {"$sum": {"$multiply": [f"${nome[c]}" for c in campos]}}
+    filtro = filtro_mongo(consulta, entidade)
+    pipeline = [{"$match": filtro}] if filtro else []
+    pipeline.append({"$group": {"_id": {c: f"${nome[c]}" for c in agrupar} or None, **acumuladores}})
+    pipeline.append({"$project": {"_id": 0, **{c: f"$_id.{c}" for c in agrupar}, **dict.fromkeys(metricas, 1)}})
+    ordem = consulta.ordem or [(c, False) for c in agrupar]
+    if ordem:
+        pipeline.append({"$sort": {c: -1 if desc else 1 for c, desc in ordem}})
+    if consulta.limite is not None:
+        pipeline.append({"$limit": consulta.limite})
+    return colecao, pipeline, agrupar + list(metricas)
+
+
+def pipeline_resumo(entidade):
+    """Pipeline que recalcula a coleção resumo_{entidade} do MongoDB ($out troca a
+    coleção inteira de uma vez, então quem lê nunca vê o resumo pela metade)"""
+    agrupar = list(RESUMOS[entidade])
+    nome = {campo: nomes[1] for campo, nomes in CAMPOS[entidade].items()}
+    _, pipeline, _ = para_mongo(entidade, agrupar)
+    grupo = next(etapa for etapa in pipeline if "$group" in etapa)
+    # no resumo os campos agrupados ficam com o nome do MongoDB, para o filtro da Consulta valer nele
+    projecao = {"_id": 0, **{nome[c]: f"$_id.{c}" for c in agrupar}, **dict.fromkeys(METRICAS[entidade], 1)}
+    return [grupo, {"$project": projecao}, {"$out": f"resumo_{entidade}"}]
+
+
+def sql_resumo(entidade):
+    """SQL que cria (ou recria) o resumo de `entidade` no Postgres e o preenche.
+
+    A tabela mydb.resumo_{entidade} tem uma linha por (fatia, grupo) com as
+    métricas; triggers por comando (FOR EACH STATEMENT, com as tabelas de
+    transição) somam as linhas novas e subtraem as antigas a cada INSERT,
+    UPDATE ou DELETE, inclusive COPY e escritas de fora dos managers, na
+    mesma transação da escrita. TRUNCATE na tabela zera o resumo. Nulos nos
+    campos agrupados são guardados como ''."""
+    agrupar = RESUMOS[entidade]
+    tabela, base = f"mydb.resumo_{entidade}", TABELAS[entidade]
+    coluna = {campo: nomes[0] for campo, nomes in CAMPOS[entidade].items()}
+    grupos = [coluna[c] for c in agrupar]
+    expressoes = _expressoes_sql(entidade)
+    metricas = METRICAS[entidade]
+    chave = ", ".join(["fatia"] + grupos)
+    colunas = ", ".join(["fatia"] + grupos + list(metricas))
+    definicoes = ",\n    ".join(["fatia smallint NOT NULL"] + [f"{g} text NOT NULL" for g in grupos]
+                                + [f"{nome} {_TIPOS_SQL[operacao]} NOT NULL DEFAULT 0"
+                                   for nome, (operacao, *_) in metricas.items()])
+
+    def somar(origem, fatia, sinal=""):
+        selecao = ", ".join([fatia] + [f"COALESCE({g}::text, '')" for g in grupos]
+                            + [f"{sinal}COALESCE(sum({expressao}), 0)" for expressao in expressoes.values()])
+        sql = f"INSERT INTO {tabela} AS r ({colunas}) SELECT {selecao} FROM {origem}"
+        if grupos:
+            sql += " GROUP BY " + ", ".join(str(i) for i in range(2, len(grupos) + 2))
+        return sql
+
+    atualizar = ", ".join(f"{nome} = r.{nome} + EXCLUDED.{nome}" for nome in metricas)
+    delta = f"ON CONFLICT ({chave}) DO UPDATE SET {atualizar}"
+    fatia = f"pg_backend_pid() % {FATIAS}"
+    gatilho = f"resumo_{entidade}"
+    return f"""
+LOCK TABLE {base} IN SHARE MODE;
+
+CREATE TABLE IF NOT EXISTS {tabela} (
+    {definicoes},
+    PRIMARY KEY ({chave})
+);
+
+CREATE OR REPLACE FUNCTION mydb.{gatilho}_atualizar() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM {tabela};
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        {somar("novos", fatia)} {delta};
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        {somar("antigos", fatia, "-")} {delta};
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {gatilho}_insert ON {base};
+CREATE TRIGGER {gatilho}_insert AFTER INSERT ON {base}
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION mydb.{gatilho}_atualizar();
+
+DROP TRIGGER IF EXISTS {gatilho}_update ON {base};
+CREATE TRIGGER {gatilho}_update AFTER UPDATE ON {base}
+    REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION mydb.{gatilho}_atualizar();
+
+DROP TRIGGER IF EXISTS {gatilho}_delete ON {base};
+CREATE TRIGGER {gatilho}_delete AFTER DELETE ON {base}
+    REFERENCING OLD TABLE AS antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION mydb.{gatilho}_atualizar();
+
+DROP TRIGGER IF EXISTS {gatilho}_truncate ON {base};
+CREATE TRIGGER {gatilho}_truncate AFTER TRUNCATE ON {base}
+    FOR EACH STATEMENT EXECUTE FUNCTION mydb.{gatilho}_atualizar();
+
+DELETE FROM {tabela};
+{somar(base, "0")};
+"""
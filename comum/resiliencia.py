@@ -0,0 +1,132 @@
+"""Retry com backoff e disjuntor (circuit breaker) para os managers
+
+    retentativa = Retentativa(tentativas=3, base_ms=50, teto_ms=2000)
+    retentativa.executar(operacao, pode_repetir=lambda e: isinstance(e, TimeoutError))
+
+    disjuntor = Disjuntor(falhas_para_abrir=5, aberto_s=10)
+    with disjuntor.protegendo(lambda e: isinstance(e, ConnectionError)):
+        ...
+
+Quem decide o que é transitório e o que é seguro repetir é cada manager,
+porque depende do driver e da operação.
+"""
+
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+class CircuitoAberto(Exception):
+    """Marca os erros levantados pelo Disjuntor enquanto o circuito está aberto"""
+
+
+@functools.lru_cache(maxsize=None)
+def classe_circuito_aberto(base):
+    """Subclasse de `base` (ex. psycopg2.OperationalError) e de CircuitoAberto, para
+    o erro cair no tratamento que o manager já tem para o seu driver"""
+    return type(f"CircuitoAberto{base.__name__}", (base, CircuitoAberto), {})
+
+
+class Retentativa:
+    """Repete uma operação com backoff exponencial e jitter completo: antes da
+    tentativa n espera um tempo aleatório entre 0 e min(teto, base * 2**n), para
+    clientes que falharam juntos não voltarem todos ao mesmo tempo"""
+
+    def __init__(self, tentativas=3, base_ms=50, teto_ms=2000):
+        self.tentativas = max(1, tentativas)
+        self.base_ms = base_ms
+        self.teto_ms = teto_ms
+
+    def espera(self, tentativa):
+        return random.uniform(0, min(self.teto_ms, self.base_ms * 2 ** tentativa)) / 1000
+
+    def executar(self, operacao, pode_repetir):
+        """Chama operacao() até dar certo, até acabarem as tentativas ou até um
+        erro para o qual pode_repetir(erro) é falso; nesses casos levanta o erro"""
+        tentativa = 0
+        while True:
+            try:
+                return operacao()
+            except Exception as e:
+                tentativa += 1
+                if tentativa >= self.tentativas or isinstance(e, CircuitoAberto) or not pode_repetir(e):
+                    raise
+            time.sleep(self.espera(tentativa - 1))
+
+
+class Disjuntor:
+    """Depois de `falhas_para_abrir` falhas de conexão seguidas o circuito abre e as
+    operações falham na hora, sem esperar timeout do banco. Passados `aberto_s`
+    segundos uma única operação de teste passa (meio aberto): se der certo o
+    circuito fecha, se falhar abre de novo.
+
+    `excecao(mensagem)` cria o erro levantado com o circuito aberto e
+    `ao_abrir()` é chamado cada vez que ele abre (ex. para revalidar conexões)."""
+
+    FECHADO, ABERTO, MEIO_ABERTO = "fechado", "aberto", "meio aberto"
+
+    def __init__(self, falhas_para_abrir=5, aberto_s=10.0, excecao=CircuitoAberto, ao_abrir=None):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.aberto_s = aberto_s
+        self.excecao = excecao
+        self.ao_abrir = ao_abrir
+        self.estado = self.FECHADO
+        self.falhas = 0
+        self._reabrir_em = 0.0
+        self._lock = threading.Lock()
+
+    def verificar(self):
+        """Levanta `excecao` se o circuito está aberto (ou se o teste já está em curso)"""
+        if self.falhas_para_abrir <= 0:
+            return
+        with self._lock:
+            if self.estado == self.FECHADO:
+                return
+            agora = time.monotonic()
+            if agora >= self._reabrir_em:
+                # esta chamada é o teste; se ela não der notícia, outra testa depois de aberto_s
+                self.estado = self.MEIO_ABERTO
+                self._reabrir_em = agora + self.aberto_s
+                return
+            restante = self._reabrir_em - agora
+        raise self.excecao(f"Circuito aberto: banco indisponível (novo teste em {restante:.1f}s)")
+
+    def sucesso(self):
+        if self.estado == self.FECHADO and not self.falhas:
+            return  # caminho comum, sem pegar o lock
+        with self._lock:
+            self.falhas = 0
+            self.estado = self.FECHADO
+
+    def falha(self):
+        if self.falhas_para_abrir <= 0:
+            return
+        with self._lock:
+            self.falhas += 1
+            if self.estado == self.ABERTO:
+                return
+            if self.estado != self.MEIO_ABERTO and self.falhas < self.falhas_para_abrir:
+                return
+            self.estado = self.ABERTO
+            self._reabrir_em = time.monotonic() + self.aberto_s
+        if self.ao_abrir:
+            self.ao_abrir()
+
+    @contextmanager
+    def protegendo(self, falha_de_conexao):
+        """Passa o bloco pelo disjuntor; só erros com falha_de_conexao(erro)
+        verdadeiro contam como falha, qualquer outro mostra que o banco respondeu"""
+        self.verificar()
+        try:
+            yield
+        except Exception as e:
+            if isinstance(e, CircuitoAberto):
+                raise
+            if falha_de_conexao(e):
+                self.falha()
+            else:
+                self.sucesso()
+            raise
+        self.sucesso()
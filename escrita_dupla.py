@@ -0,0 +1,377 @@
+"""Escrita dupla: cada criar_*/atualizar_*/deletar_* vai para o Postgres e para o MongoDB
+
+    dupla = EscritaDupla(pg_manager, mongo_manager, consistencia="ambos")
+    id_produto = dupla.criar_produto("Arroz", 10.0, 5)
+    dupla.atualizar_produto(id_produto, 12.5)
+
+    python escrita_dupla.py reconciliar   # reaplica as escritas que falharam de um lado
+
+Um dos bancos é o primário (DB_DUPLA_PRIMARIO, padrão pg) e é a fonte da verdade.
+A escrita no primário roda na thread de quem chamou; a do secundário:
+
+- consistencia="ambos": roda ao mesmo tempo numa thread do executor e a chamada
+  só volta quando as duas terminam (latência ~ a maior das duas, não a soma);
+- consistencia="primario": entra numa fila limitada (fila_max) que uma thread
+  aplica em ordem, e a chamada volta assim que o primário grava. Com a fila
+  cheia a escrita não espera: vira pendência. Cada (entidade, chave) na fila
+  é anotado antes num diário (DB_DUPLA_PENDENCIAS + ".fila") e sai dele quando
+  o secundário grava; se o processo cair com a fila cheia, o que ficou no
+  diário vira pendência na próxima EscritaDupla com o mesmo arquivo (e
+  reconciliar() também o lê). O diário é de um processo só.
+
+Produtos e endereços recebem o ID antes da escrita, reservado em blocos no
+gerador do primário (sequência do Postgres ou `counters` do MongoDB), e os dois
+lados gravam o mesmo ID. A cada bloco o gerador do secundário é avançado, para
+ele não entregar esses IDs depois.
+
+Toda escrita que deu certo só de um lado vira uma pendência (entidade, chave),
+guardada em memória e no arquivo DB_DUPLA_PENDENCIAS (JSONL, fora dos dois
+bancos para sobreviver à queda de qualquer um). reconciliar() lê o estado
+atual de cada chave no primário e o aplica no secundário (upsert ou delete),
+então a ordem e a repetição das pendências não importam.
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from SQL.bd import PostgresManager, DB_CONFIG, POOL_CONFIG
+from NOSQL.bdnosql import MongoManager, MONGO_URI
+from comum.consulta import CAMPOS, Consulta
+from comum.inicializacao import conectar_em_paralelo
+
+ESCRITA_DUPLA_CONFIG = {
+    "consistencia": os.getenv("DB_DUPLA_CONSISTENCIA", "ambos"),
+    "primario": os.getenv("DB_DUPLA_PRIMARIO", "pg"),
+    "fila_max": int(os.getenv("DB_DUPLA_FILA", "10000")),
+    "pendencias": os.getenv("DB_DUPLA_PENDENCIAS", "escrita_dupla_pendencias.jsonl")
+}
+
+CONSISTENCIAS = ("ambos", "primario")
+BLOCO_IDS = 100
+
+
+def _nos_dois(operacao):
+    return {"pg": operacao, "mongo": operacao}
+
+
+class EscritaDupla:
+    def __init__(self, pg_manager, mongo_manager, consistencia="ambos", primario="pg", fila_max=10000,
+                 pendencias=None, bloco_ids=BLOCO_IDS, threads=16):
+        if consistencia not in CONSISTENCIAS:
+            raise ValueError(f"Consistência inválida: {consistencia}")
+        if primario not in ("pg", "mongo"):
+            raise ValueError(f"Primário inválido: {primario}")
+        managers = {"pg": pg_manager, "mongo": mongo_manager}
+        self.nome_primario = primario
+        self.nome_secundario = "mongo" if primario == "pg" else "pg"
+        self.primario = managers[self.nome_primario]
+        self.secundario = managers[self.nome_secundario]
+        self.consistencia = consistencia
+        self.bloco_ids = bloco_ids
+        self.arquivo_pendencias = pendencias
+        self._pendencias = set()
+        self._lock_pendencias = threading.Lock()
+        self._ids = {}  # entidade -> IDs já reservados no primário
+        self._lock_ids = threading.Lock()
+        self._executor = None
+        self._fila = None
+        self._thread = None
+        # diário da fila: número -> (entidade, chave) ainda não aplicados no secundário
+        self.arquivo_fila = pendencias + ".fila" if pendencias else None
+        self._na_fila = {}
+        self._numero_fila = 0
+        self._lock_fila = threading.Lock()
+        self._diario = None
+        if consistencia == "ambos":
+            self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="escrita-dupla")
+        else:
+            self._abrir_diario()
+            self._fila = queue.Queue(maxsize=fila_max)
+            self._thread = threading.Thread(target=self._aplicar_fila, daemon=True)
+            self._thread.start()
+
+    # --- despacho --------------------------------------------------------
+
+    @staticmethod
+    def _rodar(manager, operacao, criar):
+        """Devolve (resultado, deu_certo). Os managers não levantam exceção nos
+        CRUDs, então a falha aparece em ultimo_erro (por thread) ou, em criar_*, no None"""
+        erro_antes = manager.ultimo_erro
+        try:
+            resultado = operacao(manager)
+        except Exception as e:
+            print(f"Erro: {e}")
+            return None, False
+        return resultado, manager.ultimo_erro is erro_antes and not (criar and resultado is None)
+
+    def _escrever(self, entidade, chave, operacoes, criar=False):
+        operacao_primario = operacoes[self.nome_primario]
+        operacao_secundario = operacoes[self.nome_secundario]
+        if self.consistencia == "ambos":
+            futuro = self._executor.submit(self._rodar, self.secundario, operacao_secundario, criar)
+            resultado, ok = self._rodar(self.primario, operacao_primario, criar)
+            _, ok_secundario = futuro.result()
+            if ok != ok_secundario:
+                self._pendencia(("chave", entidade, chave))
+            return resultado
+        resultado, ok = self._rodar(self.primario, operacao_primario, criar)
+        if ok:
+            fila = self._fila
+            if fila is None:
+                # depois de fechar() não há quem aplique a fila
+                self._pendencia(("chave", entidade, chave))
+                return resultado
+            numero = self._entrar_no_diario(entidade, chave)
+            try:
+                fila.put_nowait((numero, entidade, chave, operacao_secundario, criar))
+            except queue.Full:
+                self._pendencia(("chave", entidade, chave))
+                self._sair_do_diario(numero)
+        return resultado
+
+    def _aplicar_fila(self):
+        while True:
+            item = self._fila.get()
+            if item is None:
+                return
+            numero, entidade, chave, operacao, criar = item
+            _, ok = self._rodar(self.secundario, operacao, criar)
+            if not ok:
+                self._pendencia(("chave", entidade, chave))
+            self._sair_do_diario(numero)
+
+    # --- diário da fila --------------------------------------------------
+
+    def _abrir_diario(self):
+        """O que sobrou no diário (processo anterior caiu) vira pendência; depois o zera"""
+        if not self.arquivo_fila:
+            return
+        for pendencia in self._ler_diario(self.arquivo_fila):
+            self._pendencia(pendencia)
+        self._diario = open(self.arquivo_fila, "w", encoding="utf-8")
+
+    def _entrar_no_diario(self, entidade, chave):
+        with self._lock_fila:
+            self._numero_fila += 1
+            numero = self._numero_fila
+            self._na_fila[numero] = (entidade, chave)
+            if self._diario is not None:
+                # flush sem fsync: sobrevive à queda do processo, não à da máquina
+                self._diario.write(json.dumps(["+", numero, entidade, chave]) + "\n")
+                self._diario.flush()
+        return numero
+
+    def _sair_do_diario(self, numero):
+        with self._lock_fila:
+            self._na_fila.pop(numero, None)
+            if self._diario is None:
+                return
+            if self._na_fila:
+                self._diario.write(json.dumps(["-", numero]) + "\n")
+            else:
+                # fila vazia: nada a recuperar, o diário recomeça
+                self._diario.seek(0)
+                self._diario.truncate()
+            self._diario.flush()
+
+    @staticmethod
+    def _ler_diario(caminho):
+        """Pendências das escritas que entraram no diário e não saíram"""
+        if not caminho or not os.path.exists(caminho):
+            return set()
+        abertas = {}
+        with open(caminho, encoding="utf-8") as arquivo:
+            for linha in arquivo:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    continue  # linha cortada pela queda do processo
+                if registro[0] == "+":
+                    abertas[registro[1]] = ("chave", registro[2], registro[3])
+                else:
+                    abertas.pop(registro[1], None)
+        return set(abertas.values())
+
+    def _proximo_id(self, entidade):
+        with self._lock_ids:
+            ids = self._ids.setdefault(entidade, deque())
+            if not ids:
+                novos = self.primario.reservar_ids(entidade, self.bloco_ids)
+                if not novos:
+                    return None
+                ids.extend(novos)
+                try:
+                    self.secundario.ajustar_sequencia(entidade, max(novos))
+                except Exception:
+                    self._pendencia(("sequencia", entidade, max(novos)))
+            return ids.popleft()
+
+    def pendentes(self):
+        """Escritas do secundário ainda na fila (consistencia="primario")"""
+        return self._fila.qsize() if self._fila is not None else 0
+
+    def fechar(self):
+        """Espera as escritas em andamento (e a fila) terminarem"""
+        if self._fila is not None:
+            fila = self._fila
+            fila.put(None)
+            self._thread.join()
+            self._fila = None
+            # o que entrou depois do None não foi aplicado
+            while not fila.empty():
+                item = fila.get_nowait()
+                if item is not None:
+                    numero, entidade, chave = item[:3]
+                    self._pendencia(("chave", entidade, chave))
+                    self._sair_do_diario(numero)
+        with self._lock_fila:
+            if self._diario is not None:
+                self._diario.close()
+                self._diario = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def fechar_conexao(self):
+        self.fechar()
+        self.primario.fechar_conexao()
+        self.secundario.fechar_conexao()
+
+    # --- pendências e reconciliação --------------------------------------
+
+    def _pendencia(self, pendencia):
+        with self._lock_pendencias:
+            self._pendencias.add(pendencia)
+            if self.arquivo_pendencias:
+                with open(self.arquivo_pendencias, "a", encoding="utf-8") as arquivo:
+                    arquivo.write(json.dumps(pendencia) + "\n")
+
+    @staticmethod
+    def _ler_pendencias(caminho):
+        if not os.path.exists(caminho):
+            return set()
+        with open(caminho, encoding="utf-8") as arquivo:
+            return {tuple(json.loads(linha)) for linha in arquivo if linha.strip()}
+
+    def _tomar_pendencias(self):
+        """Tira as pendências da memória e do arquivo; as que chegarem durante a
+        reconciliação vão para um arquivo novo. O arquivo tomado só é apagado no
+        fim, então uma reconciliação interrompida é retomada na próxima"""
+        with self._lock_pendencias:
+            pendencias = set(self._pendencias)
+            self._pendencias.clear()
+            if not self.arquivo_pendencias:
+                return pendencias
+            tomado = self.arquivo_pendencias + ".reconciliando"
+            if os.path.exists(self.arquivo_pendencias):
+                if os.path.exists(tomado):
+                    with open(tomado, "a", encoding="utf-8") as destino, \
+                            open(self.arquivo_pendencias, encoding="utf-8") as origem:
+                        destino.write(origem.read())
+                    os.remove(self.arquivo_pendencias)
+                else:
+                    os.replace(self.arquivo_pendencias, tomado)
+            # escritas ainda no diário da fila: reconciliar antes da hora não faz mal
+            return pendencias | self._ler_pendencias(tomado) | self._ler_diario(self.arquivo_fila)
+
+    def _reconciliar(self, pendencia):
+        tipo, entidade, valor = pendencia
+        if tipo == "sequencia":
+            self.secundario.ajustar_sequencia(entidade, valor)
+            return
+        chave_primaria = next(iter(CAMPOS[entidade]))
+        consulta = Consulta().onde(chave_primaria, "=", valor).limitar(1)
+        registros = list(self.primario.consultar(entidade, consulta))
+        self.secundario.aplicar_estado(entidade, valor, registros[0] if registros else None)
+
+    def reconciliar(self):
+        """Copia do primário para o secundário o estado atual de cada chave pendente.
+        Devolve (resolvidas, restantes); as que falharem de novo continuam pendentes"""
+        pendencias = self._tomar_pendencias()
+        restantes = set()
+        for pendencia in sorted(pendencias, key=str):
+            try:
+                self._reconciliar(pendencia)
+            except Exception as e:
+                print(f"Erro ao reconciliar {pendencia}: {e}")
+                restantes.add(pendencia)
+        for pendencia in restantes:
+            self._pendencia(pendencia)
+        if self.arquivo_pendencias and os.path.exists(self.arquivo_pendencias + ".reconciliando"):
+            os.remove(self.arquivo_pendencias + ".reconciliando")
+        print(f"{len(pendencias) - len(restantes)} pendência(s) resolvida(s), {len(restantes)} restante(s)")
+        return len(pendencias) - len(restantes), len(restantes)
+
+    # --- CRUD ------------------------------------------------------------
+
+    def criar_usuario(self, cpf, nome, email):
+        return self._escrever("usuarios", cpf, _nos_dois(lambda m: m.criar_usuario(cpf, nome, email)), criar=True)
+
+    def atualizar_usuario(self, cpf, email):
+        return self._escrever("usuarios", cpf, {
+            "pg": lambda m: m.atualizar_usuario(cpf, email),
+            "mongo": lambda m: m.atualizar_usuario(cpf, None, email)
+        })
+
+    def deletar_usuario(self, cpf):
+        return self._escrever("usuarios", cpf, _nos_dois(lambda m: m.deletar_usuario(cpf)))
+
+    def criar_produto(self, nome, valor, quantidade):
+        id_prod = self._proximo_id("produtos")
+        if id_prod is None:
+            print("Erro ao gerar ID para o produto")
+            return None
+        return self._escrever("produtos", id_prod,
+                              _nos_dois(lambda m: m.criar_produto(nome, valor, quantidade, id_prod)), criar=True)
+
+    def atualizar_produto(self, id_prod, valor):
+        id_prod = int(id_prod)
+        return self._escrever("produtos", id_prod, _nos_dois(lambda m: m.atualizar_produto(id_prod, valor)))
+
+    def deletar_produto(self, id_prod):
+        id_prod = int(id_prod)
+        return self._escrever("produtos", id_prod, _nos_dois(lambda m: m.deletar_produto(id_prod)))
+
+    def criar_endereco(self, rua, numero, bairro, cidade, cep, complemento):
+        id_endereco = self._proximo_id("enderecos")
+        if id_endereco is None:
+            print("Erro ao gerar ID para o endereço")
+            return None
+        return self._escrever("enderecos", id_endereco, _nos_dois(
+            lambda m: m.criar_endereco(rua, numero, bairro, cidade, cep, complemento, id_endereco)), criar=True)
+
+    def atualizar_endereco(self, id_endereco, rua, numero, complemento):
+        id_endereco = int(id_endereco)
+        return self._escrever("enderecos", id_endereco, _nos_dois(
+            lambda m: m.atualizar_endereco(id_endereco, rua, numero, complemento)))
+
+    def deletar_endereco(self, id_endereco):
+        id_endereco = int(id_endereco)
+        return self._escrever("enderecos", id_endereco, _nos_dois(lambda m: m.deletar_endereco(id_endereco)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Escrita dupla Postgres + MongoDB")
+    parser.add_argument("comando", choices=["reconciliar"])
+    parser.add_argument("--primario", choices=["pg", "mongo"], default=ESCRITA_DUPLA_CONFIG["primario"])
+    parser.add_argument("--pendencias", default=ESCRITA_DUPLA_CONFIG["pendencias"],
+                        help="arquivo JSONL com as pendências")
+    args = parser.parse_args()
+
+    pg_manager = PostgresManager(DB_CONFIG, POOL_CONFIG)
+    mongo_manager = MongoManager(MONGO_URI)
+    dupla = EscritaDupla(pg_manager, mongo_manager, primario=args.primario, pendencias=args.pendencias)
+    try:
+        conectar_em_paralelo(pg_manager, mongo_manager)
+        dupla.reconciliar()
+    finally:
+        dupla.fechar_conexao()
+
+
+if __name__ == "__main__":
+    main()
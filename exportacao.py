@@ -0,0 +1,255 @@
+# BIBLIOTECA NECESSARIA P/ EXEC
+# pyarrow
+# pip install pyarrow
+
+"""Exportação colunar (Parquet ou Arrow IPC) para análise
+
+    python cli.py produtos exportar produtos.parquet --backend pg
+    python cli.py usuarios exportar usuarios.arrow --backend mongo
+    python SQL/bd.py enderecos exportar enderecos.parquet --copy-binario
+
+As linhas vêm em streaming de consultar() (cursor server-side no Postgres,
+cursor com batch_size no MongoDB) e são agrupadas em RecordBatches de `lote`
+linhas, gravados um a um: a memória fica em torno de um lote, seja qual for o
+tamanho da tabela. Cada lote vira um row group no Parquet, então lotes
+maiores dão arquivos melhores para leitura analítica.
+
+No Postgres, `copy_binario=True` usa COPY (...) TO STDOUT (FORMAT binary)
+(PostgresManager.exportar_copy), que evita a conversão de cada valor para
+texto e de volta; se alguma coluna tiver um tipo sem decodificador aqui, a
+exportação volta para o cursor.
+"""
+
+import struct
+from decimal import Decimal
+from itertools import islice
+
+from comum.consulta import Consulta
+from comum.inicializacao import ModuloPreguicoso
+
+pa = ModuloPreguicoso("pyarrow")
+
+TAMANHO_LOTE = 64 * 1024
+
+# tipo Arrow de cada campo lógico (ver comum/consulta.py); no MongoDB o mesmo
+# campo pode vir com tipos diferentes em cada documento, então os valores são
+# convertidos para o tipo da coluna
+ESQUEMAS = {
+    "usuarios": {"cpf": "string", "nome": "string", "email": "string"},
+    "produtos": {"id": "int64", "nome": "string", "valor": "float64", "quantidade": "int64"},
+    "enderecos": {"id": "int64", "rua": "string", "numero": "string", "bairro": "string",
+                  "cidade": "string", "cep": "string", "complemento": "string"}
+}
+
+_CONVERSORES = {"string": str, "int64": int, "float64": float}
+
+FORMATOS = {".parquet": "parquet", ".pq": "parquet", ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow"}
+
+
+def formato_pela_extensao(caminho):
+    for extensao, formato in FORMATOS.items():
+        if caminho.endswith(extensao):
+            return formato
+    return "parquet"
+
+
+def esquema(entidade, campos):
+    return pa.schema([(campo, getattr(pa, ESQUEMAS[entidade][campo])()) for campo in campos])
+
+
+def _lote_de_colunas(entidade, esquema_arrow, colunas):
+    """RecordBatch a partir de uma lista de valores por coluna, convertendo para o tipo do esquema"""
+    arrays = []
+    for campo, valores in zip(esquema_arrow, colunas):
+        converter = _CONVERSORES[ESQUEMAS[entidade][campo.name]]
+        arrays.append(pa.array([None if valor is None else converter(valor) for valor in valores],
+                               type=campo.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=esquema_arrow)
+
+
+def _abrir_escritor(caminho, formato, esquema_arrow, compressao):
+    if formato == "parquet":
+        return pa.parquet.ParquetWriter(caminho, esquema_arrow, compression=compressao or "snappy")
+    opcoes = pa.ipc.IpcWriteOptions(compression=compressao) if compressao else None
+    return pa.ipc.new_file(caminho, esquema_arrow, options=opcoes)
+
+
+# --- COPY binário --------------------------------------------------------
+
+_ASSINATURA_COPY = b"PGCOPY\n\xff\r\n\x00"
+
+
+def _numeric(dados):
+    """numeric no formato binário: dígitos em base 10000, peso do primeiro e sinal"""
+    ndigitos, peso, sinal, _ = struct.unpack_from("!hhHh", dados)
+    if sinal == 0xC000:
+        return Decimal("NaN")
+    inteiro = 0
+    for digito in struct.unpack_from(f"!{ndigitos}h", dados, 8):
+        inteiro = inteiro * 10000 + digito
+    return Decimal((sinal == 0x4000, tuple(map(int, str(inteiro))), (peso - ndigitos + 1) * 4))
+
+
+def _binario(formato):
+    estrutura = struct.Struct(formato)
+    return lambda dados: estrutura.unpack(dados)[0]
+
+
+def _texto(dados):
+    return dados.decode("utf-8")
+
+
+# OID do tipo no Postgres -> decodificador do valor binário
+DECODIFICADORES = {
+    16: lambda dados: dados != b"\x00",  # bool
+    20: _binario("!q"),                  # bigint
+    21: _binario("!h"),                  # smallint
+    23: _binario("!i"),                  # integer
+    700: _binario("!f"),                 # real
+    701: _binario("!d"),                 # double precision
+    1700: _numeric,                      # numeric
+    19: _texto,                          # name
+    25: _texto,                          # text
+    1042: _texto,                        # char(n)
+    1043: _texto                         # varchar
+}
+
+
+class DecodificadorCopyBinario:
+    """Recebe o fluxo do COPY ... (FORMAT binary) por write() e chama
+    ao_lote(colunas) a cada `lote` linhas (e no fim, em fechar())"""
+
+    def __init__(self, oids, lote, ao_lote):
+        faltando = [oid for oid in oids if oid not in DECODIFICADORES]
+        if faltando:
+            raise ValueError(f"Tipo(s) sem decodificador binário: OID {faltando}")
+        self.decodificadores = [DECODIFICADORES[oid] for oid in oids]
+        self.lote = lote
+        self.ao_lote = ao_lote
+        self._buffer = bytearray()
+        self._cabecalho_lido = False
+        self._colunas = [[] for _ in oids]
+        self._linhas = 0
+
+    def write(self, dados):
+        self._buffer += dados
+        posicao = 0
+        if not self._cabecalho_lido:
+            posicao = self._ler_cabecalho()
+            if not self._cabecalho_lido:
+                return len(dados)  # cabeçalho incompleto, espera o próximo write
+        buffer = self._buffer
+        while posicao + 2 <= len(buffer):
+            (quantidade,) = struct.unpack_from("!h", buffer, posicao)
+            if quantidade == -1:  # trailer
+                posicao += 2
+                break
+            valores, fim = self._ler_linha(buffer, posicao + 2, quantidade)
+            if valores is None:
+                break  # linha incompleta, espera o próximo write
+            for coluna, valor in zip(self._colunas, valores):
+                coluna.append(valor)
+            posicao = fim
+            self._linhas += 1
+            if self._linhas == self.lote:
+                self._entregar()
+        del buffer[:posicao]
+        return len(dados)
+
+    def _ler_cabecalho(self):
+        tamanho_fixo = len(_ASSINATURA_COPY) + 8
+        if len(self._buffer) < tamanho_fixo:
+            return 0
+        if not self._buffer.startswith(_ASSINATURA_COPY):
+            raise ValueError("Fluxo do COPY não está no formato binário")
+        (extensao,) = struct.unpack_from("!i", self._buffer, len(_ASSINATURA_COPY) + 4)
+        if len(self._buffer) < tamanho_fixo + extensao:
+            return 0
+        self._cabecalho_lido = True
+        return tamanho_fixo + extensao
+
+    def _ler_linha(self, buffer, posicao, quantidade):
+        valores = []
+        for decodificar in self.decodificadores[:quantidade]:
+            if posicao + 4 > len(buffer):
+                return None, posicao
+            (tamanho,) = struct.unpack_from("!i", buffer, posicao)
+            posicao += 4
+            if tamanho == -1:
+                valores.append(None)
+                continue
+            if posicao + tamanho > len(buffer):
+                return None, posicao
+            valores.append(decodificar(bytes(buffer[posicao:posicao + tamanho])))
+            posicao += tamanho
+        return valores, posicao
+
+    def _entregar(self):
+        if self._linhas:
+            self.ao_lote(self._colunas)
+            self._colunas = [[] for _ in self._colunas]
+            self._linhas = 0
+
+    def fechar(self):
+        self._entregar()
+
+
+# --- exportação ----------------------------------------------------------
+
+def _exportar_copy(manager, entidade, consulta, caminho, formato, lote, compressao, progresso):
+    """Caminho do COPY binário; devolve o total de linhas ou None se algum tipo não é suportado"""
+    estado = {"escritor": None, "decodificador": None, "linhas": 0}
+
+    def gravar(esquema_arrow, colunas):
+        estado["escritor"].write_batch(_lote_de_colunas(entidade, esquema_arrow, colunas))
+        estado["linhas"] += len(colunas[0])
+        if progresso:
+            progresso(estado["linhas"])
+
+    def criar_destino(campos, oids):
+        esquema_arrow = esquema(entidade, campos)
+        estado["decodificador"] = DecodificadorCopyBinario(
+            oids, lote, lambda colunas: gravar(esquema_arrow, colunas))
+        estado["escritor"] = _abrir_escritor(caminho, formato, esquema_arrow, compressao)
+        return estado["decodificador"]
+
+    try:
+        manager.exportar_copy(entidade, consulta, criar_destino)
+        estado["decodificador"].fechar()
+    except ValueError:
+        if estado["escritor"] is not None:
+            raise
+        return None  # tipo sem decodificador: nada foi gravado ainda
+    finally:
+        if estado["escritor"] is not None:
+            estado["escritor"].close()
+    return estado["linhas"]
+
+
+def exportar(manager, entidade, caminho, formato=None, consulta=None, lote=TAMANHO_LOTE,
+             copy_binario=False, compressao=None, progresso=None):
+    """Grava as linhas da Consulta (padrão: a entidade inteira) em Parquet ou Arrow IPC.
+
+    `progresso(linhas)` é chamado a cada lote gravado. Devolve o total de linhas."""
+    formato = formato or formato_pela_extensao(caminho)
+    consulta = consulta or Consulta()
+    if copy_binario and hasattr(manager, "exportar_copy"):
+        linhas = _exportar_copy(manager, entidade, consulta, caminho, formato, lote, compressao, progresso)
+        if linhas is not None:
+            return linhas
+
+    campos = consulta.campos_de(entidade)
+    esquema_arrow = esquema(entidade, campos)
+    registros = manager.consultar(entidade, consulta)
+    linhas = 0
+    with _abrir_escritor(caminho, formato, esquema_arrow, compressao) as escritor:
+        while True:
+            bloco = list(islice(registros, lote))
+            if not bloco:
+                break
+            colunas = [[registro[campo] for registro in bloco] for campo in campos]
+            escritor.write_batch(_lote_de_colunas(entidade, esquema_arrow, colunas))
+            linhas += len(bloco)
+            if progresso:
+                progresso(linhas)
+    return linhas
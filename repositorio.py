@@ -0,0 +1,332 @@
+"""Camada assíncrona de repositório com a mesma interface para Postgres e MongoDB
+
+Pensada para serviços que disparam muitas operações concorrentes a partir de
+um único event loop:
+
+    repo = PostgresRepositorio(DB_CONFIG)
+    async with repo:
+        ids = await asyncio.gather(*(repo.criar_produto(f"p{i}", 1.0, 1) for i in range(1000)))
+
+Diferente dos managers de SQL/bd.py e NOSQL/bdnosql.py, os métodos daqui não
+imprimem nada: devolvem o resultado e deixam as exceções do driver subirem.
+
+BIBLIOTECAS NECESSARIAS P/ EXEC
+# pip install asyncpg          (Postgres)
+# pip install "pymongo>=4.9"   (MongoDB; com versões antigas use motor)
+"""
+
+import asyncio
+import inspect
+import os
+from abc import ABC, abstractmethod
+
+BLOCO_IDS = int(os.getenv("DB_MONGO_BLOCO_IDS", "100"))
+TAMANHO_LOTE = 1000
+
+
+class Repositorio(ABC):
+    """Interface comum dos 12 CRUDs.
+
+    Usuários são identificados pelo CPF; produtos e endereços por um ID
+    inteiro. Leituras são geradores assíncronos de dicts, paginados por chave
+    (`after`) e com `limit` opcional. atualizar_* e deletar_* devolvem True se
+    o registro existia."""
+
+    async def __aenter__(self):
+        await self.conectar()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.fechar()
+
+    @abstractmethod
+    async def conectar(self): ...
+
+    @abstractmethod
+    async def fechar(self): ...
+
+    @abstractmethod
+    async def criar_usuario(self, cpf, nome, email): ...
+
+    @abstractmethod
+    def ler_usuarios(self, limit=None, after=None): ...
+
+    @abstractmethod
+    async def atualizar_usuario(self, cpf, nome=None, email=None): ...
+
+    @abstractmethod
+    async def deletar_usuario(self, cpf): ...
+
+    @abstractmethod
+    async def criar_produto(self, nome, valor, quantidade): ...
+
+    @abstractmethod
+    def ler_produtos(self, limit=None, after=None): ...
+
+    @abstractmethod
+    async def atualizar_produto(self, id_produto, valor): ...
+
+    @abstractmethod
+    async def deletar_produto(self, id_produto): ...
+
+    @abstractmethod
+    async def criar_endereco(self, rua, numero, bairro, cidade, cep, complemento): ...
+
+    @abstractmethod
+    def ler_enderecos(self, limit=None, after=None): ...
+
+    @abstractmethod
+    async def atualizar_endereco(self, id_endereco, rua, numero, complemento=None): ...
+
+    @abstractmethod
+    async def deletar_endereco(self, id_endereco): ...
+
+
+def _campos_preenchidos(**campos):
+    return {campo: valor for campo, valor in campos.items() if valor is not None}
+
+
+class PostgresRepositorio(Repositorio):
+    """Implementação com asyncpg; cada chamada pega uma conexão do pool"""
+
+    def __init__(self, config, min_size=1, max_size=10):
+        self.config = config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def conectar(self):
+        import asyncpg
+
+        porta = self.config.get("port")
+        self.pool = await asyncpg.create_pool(
+            database=self.config.get("dbname"),
+            user=self.config.get("user"),
+            password=self.config.get("password"),
+            host=self.config.get("host"),
+            port=int(porta) if porta else None,
+            min_size=self.min_size,
+            max_size=self.max_size
+        )
+
+    async def fechar(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    @staticmethod
+    def _afetou(status):
+        # asyncpg devolve o status do comando, ex. "UPDATE 1" / "DELETE 0"
+        return int(status.split()[-1]) > 0
+
+    async def _atualizar(self, tabela, chave, valor_chave, campos):
+        if not campos:
+            return False
+        sets = ", ".join(f"{campo} = ${n}" for n, campo in enumerate(campos, start=1))
+        sql = f"UPDATE {tabela} SET {sets} WHERE {chave} = ${len(campos) + 1};"
+        return self._afetou(await self.pool.execute(sql, *campos.values(), valor_chave))
+
+    async def _iterar(self, sql, chave, limit, after):
+        params = []
+        if after is not None:
+            params.append(after)
+            sql += f" WHERE {chave} > ${len(params)}"
+        sql += f" ORDER BY {chave}"
+        if limit is not None:
+            params.append(limit)
+            sql += f" LIMIT ${len(params)}"
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                async for linha in conn.cursor(sql, *params, prefetch=TAMANHO_LOTE):
+                    yield dict(linha)
+
+    async def criar_usuario(self, cpf, nome, email):
+        sql = """
+        INSERT INTO mydb.Usuario (cpf, nome, email, Dados_bancarios_idDados_bancarios)
+        VALUES ($1, $2, $3, 1) RETURNING cpf;
+        """
+        return await self.pool.fetchval(sql, cpf, nome, email)
+
+    def ler_usuarios(self, limit=None, after=None):
+        return self._iterar("SELECT cpf, nome, email FROM mydb.Usuario", "cpf", limit, after)
+
+    async def atualizar_usuario(self, cpf, nome=None, email=None):
+        return await self._atualizar("mydb.Usuario", "cpf", cpf,
+                                     _campos_preenchidos(nome=nome, email=email))
+
+    async def deletar_usuario(self, cpf):
+        return self._afetou(await self.pool.execute("DELETE FROM mydb.Usuario WHERE cpf = $1;", cpf))
+
+    async def criar_produto(self, nome, valor, quantidade):
+        sql = """
+        INSERT INTO mydb.Produto (nome, valor, quantidade, descricao, porcao_peso)
+        VALUES ($1, $2, $3, 'N/A', 0) RETURNING idProduto;
+        """
+        return await self.pool.fetchval(sql, nome, valor, quantidade)
+
+    def ler_produtos(self, limit=None, after=None):
+        return self._iterar("SELECT idProduto AS id, nome, valor, quantidade FROM mydb.Produto",
+                            "idProduto", limit, after)
+
+    async def atualizar_produto(self, id_produto, valor):
+        return await self._atualizar("mydb.Produto", "idProduto", id_produto, {"valor": valor})
+
+    async def deletar_produto(self, id_produto):
+        sql = "DELETE FROM mydb.Produto WHERE idProduto = $1;"
+        return self._afetou(await self.pool.execute(sql, id_produto))
+
+    async def criar_endereco(self, rua, numero, bairro, cidade, cep, complemento):
+        sql = """
+        INSERT INTO mydb.Endereco (rua, numero, bairo, cidade, cep, complemento)
+        VALUES ($1, $2, $3, $4, $5, $6) RETURNING idEndereco;
+        """
+        return await self.pool.fetchval(sql, rua, numero, bairro, cidade, cep, complemento)
+
+    def ler_enderecos(self, limit=None, after=None):
+        sql = """SELECT idEndereco AS id, rua, numero, bairo AS bairro, cidade, cep, complemento
+        FROM mydb.Endereco"""
+        return self._iterar(sql, "idEndereco", limit, after)
+
+    async def atualizar_endereco(self, id_endereco, rua, numero, complemento=None):
+        return await self._atualizar("mydb.Endereco", "idEndereco", id_endereco,
+                                     _campos_preenchidos(rua=rua, numero=numero, complemento=complemento))
+
+    async def deletar_endereco(self, id_endereco):
+        sql = "DELETE FROM mydb.Endereco WHERE idEndereco = $1;"
+        return self._afetou(await self.pool.execute(sql, id_endereco))
+
+
+class _AlocadorSequenciaAsync:
+    """Versão assíncrona do AlocadorSequencia de NOSQL/bdnosql.py (mesmo contador)"""
+
+    def __init__(self, banco, tamanho_bloco):
+        self.banco = banco
+        self.tamanho_bloco = max(1, tamanho_bloco)
+        self._blocos = {}
+        self._lock = asyncio.Lock()
+
+    async def proximo(self, colecao):
+        from pymongo import ReturnDocument
+
+        async with self._lock:
+            proximo, limite = self._blocos.get(colecao, (0, 0))
+            if proximo >= limite:
+                counter = await self.banco.counters.find_one_and_update(
+                    {'_id': colecao},
+                    {'$inc': {'seq': self.tamanho_bloco}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                limite = counter['seq'] + 1
+                proximo = limite - self.tamanho_bloco
+            self._blocos[colecao] = (proximo + 1, limite)
+            return proximo
+
+
+def _cliente_mongo_async(uri):
+    try:
+        from pymongo import AsyncMongoClient
+    except ImportError:
+        from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+    return AsyncMongoClient(uri)
+
+
+class MongoRepositorio(Repositorio):
+    """Implementação com o cliente assíncrono do pymongo (ou motor)"""
+
+    def __init__(self, uri, bloco_ids=BLOCO_IDS):
+        self.uri = uri
+        self.bloco_ids = bloco_ids
+        self.cliente = None
+        self.banco = None
+        self.ids = None
+
+    async def conectar(self):
+        self.cliente = _cliente_mongo_async(self.uri)
+        await self.cliente.admin.command('ping')
+        self.banco = self.cliente.sistema
+        self.ids = _AlocadorSequenciaAsync(self.banco, self.bloco_ids)
+
+    async def fechar(self):
+        if self.cliente:
+            # AsyncMongoClient.close() é corrotina, o do motor não
+            fechou = self.cliente.close()
+            if inspect.isawaitable(fechou):
+                await fechou
+            self.cliente = None
+
+    async def _iterar(self, colecao, chave, limit, after):
+        filtro = {} if after is None else {"_id": {"$gt": after}}
+        cursor = colecao.find(filtro).sort("_id", 1).batch_size(TAMANHO_LOTE)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        async for documento in cursor:
+            documento[chave] = documento.pop("_id")
+            yield documento
+
+    async def criar_usuario(self, cpf, nome, email):
+        await self.banco.usuarios.insert_one({"_id": cpf, "nome": nome, "email": email})
+        return cpf
+
+    def ler_usuarios(self, limit=None, after=None):
+        return self._iterar(self.banco.usuarios, "cpf", limit, after)
+
+    async def atualizar_usuario(self, cpf, nome=None, email=None):
+        campos = _campos_preenchidos(nome=nome, email=email)
+        if not campos:
+            return False
+        result = await self.banco.usuarios.update_one({"_id": cpf}, {"$set": campos})
+        return result.matched_count > 0
+
+    async def deletar_usuario(self, cpf):
+        result = await self.banco.usuarios.delete_one({"_id": cpf})
+        return result.deleted_count > 0
+
+    async def criar_produto(self, nome, valor, quantidade):
+        id_produto = await self.ids.proximo('produtos')
+        await self.banco.produtos.insert_one({
+            "_id": id_produto,
+            "nome": nome,
+            "valor": float(valor),
+            "quantidade": int(quantidade)
+        })
+        return id_produto
+
+    def ler_produtos(self, limit=None, after=None):
+        return self._iterar(self.banco.produtos, "id", limit, after)
+
+    async def atualizar_produto(self, id_produto, valor):
+        result = await self.banco.produtos.update_one(
+            {"_id": int(id_produto)}, {"$set": {"valor": float(valor)}})
+        return result.matched_count > 0
+
+    async def deletar_produto(self, id_produto):
+        result = await self.banco.produtos.delete_one({"_id": int(id_produto)})
+        return result.deleted_count > 0
+
+    async def criar_endereco(self, rua, numero, bairro, cidade, cep, complemento):
+        id_endereco = await self.ids.proximo('enderecos')
+        await self.banco.enderecos.insert_one({
+            "_id": id_endereco,
+            "rua": rua,
+            "numero": numero,
+            "bairro": bairro,
+            "cidade": cidade,
+            "cep": cep,
+            "complemento": complemento
+        })
+        return id_endereco
+
+    def ler_enderecos(self, limit=None, after=None):
+        return self._iterar(self.banco.enderecos, "id", limit, after)
+
+    async def atualizar_endereco(self, id_endereco, rua, numero, complemento=None):
+        campos = _campos_preenchidos(rua=rua, numero=numero, complemento=complemento)
+        if not campos:
+            return False
+        result = await self.banco.enderecos.update_one({"_id": int(id_endereco)}, {"$set": campos})
+        return result.matched_count > 0
+
+    async def deletar_endereco(self, id_endereco):
+        result = await self.banco.enderecos.delete_one({"_id": int(id_endereco)})
+        return result.deleted_count > 0
@@ -0,0 +1,251 @@
+"""Sincronização Postgres (mydb.*) -> MongoDB (sistema)
+
+    python sync.py instalar          # cria a fila mydb.sync_fila e os triggers
+    python sync.py copiar            # cópia inicial completa (retoma de onde parou)
+    python sync.py seguir            # aplica as alterações continuamente
+    python sync.py seguir --uma-vez  # esvazia a fila e sai
+
+Os triggers registram cada INSERT/UPDATE/DELETE como (tabela, chave) em
+mydb.sync_fila e avisam via NOTIFY. O `seguir` lê a fila em lotes, busca o
+estado atual de cada chave no Postgres e aplica no MongoDB como upsert (ou
+delete, se a linha não existe mais) num bulk_write. Só depois apaga as
+entradas da fila, então a própria fila é o checkpoint: se o processo cair,
+o lote é reaplicado (as escritas são idempotentes). Rode `instalar` antes do
+`copiar` para que nada escrito durante a cópia se perca.
+"""
+
+import argparse
+import select
+import time
+
+import psycopg2
+import psycopg2.extensions
+from pymongo import DeleteOne, ReplaceOne
+
+from SQL.bd import PostgresManager, DB_CONFIG, POOL_CONFIG
+from NOSQL.bdnosql import MongoManager, MONGO_URI
+from comum.inicializacao import conectar_em_paralelo
+
+CANAL = "sync_mydb"
+TAMANHO_LOTE = 1000
+
+SQL_INSTALAR = """
+CREATE TABLE IF NOT EXISTS mydb.sync_fila (
+    id bigserial PRIMARY KEY,
+    tabela text NOT NULL,
+    chave text NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION mydb.sync_registrar() RETURNS trigger AS $$
+DECLARE
+    chave text;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        chave := to_jsonb(OLD) ->> TG_ARGV[0];
+    ELSE
+        chave := to_jsonb(NEW) ->> TG_ARGV[0];
+    END IF;
+    INSERT INTO mydb.sync_fila (tabela, chave) VALUES (TG_TABLE_NAME, chave);
+    -- mudança de chave primária: a chave antiga também precisa sair do MongoDB
+    IF TG_OP = 'UPDATE' AND (to_jsonb(OLD) ->> TG_ARGV[0]) IS DISTINCT FROM chave THEN
+        INSERT INTO mydb.sync_fila (tabela, chave) VALUES (TG_TABLE_NAME, to_jsonb(OLD) ->> TG_ARGV[0]);
+    END IF;
+    PERFORM pg_notify('sync_mydb', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sync_usuario ON mydb.Usuario;
+CREATE TRIGGER sync_usuario AFTER INSERT OR UPDATE OR DELETE ON mydb.Usuario
+    FOR EACH ROW EXECUTE FUNCTION mydb.sync_registrar('cpf');
+
+DROP TRIGGER IF EXISTS sync_produto ON mydb.Produto;
+CREATE TRIGGER sync_produto AFTER INSERT OR UPDATE OR DELETE ON mydb.Produto
+    FOR EACH ROW EXECUTE FUNCTION mydb.sync_registrar('idproduto');
+
+DROP TRIGGER IF EXISTS sync_endereco ON mydb.Endereco;
+CREATE TRIGGER sync_endereco AFTER INSERT OR UPDATE OR DELETE ON mydb.Endereco
+    FOR EACH ROW EXECUTE FUNCTION mydb.sync_registrar('idendereco');
+"""
+
+
+def _usuario(linha):
+    cpf, nome, email = linha
+    return {"_id": cpf, "nome": nome, "email": email}
+
+
+def _produto(linha):
+    id_produto, nome, valor, quantidade = linha
+    return {"_id": id_produto, "nome": nome, "valor": float(valor), "quantidade": quantidade}
+
+
+def _endereco(linha):
+    id_endereco, rua, numero, bairo, cidade, cep, complemento = linha
+    return {"_id": id_endereco, "rua": rua, "numero": numero, "bairro": bairo,
+            "cidade": cidade, "cep": cep, "complemento": complemento}
+
+
+# tabela do trigger (TG_TABLE_NAME) -> como ler no Postgres e gravar no MongoDB
+TABELAS = {
+    "usuario": {
+        "colecao": "usuarios",
+        "select": "SELECT cpf, nome, email FROM mydb.Usuario",
+        "chave": "cpf",
+        "tipo": str,
+        "documento": _usuario
+    },
+    "produto": {
+        "colecao": "produtos",
+        "select": "SELECT idProduto, nome, valor, quantidade FROM mydb.Produto",
+        "chave": "idProduto",
+        "tipo": int,
+        "documento": _produto
+    },
+    "endereco": {
+        "colecao": "enderecos",
+        "select": "SELECT idEndereco, rua, numero, bairo, cidade, cep, complemento FROM mydb.Endereco",
+        "chave": "idEndereco",
+        "tipo": int,
+        "documento": _endereco
+    }
+}
+
+
+class Sincronizador:
+    def __init__(self, pg_manager, mongo_manager, tamanho_lote=TAMANHO_LOTE):
+        self.pg = pg_manager
+        self.mongo = mongo_manager
+        self.tamanho_lote = tamanho_lote
+        self.estado = mongo_manager.banco.sync_estado  # checkpoint da cópia inicial
+
+    def instalar(self):
+        with self.pg._cursor() as cursor:
+            cursor.execute(SQL_INSTALAR)
+        print("Fila e triggers de sincronização instalados")
+
+    def _ajustar_contador(self, colecao, documentos):
+        # IDs vindos do Postgres não podem ser entregues de novo pelo get_next_sequence
+        ids = [doc["_id"] for doc in documentos if isinstance(doc["_id"], int)]
+        if ids:
+            self.mongo.banco.counters.update_one({"_id": colecao}, {"$max": {"seq": max(ids)}}, upsert=True)
+
+    def copiar(self):
+        """Cópia completa em streaming (cursor server-side), em lotes de upserts.
+
+        O último ID copiado de cada tabela fica em sync_estado, então uma cópia
+        interrompida continua de onde parou; `--do-zero` recomeça."""
+        for tabela, info in TABELAS.items():
+            checkpoint = self.estado.find_one({"_id": f"copia:{tabela}"}) or {}
+            if checkpoint.get("concluida"):
+                print(f"{tabela}: já copiada")
+                continue
+            colecao = self.mongo.banco[info["colecao"]]
+            linhas = self.pg._iterar(info["select"], info["chave"], None,
+                                     checkpoint.get("ultima_chave"), self.tamanho_lote)
+            total, inicio = 0, time.perf_counter()
+            lote = []
+            for linha in linhas:
+                lote.append(info["documento"](linha))
+                if len(lote) >= self.tamanho_lote:
+                    total += self._gravar_copia(tabela, colecao, lote)
+                    lote = []
+            if lote:
+                total += self._gravar_copia(tabela, colecao, lote)
+            self.estado.update_one({"_id": f"copia:{tabela}"}, {"$set": {"concluida": True}}, upsert=True)
+            duracao = time.perf_counter() - inicio
+            print(f"{tabela}: {total} linha(s) copiada(s) em {duracao:.1f}s")
+
+    def _gravar_copia(self, tabela, colecao, documentos):
+        colecao.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documentos],
+                           ordered=False)
+        self._ajustar_contador(colecao.name, documentos)
+        self.estado.update_one({"_id": f"copia:{tabela}"},
+                               {"$set": {"ultima_chave": documentos[-1]["_id"]}}, upsert=True)
+        return len(documentos)
+
+    def reiniciar_copia(self):
+        self.estado.delete_many({"_id": {"$regex": "^copia:"}})
+
+    def aplicar_lote(self):
+        """Aplica até tamanho_lote entradas da fila; devolve quantas foram consumidas"""
+        with self.pg._cursor() as cursor:
+            cursor.execute("SELECT id, tabela, chave FROM mydb.sync_fila ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED;",
+                           (self.tamanho_lote,))
+            entradas = cursor.fetchall()
+            if not entradas:
+                return 0
+            chaves_por_tabela = {}
+            for _, tabela, chave in entradas:
+                if tabela in TABELAS:
+                    chaves_por_tabela.setdefault(tabela, set()).add(TABELAS[tabela]["tipo"](chave))
+            for tabela, chaves in chaves_por_tabela.items():
+                info = TABELAS[tabela]
+                cursor.execute(f"{info['select']} WHERE {info['chave']} = ANY(%s);", (list(chaves),))
+                documentos = [info["documento"](linha) for linha in cursor.fetchall()]
+                existentes = {doc["_id"] for doc in documentos}
+                operacoes = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documentos]
+                operacoes += [DeleteOne({"_id": chave}) for chave in chaves - existentes]
+                self.mongo.banco[info["colecao"]].bulk_write(operacoes, ordered=False)
+                self._ajustar_contador(info["colecao"], documentos)
+            # só sai da fila depois de aplicado; se cair antes, o lote é reaplicado
+            cursor.execute("DELETE FROM mydb.sync_fila WHERE id = ANY(%s);", ([e[0] for e in entradas],))
+        return len(entradas)
+
+    def seguir(self, uma_vez=False, espera=5.0):
+        """Esvazia a fila e, sem `uma_vez`, fica esperando NOTIFY por novas alterações"""
+        ouvinte = None
+        if not uma_vez:
+            ouvinte = psycopg2.connect(**self.pg.config)
+            ouvinte.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with ouvinte.cursor() as cursor:
+                cursor.execute(f"LISTEN {CANAL};")
+        aplicadas, inicio = 0, time.perf_counter()
+        try:
+            while True:
+                consumidas = self.aplicar_lote()
+                aplicadas += consumidas
+                if consumidas:
+                    continue
+                print(f"{aplicadas} alteração(ões) aplicada(s) em {time.perf_counter() - inicio:.1f}s")
+                if uma_vez:
+                    return aplicadas
+                # fila vazia: dorme até um NOTIFY (ou até `espera`, por segurança)
+                if select.select([ouvinte], [], [], espera)[0]:
+                    ouvinte.poll()
+                    ouvinte.notifies.clear()
+        finally:
+            if ouvinte:
+                ouvinte.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincroniza mydb.* (Postgres) com sistema (MongoDB)")
+    parser.add_argument("comando", choices=["instalar", "copiar", "seguir"])
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE)
+    parser.add_argument("--uma-vez", action="store_true", help="seguir: esvazia a fila e sai")
+    parser.add_argument("--do-zero", action="store_true", help="copiar: ignora o checkpoint da cópia")
+    args = parser.parse_args()
+
+    pg_manager = PostgresManager(DB_CONFIG, POOL_CONFIG)
+    mongo_manager = MongoManager(MONGO_URI)
+    try:
+        # os dois handshakes (TCP/TLS, autenticação, ping) correm ao mesmo tempo
+        conectar_em_paralelo(pg_manager, mongo_manager)
+        sincronizador = Sincronizador(pg_manager, mongo_manager, args.lote)
+        if args.comando == "instalar":
+            sincronizador.instalar()
+        elif args.comando == "copiar":
+            if args.do_zero:
+                sincronizador.reiniciar_copia()
+            sincronizador.copiar()
+        else:
+            sincronizador.seguir(args.uma_vez)
+    except KeyboardInterrupt:
+        print("Interrompido")
+    finally:
+        mongo_manager.fechar_conexao()
+        pg_manager.fechar_conexao()
+
+
+if __name__ == "__main__":
+    main()